@@ -0,0 +1,298 @@
+# Benchmarks of the topology helpers on synthetic stand-in environments (no grid2op needed).
+# The stand-ins carry the same arrays as a grid2op environment (sub_info, n_line, *_to_subid,
+# *_to_sub_pos, ...), at IEEE-14, 118-bus and ~1000-bus scales, plus random meshed grids.
+# Results are saved as JSON, so that a later run can be compared against them (regressions).
+#
+# Usage:
+#   python BenchmarkHelpers.py --output benchmark_baseline.json
+#   python BenchmarkHelpers.py --grids ieee14 random60 --compare benchmark_baseline.json
+# (benchmark_baseline.json in this directory is a reference run; timings depend on the machine.)
+
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import time
+import numpy as np
+
+import CommonHelpers
+import TopologyHelpers
+import Substation
+import SweepHelpers
+
+# Increment this if the benchmarks change, so that old baselines are not compared to new ones.
+#  - 2: BuildSubstations is timed with warm=True, and BuildSubstations.lazy is added
+BENCHMARK_VERSION = 2
+
+class SyntheticEnv :
+
+    # Minimal stand-in for a grid2op environment: only the arrays that the helpers read.
+    # Elements are placed in each substation in the order: loads, generators, line origins,
+    # line extremities (the *_to_sub_pos arrays).
+
+    def __init__(self,name,n_sub,lines,gen_to_subid,load_to_subid) :
+        self.name = name
+        self.n_sub = n_sub
+        self.n_line = len(lines)
+        self.n_gen = len(gen_to_subid)
+        self.n_load = len(load_to_subid)
+        self.line_or_to_subid = np.array(list(a for a,b in lines),dtype=np.int64)
+        self.line_ex_to_subid = np.array(list(b for a,b in lines),dtype=np.int64)
+        self.gen_to_subid = np.array(gen_to_subid,dtype=np.int64)
+        self.load_to_subid = np.array(load_to_subid,dtype=np.int64)
+
+        n_elements = [0]*n_sub
+        def Positions(subids) :
+            positions = []
+            for sub in subids :
+                positions.append(n_elements[sub])
+                n_elements[sub] += 1
+            return np.array(positions,dtype=np.int64)
+
+        self.load_to_sub_pos = Positions(self.load_to_subid)
+        self.gen_to_sub_pos = Positions(self.gen_to_subid)
+        self.line_or_to_sub_pos = Positions(self.line_or_to_subid)
+        self.line_ex_to_sub_pos = Positions(self.line_ex_to_subid)
+        self.sub_info = np.array(n_elements,dtype=np.int64)
+        self.dim_topo = int(self.sub_info.sum())
+
+        sub_start = np.concatenate([[0],np.cumsum(self.sub_info)[:-1]])
+        self.load_pos_topo_vect = sub_start[self.load_to_subid] + self.load_to_sub_pos
+        self.gen_pos_topo_vect = sub_start[self.gen_to_subid] + self.gen_to_sub_pos
+        self.line_or_pos_topo_vect = sub_start[self.line_or_to_subid] + self.line_or_to_sub_pos
+        self.line_ex_pos_topo_vect = sub_start[self.line_ex_to_subid] + self.line_ex_to_sub_pos
+
+
+def MakeIEEE14Env() :
+    # The IEEE 14-bus case (branches, generators and loads as in grid2op's l2rpn_case14_sandbox)
+    lines = [(0,1),(0,4),(1,2),(1,3),(1,4),(2,3),(3,4),(3,6),(3,8),(4,5),
+             (5,10),(5,11),(5,12),(6,7),(6,8),(8,9),(8,13),(9,10),(11,12),(12,13)]
+    gens = [1,2,5,7,0]
+    loads = [1,2,3,4,5,8,9,10,11,12,13]
+    return SyntheticEnv('ieee14',14,lines,gens,loads)
+
+
+def MakeRandomMeshedEnv(n_sub,n_line,n_gen,n_load,seed=0,max_elements=10,locality=10,name=None) :
+    # A random connected, meshed grid: a random spanning tree plus extra lines, each line going
+    # to one of the "locality" previous substations (so the grid is sparse and local, like a
+    # real one). No substation gets more than max_elements elements, since the validity tables
+    # of BuildSubstations grow as 2^n_elements.
+    rng = random.Random(seed)
+    n_elements = [0]*n_sub
+    lines = []
+    existing = set()
+
+    def TryAdd(a,b) :
+        if a == b or (min(a,b),max(a,b)) in existing :
+            return False
+        if n_elements[a] >= max_elements or n_elements[b] >= max_elements :
+            return False
+        lines.append((a,b))
+        existing.add((min(a,b),max(a,b)))
+        n_elements[a] += 1
+        n_elements[b] += 1
+        return True
+
+    for b in range(1,n_sub) :
+        candidates = list(range(max(0,b-locality),b))
+        rng.shuffle(candidates)
+        if not any(TryAdd(a,b) for a in candidates) :
+            # All the neighbors are full: connect to any substation with room
+            TryAdd(min((a for a in range(b) if n_elements[a] < max_elements),key=lambda a : b-a),b)
+
+    n_tries = 0
+    while len(lines) < n_line and n_tries < 100*n_line :
+        n_tries += 1
+        b = rng.randrange(1,n_sub)
+        TryAdd(rng.randrange(max(0,b-locality),b),b)
+
+    def PlaceExternals(n) :
+        subids = []
+        for i in range(n) :
+            room = list(s for s in range(n_sub) if n_elements[s] < max_elements)
+            if not room :
+                break
+            sub = rng.choice(room)
+            n_elements[sub] += 1
+            subids.append(sub)
+        return subids
+
+    gens = PlaceExternals(n_gen)
+    loads = PlaceExternals(n_load)
+    if name is None :
+        name = 'random{}'.format(n_sub)
+    return SyntheticEnv(name,n_sub,lines,gens,loads)
+
+
+def MakeBenchmarkEnv(name) :
+    # Grid names: ieee14, ieee118 (a synthetic grid at the size of the IEEE 118-bus case:
+    # 118 substations, 186 lines, 54 generators, 99 loads), grid1000 (~1000 buses), and
+    # randomN (a random meshed grid with N substations).
+    if name == 'ieee14' :
+        return MakeIEEE14Env()
+    if name == 'ieee118' :
+        return MakeRandomMeshedEnv(118,186,54,99,seed=118,name=name)
+    if name == 'grid1000' :
+        return MakeRandomMeshedEnv(1000,1500,300,700,seed=1000,name=name)
+    if name.startswith('random') :
+        n_sub = int(name[len('random'):])
+        return MakeRandomMeshedEnv(n_sub,int(1.4*n_sub),n_sub//3,2*n_sub//3,seed=n_sub,name=name)
+    print('Error -- unknown benchmark grid {}'.format(name))
+    return None
+
+
+def TimeIt(func,repeats=3,number=1) :
+    # Best and median time (seconds) of one call, over repeats of number calls.
+    times = []
+    for i in range(repeats) :
+        start = time.perf_counter()
+        for j in range(number) :
+            func()
+        times.append((time.perf_counter() - start)/number)
+    return {'seconds' : min(times),'median_seconds' : float(np.median(times)),
+            'repeats' : repeats,'number' : number}
+
+
+def RunBenchmarks(_env,repeats=3,max_sweep_lines=20,n_sweep_samples=2000,verbose=False) :
+    # Time the helpers on one environment. Returns a dict of benchmark name -> timing dict.
+    results = dict()
+
+    def Record(name,timing) :
+        results[name] = timing
+        if verbose :
+            print('  {:<40} {:12.6f} s'.format(name,timing['seconds']))
+
+    Record('MakeAdjacencyMatrix',TimeIt(lambda : TopologyHelpers.MakeAdjacencyMatrix(_env),repeats))
+
+    adj = TopologyHelpers.AdjacencyMatrixClass(_env)
+    Record('GetDisjointSets',TimeIt(adj.GetDisjointSets,repeats))
+
+    lap = TopologyHelpers.MakeLaplacian(_env,n_buses=1,skipExternals=True)
+    Record('IsConnectedLaplacianEigenvalue',TimeIt(lambda : TopologyHelpers.IsConnectedLaplacianEigenvalue(lap),repeats))
+
+    # A fresh validity table store each time, so that the tables are really built (warm=True: the
+    # tables are otherwise only built on first use; the lazy construction is timed separately)
+    Record('BuildSubstations',TimeIt(lambda : Substation.BuildSubstations(_env,warm=True),repeats))
+    Record('BuildSubstations.lazy',TimeIt(lambda : Substation.BuildSubstations(_env),repeats))
+
+    # IsValidBooleanBusState: every valid bus state of every substation, all lines on and with
+    # one random line off. Timed per call.
+    sub_classes = Substation.BuildSubstations(_env)
+    rng = random.Random(0)
+    all_on = CommonHelpers.FullyConnectedBitset(_env.n_line)
+    line_bitsets = [all_on,all_on - (0b1 << rng.randrange(_env.n_line))]
+    calls = list((sub,bits,lineOnBits) for sub in sub_classes for bits in sub.GetValidBusStates()
+                 for lineOnBits in line_bitsets)
+
+    def CheckAll() :
+        for sub,bits,lineOnBits in calls :
+            sub.SetBusConfig(bits)
+            sub.IsValidBooleanBusState(lineOnBits=lineOnBits)
+
+    timing = TimeIt(CheckAll,repeats)
+    for sub in sub_classes :
+        sub.ResetBusConfig()
+    timing['n_calls'] = len(calls)
+    timing['seconds_per_call'] = timing['seconds']/max(1,len(calls))
+    Record('IsValidBooleanBusState',timing)
+
+    # Line-bitset sweep: the connectivity check rate on random bitsets (this is what the sweep
+    # does for every bitset it cannot prune), and the full sweep if it is small enough.
+    builder = TopologyHelpers.AdjacencyMatrixBuilder(_env,n_buses=1,skipExternals=True)
+    samples = list(rng.getrandbits(_env.n_line) for i in range(n_sweep_samples))
+
+    def CheckSamples() :
+        for bits in samples :
+            builder.IsConnected(bits)
+
+    timing = TimeIt(CheckSamples,repeats)
+    timing['n_bitsets'] = n_sweep_samples
+    timing['bitsets_per_second'] = n_sweep_samples/timing['seconds']
+    # Upper bound for a full sweep (no pruning at all), to judge which grid sizes are feasible.
+    # (As log10, since 2^n_line overflows a float for large grids.)
+    timing['log10_estimated_full_sweep_seconds'] = _env.n_line*np.log10(2.) - np.log10(timing['bitsets_per_second'])
+    Record('SweepConnectivityCheck',timing)
+
+    if _env.n_line <= max_sweep_lines :
+        Record('FindConnectedAndUnconnectedBitsets',
+               TimeIt(lambda : SweepHelpers.FindConnectedAndUnconnectedBitsets(_env,n_workers=1,keep_connected_bitsets=False),1))
+
+    return results
+
+
+def RunBenchmarkSuite(grid_names=['ieee14','ieee118','grid1000','random60'],repeats=3,max_sweep_lines=20,verbose=True) :
+    # Run the benchmarks on every grid. Returns the machine-readable result (see SaveBaseline).
+    suite = dict()
+    suite['version'] = BENCHMARK_VERSION
+    suite['python'] = sys.version.split()[0]
+    suite['numpy'] = np.__version__
+    suite['platform'] = platform.platform()
+    suite['grids'] = dict()
+    suite['results'] = dict()
+
+    for name in grid_names :
+        _env = MakeBenchmarkEnv(name)
+        if _env is None :
+            continue
+        suite['grids'][name] = {'n_sub' : _env.n_sub,'n_line' : _env.n_line,'n_gen' : _env.n_gen,
+                                'n_load' : _env.n_load,'max_elements' : int(_env.sub_info.max())}
+        if verbose :
+            print('{}: {} substations, {} lines'.format(name,_env.n_sub,_env.n_line))
+        suite['results'][name] = RunBenchmarks(_env,repeats=repeats,max_sweep_lines=max_sweep_lines,verbose=verbose)
+
+    return suite
+
+
+def SaveBaseline(suite,filename) :
+    with open(filename,'w') as f :
+        json.dump(suite,f,indent=1,sort_keys=True)
+    return
+
+
+def LoadBaseline(filename) :
+    with open(filename) as f :
+        return json.load(f)
+
+
+def CompareToBaseline(suite,baseline,tolerance=1.25,verbose=True) :
+    # Compare the best times with a baseline. Returns a list of (grid,benchmark,ratio) for every
+    # benchmark that is slower than the baseline by more than the tolerance factor.
+    if baseline.get('version') != suite.get('version') :
+        print('Warning: the baseline is from benchmark version {}, this is version {}.'.format(baseline.get('version'),
+                                                                                              suite.get('version')))
+    regressions = []
+    for grid,results in suite['results'].items() :
+        for name,timing in results.items() :
+            if name not in baseline['results'].get(grid,dict()) :
+                continue
+            ratio = timing['seconds']/baseline['results'][grid][name]['seconds']
+            flag = ''
+            if ratio > tolerance :
+                regressions.append((grid,name,ratio))
+                flag = '  <-- slower'
+            if verbose :
+                print('{:<10} {:<40} x{:6.2f}{}'.format(grid,name,ratio,flag))
+    return regressions
+
+
+if __name__ == '__main__' :
+    parser = argparse.ArgumentParser(description='Benchmark the topology helpers on synthetic grids.')
+    parser.add_argument('--grids',nargs='+',default=['ieee14','ieee118','grid1000','random60'],
+                        help='ieee14, ieee118, grid1000, or randomN (N substations)')
+    parser.add_argument('--repeats',type=int,default=3)
+    parser.add_argument('--max-sweep-lines',type=int,default=20,
+                        help='run the full line-bitset sweep for grids with at most this many lines')
+    parser.add_argument('--output',help='save the results (JSON) to this file')
+    parser.add_argument('--compare',help='compare the results to this baseline (JSON)')
+    parser.add_argument('--tolerance',type=float,default=1.25)
+    args = parser.parse_args()
+
+    suite = RunBenchmarkSuite(args.grids,repeats=args.repeats,max_sweep_lines=args.max_sweep_lines)
+    if args.output :
+        SaveBaseline(suite,args.output)
+    if args.compare and os.path.exists(args.compare) :
+        regressions = CompareToBaseline(suite,LoadBaseline(args.compare),tolerance=args.tolerance)
+        if regressions :
+            sys.exit(1)
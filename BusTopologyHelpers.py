@@ -2,6 +2,8 @@
 # Module for imposing bus rules, given a bitset representation.
 
 import CommonHelpers
+import InstrumentationHelpers
+import numpy as np
 
 def RemoveBitFromFlag(flag,bit_to_remove,verbose=False) :
     # Remove a bit (count starting from 0)
@@ -31,7 +33,10 @@ def IsValidBooleanBusState(flag,nbits,i_gens=[],i_loads=[],items_disconnected=[]
     #  - To impose (c), we require that a disconnected line be on bus "1" instead of bus "0".
     #    In the case a disconnected line is on bus "0", we consider it a duplicate option.
     #    This is just a simplifying convention.
-    
+
+    if InstrumentationHelpers.enabled :
+        InstrumentationHelpers.Count('BusTopologyHelpers.IsValidBooleanBusState.calls')
+
     flag_str = "{:0{}b}".format(flag,nbits)
     #print(flag_str)
     n_ones = flag_str.count('1')
@@ -80,3 +85,139 @@ def IsValidBooleanBusState(flag,nbits,i_gens=[],i_loads=[],items_disconnected=[]
             return False
     
     return True
+
+
+def RemoveBitFromFlags(flags,bits_to_remove) :
+    # Batch version of RemoveBitFromFlag, on an array of (uint64) flags.
+    # bits_to_remove is an array of bit positions (one per flag); a negative position means
+    # that nothing is removed from that flag. The bits above the removed bit shift down by one.
+    flags = np.asarray(flags,dtype=np.uint64)
+    bits_to_remove = np.asarray(bits_to_remove,dtype=np.int64)
+    remove = (bits_to_remove >= 0)
+    bit = np.where(remove,bits_to_remove,0).astype(np.uint64)
+
+    bits_below = flags & ((np.uint64(1) << bit) - np.uint64(1))
+    bits_above = (flags >> (bit + np.uint64(1))) << bit
+    return np.where(remove,bits_above | bits_below,flags)
+
+
+def IsValidBooleanBusStateBatch(flags,nbits,gen_mask=0,load_mask=0,disconnected_mask=0) :
+    # Batch, string-free version of IsValidBooleanBusState.
+    # flags is an array of bus states (uint64, each < 2^nbits). The generator, load and disconnected
+    # masks have a bit set for each local index, and can be scalars or arrays (one per flag).
+    # Returns a boolean array, in exact agreement with IsValidBooleanBusState.
+    flags = np.asarray(flags,dtype=np.uint64)
+    externals = np.asarray(gen_mask,dtype=np.uint64) | np.asarray(load_mask,dtype=np.uint64)
+    disconnected = np.asarray(disconnected_mask,dtype=np.uint64)
+    flags,externals,disconnected = np.broadcast_arrays(flags,externals,disconnected)
+
+    all_on = np.uint64(CommonHelpers.FullyConnectedBitset(nbits))
+    n_ones = CommonHelpers.Popcount(flags)
+    n_zeros = nbits - n_ones
+
+    # By convention, the leading item must be on bus "1" (to remove 1 <--> 0 symmetry duplicates)
+    valid = (flags & np.uint64(0b1 << (nbits-1))) != 0
+
+    # You cannot have a single line on a bus
+    if nbits > 1 :
+        valid &= (n_ones != 1) & (n_zeros != 1)
+
+    # Generators or loads (externals) must not be islanded, i.e. one bus cannot only contain
+    # externals and disconnected lines.
+    not_isolating = ~(externals | disconnected)
+    flags_inverted = all_on - flags
+    valid &= ~((flags != 0) & ((flags & not_isolating) == 0))
+    valid &= ~((flags_inverted != 0) & ((flags_inverted & not_isolating) == 0))
+
+    # If lines are disconnected, then by convention they must be set to bus "1" here
+    valid &= (flags & disconnected) == disconnected
+
+    # Delete the disconnected bits one at a time (highest first) and check that the remaining bits
+    # are valid, as in the recursion of IsValidBooleanBusState.
+    reduced_flags = flags
+    reduced_nbits = np.full(flags.shape,nbits,dtype=np.int64)
+    reduced_ones = n_ones
+    for item in range(nbits-1,-1,-1) :
+        removing = (disconnected & np.uint64(0b1 << item)) != 0
+        if not np.any(removing) :
+            continue
+        reduced_flags = RemoveBitFromFlags(reduced_flags,np.where(removing,item,-1))
+        reduced_nbits = reduced_nbits - removing
+        reduced_ones = reduced_ones - removing
+
+        leading_bit = np.uint64(1) << np.maximum(reduced_nbits-1,0).astype(np.uint64)
+        reduced_valid = (reduced_nbits > 0) & ((reduced_flags & leading_bit) != 0)
+        reduced_valid &= (reduced_nbits <= 1) | ((reduced_ones != 1) & (reduced_nbits - reduced_ones != 1))
+        valid &= ~removing | reduced_valid
+
+    return valid
+
+
+def ValidBooleanBusStateTable(nbits,i_gens=[],i_loads=[],i_lines=[]) :
+    # Closed-form, vectorized version of IsValidBooleanBusState for every bus state and every
+    # combination of disconnected lines. Returns a boolean array of shape (2^nbits,2^len(i_lines)):
+    # table[flag,lineOff] where bit j of lineOff means that line i_lines[j] is disconnected.
+    #
+    # The recursion over disconnected items in IsValidBooleanBusState reduces to:
+    #  - every disconnected item must be on bus "1";
+    #  - after removing the i+1 highest disconnected items, the leading remaining item must be on
+    #    bus "1" (i.e. the highest item that is not among them);
+    #  - and the reduced flag (nbits-1-i items, with the same number of zeros) must not have a single
+    #    item on bus "1", which forbids 2 <= n_ones <= min(k+1,nbits-1) for k disconnected items.
+    start = InstrumentationHelpers.Start()
+    n_lines = len(i_lines)
+    flags = np.arange(0b1 << nbits,dtype=np.uint64)
+    all_on = np.uint64(CommonHelpers.FullyConnectedBitset(nbits))
+    n_ones = CommonHelpers.Popcount(flags)
+    n_zeros = nbits - n_ones
+
+    # Rules without any disconnected lines (symmetry convention and single-item buses)
+    base = (flags & np.uint64(0b1 << (nbits-1))) != 0
+    if nbits > 1 :
+        base &= (n_ones != 1) & (n_zeros != 1)
+
+    externals = 0
+    for i in list(i_gens) + list(i_loads) :
+        externals += 0b1 << int(i)
+
+    # Per combination of disconnected lines: the disconnected items, the items that must be on bus "1",
+    # and the largest forbidden number of ones
+    disc_masks = np.zeros(0b1 << n_lines,dtype=np.uint64)
+    required_masks = np.zeros(0b1 << n_lines,dtype=np.uint64)
+    max_forbidden_ones = np.zeros(0b1 << n_lines,dtype=np.int64)
+    for lineOff in range(0b1 << n_lines) :
+        disconnected = sorted((int(i_lines[j]) for j in range(n_lines) if (lineOff >> j) & 0b1),reverse=True)
+        disc_mask = 0
+        required = 0
+        for i,item in enumerate(disconnected) :
+            disc_mask += 0b1 << item
+            remaining = list(b for b in range(nbits) if b not in disconnected[:i+1])
+            if remaining :
+                required |= 0b1 << max(remaining)
+        disc_masks[lineOff] = disc_mask
+        required_masks[lineOff] = disc_mask | required
+        if disconnected and nbits >= 3 :
+            max_forbidden_ones[lineOff] = min(len(disconnected)+1,nbits-1)
+
+    table = np.zeros((0b1 << nbits,0b1 << n_lines),dtype=bool)
+
+    # Fill in chunks of columns, to limit the size of the intermediate arrays.
+    chunk = max(1,(0b1 << 22) >> nbits)
+    inverted = all_on - flags
+    for first in range(0,0b1 << n_lines,chunk) :
+        cols = slice(first,first+chunk)
+        not_isolating = ~(np.uint64(externals) | disc_masks[cols])
+
+        # Islanded externals (and disconnected lines) on bus "1" or bus "0"
+        islanded_1 = (flags[:,None] != 0) & ((flags[:,None] & not_isolating[None,:]) == 0)
+        islanded_0 = (inverted[:,None] != 0) & ((inverted[:,None] & not_isolating[None,:]) == 0)
+
+        has_required = (flags[:,None] & required_masks[None,cols]) == required_masks[None,cols]
+        forbidden_ones = (n_ones[:,None] >= 2) & (n_ones[:,None] <= max_forbidden_ones[None,cols])
+
+        table[:,cols] = base[:,None] & ~islanded_1 & ~islanded_0 & has_required & ~forbidden_ones
+
+    if InstrumentationHelpers.enabled :
+        InstrumentationHelpers.Count('ValidBooleanBusStateTable.cells',table.size)
+    InstrumentationHelpers.Stop('ValidBooleanBusStateTable',start)
+    return table
@@ -1,6 +1,209 @@
+import numpy as np
 
 def FullyConnectedBitset(n_bits) :
-    x = 0
-    for i in range(n_bits) :
-        x += 0b1 << i
-    return x
+    return (0b1 << max(0,n_bits)) - 1
+
+def BitsetToBoolArray(bits,n_bits) :
+    # Unpack a (python int) bitset into a boolean array of length n_bits, without looping over bits.
+    # Negative bitsets (e.g. the default lineOnBits=-1) are interpreted as "everything on".
+    if isinstance(bits,PackedBitsets) :
+        return PackBitsets(bits,n_bits).ToBoolArray()[0]
+    if bits < 0 :
+        return np.ones(n_bits,dtype=bool)
+    n_bytes = max(1,(n_bits+7)//8)
+    as_bytes = np.frombuffer(int(bits & FullyConnectedBitset(n_bits)).to_bytes(n_bytes,'little'),dtype=np.uint8)
+    return np.unpackbits(as_bytes,bitorder='little')[:n_bits].astype(bool)
+
+def BitsetsToBoolArray(bitsets,n_bits) :
+    # Batch version of BitsetToBoolArray: returns an array of shape (len(bitsets),n_bits).
+    # Integer arrays are unpacked with whole-array shifts if the bitsets fit in 64 bits.
+    if isinstance(bitsets,PackedBitsets) :
+        return PackBitsets(bitsets,n_bits).ToBoolArray()
+    array = np.asarray(bitsets)
+    if array.dtype.kind not in 'iu' :
+        # (e.g. a list mixing negative ints and ints >= 2^63, which numpy makes float)
+        array = np.array(bitsets.tolist() if isinstance(bitsets,np.ndarray) else bitsets,dtype=object)
+    bitsets = array
+    if bitsets.dtype != object and n_bits <= 64 :
+        all_on = (bitsets < 0) if np.issubdtype(bitsets.dtype,np.signedinteger) else np.zeros(len(bitsets),dtype=bool)
+        shifts = np.arange(n_bits,dtype=np.uint64)
+        out = ((bitsets.astype(np.uint64)[:,None] >> shifts) & np.uint64(1)).astype(bool)
+        out[all_on] = True
+        return out
+    return np.array([BitsetToBoolArray(int(b),n_bits) for b in bitsets],dtype=bool).reshape(-1,n_bits)
+
+def Popcount(x) :
+    # Vectorized number of set bits, for an array of (up to 64-bit) unsigned integers.
+    x = np.asarray(x,dtype=np.uint64)
+    if hasattr(np,'bitwise_count') :
+        return np.bitwise_count(x).astype(np.int64)
+    # (SWAR popcount, for numpy < 2.0)
+    x = x - ((x >> np.uint64(1)) & np.uint64(0x5555555555555555))
+    x = (x & np.uint64(0x3333333333333333)) + ((x >> np.uint64(2)) & np.uint64(0x3333333333333333))
+    x = (x + (x >> np.uint64(4))) & np.uint64(0x0f0f0f0f0f0f0f0f)
+    return ((x*np.uint64(0x0101010101010101)) >> np.uint64(56)).astype(np.int64)
+
+
+def NWords(n_bits) :
+    # Number of uint64 words needed for n_bits bits
+    return max(1,(n_bits+63)//64)
+
+
+def WordMasks(n_bits) :
+    # The valid bits of every word of a bitset of width n_bits
+    masks = np.full(NWords(n_bits),np.iinfo(np.uint64).max,dtype=np.uint64)
+    if n_bits % 64 :
+        masks[-1] = np.uint64((0b1 << (n_bits % 64)) - 1)
+    if n_bits <= 0 :
+        masks[:] = 0
+    return masks
+
+
+class PackedBitsets :
+
+    # An array of bitsets of any width n_bits (e.g. line statuses, n_bits = n_line), packed in
+    # uint64 words: words[i,k] holds bits 64k to 64k+63 of bitset i. Bits above n_bits are always 0.
+    # Bit i is line i, as in lineOnBits. Use PackBitsets to build one from python ints (negative:
+    # all bits set), integer arrays or boolean arrays of shape (n,n_bits).
+    #
+    # Indexing with an integer, and iterating, gives python int bitsets (so a PackedBitsets can be
+    # passed wherever a list of bitsets is expected); indexing with a slice or array gives a
+    # PackedBitsets. All other operations are whole-array operations on the words.
+
+    def __init__(self,words,n_bits) :
+        self.n_bits = n_bits
+        self.n_words = NWords(n_bits)
+        self.word_masks = WordMasks(n_bits)
+        self.words = np.asarray(words,dtype=np.uint64).reshape(-1,self.n_words) & self.word_masks
+
+    def __len__(self) :
+        return len(self.words)
+
+    def __getitem__(self,i) :
+        if isinstance(i,(int,np.integer)) :
+            return int.from_bytes(self.words[i].astype('<u8').tobytes(),'little')
+        return PackedBitsets(self.words[i],self.n_bits)
+
+    def __iter__(self) :
+        return iter(self.ToInts())
+
+    def __int__(self) :
+        # Only for a single bitset
+        assert len(self) == 1
+        return self[0]
+
+    def __repr__(self) :
+        return 'PackedBitsets(n={},n_bits={})'.format(len(self),self.n_bits)
+
+    def Other(self,other) :
+        # Bring the other operand (PackedBitsets or anything accepted by PackBitsets) to this width
+        if isinstance(other,PackedBitsets) and other.n_bits == self.n_bits :
+            return other
+        return PackBitsets(other,self.n_bits)
+
+    def __and__(self,other) :
+        return PackedBitsets(self.words & self.Other(other).words,self.n_bits)
+
+    def __or__(self,other) :
+        return PackedBitsets(self.words | self.Other(other).words,self.n_bits)
+
+    def __xor__(self,other) :
+        return PackedBitsets(self.words ^ self.Other(other).words,self.n_bits)
+
+    def __invert__(self) :
+        return self.Complement()
+
+    def Complement(self) :
+        # Flip every bit within the width n_bits (e.g. lines on <-> lines off)
+        return PackedBitsets(~self.words,self.n_bits)
+
+    def Equals(self,other) :
+        return (self.words == self.Other(other).words).all(axis=1)
+
+    def Popcount(self) :
+        # Number of set bits of every bitset (int64 array)
+        return Popcount(self.words).sum(axis=1)
+
+    def Any(self) :
+        return self.words.any(axis=1)
+
+    def IsSubsetOf(self,other) :
+        # Element-wise (or broadcast against a single bitset): every set bit of self is set in other
+        return ~(self.words & ~self.Other(other).words).any(axis=1)
+
+    def IsSupersetOf(self,other) :
+        return ~(self.Other(other).words & ~self.words).any(axis=1)
+
+    def SubsetMatrix(self,other,chunk_size=None) :
+        # All pairs: boolean array (len(self),len(other)), [i,j] = self[i] is a subset of other[j].
+        # Processed in chunks of rows of self, to bound the memory use.
+        other = self.Other(other)
+        if chunk_size is None :
+            chunk_size = max(1,(1 << 20)//max(1,len(other)*self.n_words))
+        result = np.zeros((len(self),len(other)),dtype=bool)
+        not_other = ~other.words
+        for first in range(0,len(self),chunk_size) :
+            chunk = self.words[first:first+chunk_size]
+            result[first:first+len(chunk)] = ~(chunk[:,None,:] & not_other[None,:,:]).any(axis=2)
+        return result
+
+    def ToBoolArray(self) :
+        # Boolean array of shape (n,n_bits)
+        as_bytes = self.words.astype('<u8').view(np.uint8).reshape(len(self),-1)
+        return np.unpackbits(as_bytes,axis=1,bitorder='little')[:,:self.n_bits].astype(bool)
+
+    def ToInts(self) :
+        # List of python int bitsets
+        as_bytes = self.words.astype('<u8').tobytes()
+        n_bytes = 8*self.n_words
+        return list(int.from_bytes(as_bytes[i*n_bytes:(i+1)*n_bytes],'little') for i in range(len(self)))
+
+    def IterBits(self,i) :
+        # The positions of the set bits of bitset i, in increasing order
+        as_bytes = self.words[i].astype('<u8').view(np.uint8)
+        for bit in np.flatnonzero(np.unpackbits(as_bytes,bitorder='little')) :
+            yield int(bit)
+
+
+def PackBoolArray(bool_array) :
+    # PackedBitsets from a boolean array of shape (n,n_bits) (or a single row)
+    bool_array = np.atleast_2d(np.asarray(bool_array,dtype=bool))
+    n_bits = bool_array.shape[1]
+    padded = np.zeros((len(bool_array),64*NWords(n_bits)),dtype=bool)
+    padded[:,:n_bits] = bool_array
+    as_bytes = np.packbits(padded,axis=1,bitorder='little')
+    return PackedBitsets(np.ascontiguousarray(as_bytes).view('<u8'),n_bits)
+
+
+def PackBitsets(bitsets,n_bits) :
+    # PackedBitsets of width n_bits from a PackedBitsets (of any width), a python int, or a
+    # sequence / array of ints (negative: all bits set). Boolean arrays go to PackBoolArray.
+    if isinstance(bitsets,PackedBitsets) :
+        if bitsets.n_bits == n_bits :
+            return bitsets
+        words = np.zeros((len(bitsets),NWords(n_bits)),dtype=np.uint64)
+        n_common = min(bitsets.n_words,words.shape[1])
+        words[:,:n_common] = bitsets.words[:,:n_common]
+        return PackedBitsets(words,n_bits)
+
+    if isinstance(bitsets,(int,np.integer)) :
+        bitsets = [bitsets]
+    array = np.asarray(bitsets)
+    if array.dtype == bool :
+        return PackBoolArray(array.reshape(-1,n_bits))
+    if array.dtype.kind not in 'iu' :
+        # (e.g. a list mixing negative ints and ints >= 2^63, which numpy makes float)
+        array = np.array(bitsets.tolist() if isinstance(bitsets,np.ndarray) else bitsets,dtype=object)
+
+    if array.dtype != object and n_bits <= 64 :
+        array = array.ravel()
+        words = array.astype(np.uint64)
+        if np.issubdtype(array.dtype,np.signedinteger) :
+            words[array < 0] = np.iinfo(np.uint64).max
+        return PackedBitsets(words,n_bits)
+
+    n_bytes = 8*NWords(n_bits)
+    all_on = FullyConnectedBitset(n_bits)
+    as_bytes = b''.join((int(b) & all_on).to_bytes(n_bytes,'little') if b >= 0 else all_on.to_bytes(n_bytes,'little')
+                        for b in array.ravel())
+    return PackedBitsets(np.frombuffer(as_bytes,dtype='<u8'),n_bits)
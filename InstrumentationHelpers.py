@@ -0,0 +1,143 @@
+# Opt-in instrumentation of the hot paths: counters, timing histograms and per-call-site
+# sample profiles, exported as a dict (or JSON) snapshot.
+#
+# Off by default. The instrumented code checks the module-level flag first, e.g.
+#     if InstrumentationHelpers.enabled : InstrumentationHelpers.Count('GetDisjointSets.calls')
+#     start = InstrumentationHelpers.Start()
+#     ...
+#     InstrumentationHelpers.Stop('BuildSubstations.substation',start)
+# so that the cost when disabled is one attribute lookup (or one call returning None).
+#
+# Usage:
+#     InstrumentationHelpers.Enable()
+#     ... run a sweep ...
+#     InstrumentationHelpers.SaveSnapshot('profile.json')
+#
+# Note that only this process is instrumented (not the worker processes of a parallel sweep).
+
+import json
+import math
+import os
+import sys
+import time
+
+enabled = False
+
+# Every sample_every-th timing of a name also records its call site (the caller of the timed function)
+sample_every = 16
+
+counters = dict()
+timers = dict()
+profiles = dict()
+
+def Enable(sample_every_n=16) :
+    global enabled,sample_every
+    enabled = True
+    sample_every = max(1,int(sample_every_n))
+    return
+
+
+def Disable() :
+    global enabled
+    enabled = False
+    return
+
+
+def Reset() :
+    counters.clear()
+    timers.clear()
+    profiles.clear()
+    return
+
+
+def Count(name,n=1) :
+    counters[name] = counters.get(name,0) + n
+    return
+
+
+def Start() :
+    # Start time for Stop(), or None if disabled
+    if not enabled :
+        return None
+    return time.perf_counter()
+
+
+def Stop(name,start,depth=2) :
+    # Record the time since Start(); does nothing if the instrumentation was disabled at Start().
+    if start is None :
+        return
+    AddTime(name,time.perf_counter() - start,depth=depth)
+    return
+
+
+def AddTime(name,seconds,depth=1) :
+    # Add one timing to the histogram of this name. The histogram buckets are powers of 2
+    # in microseconds: bucket k holds the timings in (2^(k-1),2^k] us.
+    # The call site is the frame "depth" levels above the caller (1: the caller of the timed function).
+    timer = timers.get(name)
+    if timer is None :
+        timer = timers[name] = {'count' : 0,'total' : 0.,'min' : seconds,'max' : seconds,'buckets' : dict()}
+    timer['count'] += 1
+    timer['total'] += seconds
+    timer['min'] = min(timer['min'],seconds)
+    timer['max'] = max(timer['max'],seconds)
+    bucket = max(0,math.ceil(math.log2(max(seconds*1e6,1.))))
+    timer['buckets'][bucket] = timer['buckets'].get(bucket,0) + 1
+
+    if timer['count'] % sample_every == 1 or sample_every == 1 :
+        # (Walk up as far as the stack goes: timings at module level have no caller above them)
+        frame = sys._getframe(1)
+        for i in range(depth) :
+            if frame.f_back is None :
+                break
+            frame = frame.f_back
+        call_site = '{}:{} ({})'.format(os.path.basename(frame.f_code.co_filename),frame.f_lineno,frame.f_code.co_name)
+        profile = profiles.setdefault(name,dict()).setdefault(call_site,[0,0.])
+        profile[0] += 1
+        profile[1] += seconds
+    return
+
+
+def Snapshot() :
+    # The current state, as a dict of plain python types (JSON-serializable).
+    snapshot = dict()
+    snapshot['enabled'] = enabled
+    snapshot['sample_every'] = sample_every
+    snapshot['counters'] = dict(counters)
+
+    snapshot['timers'] = dict()
+    for name,timer in timers.items() :
+        snapshot['timers'][name] = {'count' : timer['count'],
+                                    'total_seconds' : timer['total'],
+                                    'mean_seconds' : timer['total']/timer['count'],
+                                    'min_seconds' : timer['min'],
+                                    'max_seconds' : timer['max'],
+                                    'histogram' : list({'upper_seconds' : (2.**k)*1e-6,'count' : n}
+                                                       for k,n in sorted(timer['buckets'].items()))}
+
+    snapshot['profiles'] = dict()
+    for name,sites in profiles.items() :
+        snapshot['profiles'][name] = dict((site,{'samples' : n,'sampled_seconds' : t})
+                                          for site,(n,t) in sorted(sites.items(),key=lambda x : -x[1][1]))
+    return snapshot
+
+
+def SnapshotJSON(indent=1) :
+    return json.dumps(Snapshot(),indent=indent,sort_keys=True)
+
+
+def SaveSnapshot(filename) :
+    with open(filename,'w') as f :
+        f.write(SnapshotJSON())
+    return
+
+
+def PrintSnapshot() :
+    snapshot = Snapshot()
+    for name,n in sorted(snapshot['counters'].items()) :
+        print('{:<60} {:>14}'.format(name,n))
+    for name,timer in sorted(snapshot['timers'].items()) :
+        print('{:<60} {:>8} calls {:12.6f} s total {:12.3e} s mean'.format(name,timer['count'],
+                                                                         timer['total_seconds'],
+                                                                         timer['mean_seconds']))
+    return
@@ -0,0 +1,107 @@
+# Helper functions for the spectrum of the grid Laplacian (substation graph):
+# number of connected components, algebraic connectivity (Fiedler value) and Fiedler vector.
+# Input includes grid2op environment
+
+import TopologyHelpers
+import numpy as np
+
+class SpectralAnalyzer :
+
+    # Uses the substation graph (n_buses=1, skipExternals=True), for which MakeLaplacian is the graph
+    # Laplacian D - A. Small grids use a dense symmetric solver (np.linalg.eigvalsh/eigh), which is
+    # also vectorized over a batch of line bitsets. Larger grids count the components with union-find
+    # (GetComponentLabels), and use a sparse Laplacian and Lanczos (scipy.sparse.linalg.eigsh,
+    # shift-invert) only for the Fiedler pair of a connected grid. (Shift-invert can miss copies of
+    # the repeated zero eigenvalue, so it cannot be used to count the components.)
+
+    def __init__(self,_env,dense_max_size=300,zero_tolerance=1e-8) :
+        self.builder = TopologyHelpers.AdjacencyMatrixBuilder(_env,n_buses=1,skipExternals=True)
+        self.n_entries = self.builder.n_entries
+        self.use_dense = (self.n_entries <= dense_max_size)
+        self.zero_tolerance = zero_tolerance
+
+    def MakeSparseLaplacian(self,lineOnBits=-1) :
+        # CSR Laplacian, built from the edge list (parallel lines count once, as in MakeLaplacian)
+        import scipy.sparse
+        rows,cols = self.builder.GetEdges(lineOnBits)
+        n = self.n_entries
+        adj = scipy.sparse.coo_matrix((np.ones(2*len(rows)),(np.concatenate([rows,cols]),np.concatenate([cols,rows]))),
+                                      shape=(n,n)).tocsr()
+        adj.sum_duplicates()
+        adj.data[:] = 1.
+        degrees = np.asarray(adj.sum(axis=1)).ravel()
+        return (scipy.sparse.diags(degrees) - adj).tocsr()
+
+    def SmallestEigenpairsSparse(self,lineOnBits=-1,k=2) :
+        # The k smallest eigenvalues (ascending) and eigenvectors. Only reliable for a connected
+        # grid (see above).
+        import scipy.sparse.linalg
+        lap = self.MakeSparseLaplacian(lineOnBits)
+        evals,evecs = scipy.sparse.linalg.eigsh(lap,k=min(k,self.n_entries-1),sigma=-1e-3,which='LM')
+        order = np.argsort(evals)
+        return evals[order],evecs[:,order]
+
+    def AnalyzeSparse(self,lineOnBits=-1) :
+        # Returns (n_components,algebraic_connectivity,fiedler_vector). For a disconnected grid, the
+        # algebraic connectivity is zero and the "Fiedler vector" (not unique) is returned as zeros.
+        labels,n_components,unused_buses = self.builder.GetComponentLabels(lineOnBits)
+        if n_components > 1 :
+            return n_components,0.,np.zeros(self.n_entries)
+        if self.n_entries < 3 :
+            # (eigsh needs k < n)
+            evals,evecs = np.linalg.eigh(self.MakeSparseLaplacian(lineOnBits).toarray())
+        else :
+            evals,evecs = self.SmallestEigenpairsSparse(lineOnBits)
+        n_zero,algebraic_connectivity,fiedler_vector = self.Summarize(evals,evecs)
+        return n_components,algebraic_connectivity,fiedler_vector
+
+    def Summarize(self,evals,evecs) :
+        # From ascending eigenvalues/eigenvectors, return (n_components,algebraic_connectivity,fiedler_vector)
+        n_components = int(np.count_nonzero(np.abs(evals) < self.zero_tolerance))
+        if len(evals) < 2 :
+            return n_components,0.,np.zeros(self.n_entries)
+        algebraic_connectivity = max(0.,float(evals[1]))
+        fiedler_vector = evecs[:,1].copy()
+        # Fix the sign, so that results are reproducible
+        first = np.flatnonzero(np.abs(fiedler_vector) > self.zero_tolerance)
+        if len(first) and fiedler_vector[first[0]] < 0 :
+            fiedler_vector *= -1
+        if n_components > 1 :
+            # Disconnected: the algebraic connectivity is zero (and the "Fiedler vector" is not unique)
+            algebraic_connectivity = 0.
+        return n_components,algebraic_connectivity,fiedler_vector
+
+    def Analyze(self,lineOnBits=-1) :
+        # Returns (n_components,algebraic_connectivity,fiedler_vector) for one line bitset.
+        if self.use_dense :
+            n_components,algebraic_connectivity,fiedler_vectors = self.AnalyzeBatch([lineOnBits])
+            return int(n_components[0]),float(algebraic_connectivity[0]),fiedler_vectors[0]
+        return self.AnalyzeSparse(lineOnBits)
+
+    def AnalyzeBatch(self,lineOnBitsArray,chunk_size=256) :
+        # Batch version of Analyze. Returns arrays: n_components (n_bitsets),
+        # algebraic_connectivity (n_bitsets) and fiedler_vectors (n_bitsets,n_sub).
+        n_batch = len(lineOnBitsArray)
+        n_components = np.zeros(n_batch,dtype=np.int64)
+        algebraic_connectivity = np.zeros(n_batch)
+        fiedler_vectors = np.zeros((n_batch,self.n_entries))
+
+        if not self.use_dense :
+            for i,bits in enumerate(lineOnBitsArray) :
+                n_components[i],algebraic_connectivity[i],fiedler_vectors[i] = self.Analyze(int(bits))
+            return n_components,algebraic_connectivity,fiedler_vectors
+
+        for first in range(0,n_batch,chunk_size) :
+            laps = self.builder.MakeLaplacians(lineOnBitsArray[first:first+chunk_size]).astype(float)
+            evals,evecs = np.linalg.eigh(laps)
+            for i in range(len(laps)) :
+                result = self.Summarize(evals[i],evecs[i])
+                n_components[first+i],algebraic_connectivity[first+i],fiedler_vectors[first+i] = result
+
+        return n_components,algebraic_connectivity,fiedler_vectors
+
+    def RankByAlgebraicConnectivity(self,lineOnBitsArray) :
+        # Order the line bitsets from most to least robust (largest Fiedler value first).
+        n_components,algebraic_connectivity,fiedler_vectors = self.AnalyzeBatch(lineOnBitsArray)
+        order = np.argsort(-algebraic_connectivity,kind='stable')
+        return list(lineOnBitsArray[i] for i in order),algebraic_connectivity[order]
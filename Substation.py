@@ -1,23 +1,171 @@
 
 import CommonHelpers
 import BusTopologyHelpers
+import InstrumentationHelpers
 import numpy as np
 import itertools
+import collections.abc
+import concurrent.futures
+import hashlib
+import os
+import threading
+
+# Element types (the leading digit of the element IDs, see Substation)
+LINE_OR = 1
+LINE_EX = 2
+LOAD = 3
+GEN = 4
+
+# Integer element table (one row per element of a substation, in local bit order):
+#  - type: LINE_OR, LINE_EX, LOAD or GEN
+#  - index: the line, load or generator ID
+#  - far_sub: for lines, the substation at the other end (-1 otherwise)
+#  - adjacency_index: the row/column in AdjacencyMatrixClass (for lines, bus 1 of the far substation)
+ElementTableDtype = np.dtype([('type',np.int8),
+                              ('index',np.int64),
+                              ('far_sub',np.int64),
+                              ('adjacency_index',np.int64)])
+
+def MakeElementTable(elementIDs,n_sub=None,n_gen=None) :
+    # Decode (once) the float element IDs into an element table.
+    # Without n_sub and n_gen, the adjacency index of externals is not known, and is set to -1.
+    elementIDs = np.asarray(elementIDs,dtype=float)
+    elements = np.zeros(len(elementIDs),dtype=ElementTableDtype)
+    elements['type'] = elementIDs//1000
+    elements['index'] = np.round(elementIDs%1000,3).astype(np.int64)
+    is_line = (elements['type'] <= LINE_EX)
+    elements['far_sub'] = np.where(is_line,np.round((elementIDs - np.floor(elementIDs))*1000),-1)
+    elements['adjacency_index'] = np.where(is_line,2*elements['far_sub'],-1)
+    if n_sub is not None and n_gen is not None :
+        is_gen = (elements['type'] == GEN)
+        is_load = (elements['type'] == LOAD)
+        elements['adjacency_index'][is_gen] = 2*n_sub + elements['index'][is_gen]
+        elements['adjacency_index'][is_load] = 2*n_sub + n_gen + elements['index'][is_load]
+    return elements
+
+
+class ValidityCacheRow(collections.abc.Mapping) :
+
+    # Dict-style view of one row of Substation.validityTable:
+    # key is the disconnected lines (local element bits), value is whether the bus state is valid.
+
+    def __init__(self,substation,bus_state) :
+        self.substation = substation
+        self.bus_state = bus_state
+
+    def __getitem__(self,lineOffKey) :
+        column = self.substation.lineOffKeyToColumn[lineOffKey]
+        return bool(self.substation.validityTable[self.bus_state,column])
+
+    def __iter__(self) :
+        return iter(self.substation.lineOffKeys)
+
+    def __len__(self) :
+        return len(self.substation.lineOffKeys)
+
+
+class ValidityCache(collections.abc.Mapping) :
+
+    # Dict-style view of Substation.validityTable (the validityCache is a dict of dicts):
+    # keys are the bus states that are valid with all lines on (nominal state first, then descending),
+    # values are ValidityCacheRow objects.
+
+    def __init__(self,substation,validityTable) :
+        self.substation = substation
+        nominal = CommonHelpers.FullyConnectedBitset(substation.nElements)
+        valid = validityTable[:,0].copy()
+        valid[nominal] = True
+        self.bus_states = list(int(a) for a in np.nonzero(valid)[0][::-1])
+        self.is_key = valid
+
+    def __contains__(self,bus_state) :
+        found = (0 <= bus_state < len(self.is_key)) and bool(self.is_key[bus_state])
+        if InstrumentationHelpers.enabled :
+            InstrumentationHelpers.Count('Substation.validityCache.hits' if found else 'Substation.validityCache.misses')
+        return found
+
+    def __getitem__(self,bus_state) :
+        if bus_state not in self :
+            raise KeyError(bus_state)
+        return ValidityCacheRow(self.substation,bus_state)
+
+    def __iter__(self) :
+        return iter(self.bus_states)
+
+    def __len__(self) :
+        return len(self.bus_states)
+
+
+class ValidityTableStore :
+
+    # Content-addressed store of substation validity tables.
+    # A table only depends on the signature of the substation: the number of elements and the
+    # local positions of the externals (generators and loads) and of the lines.
+    # Tables are kept in memory (shared by all substations with the same signature) and, if a
+    # directory is given, saved there as .npy files that are memory-mapped read-only when loaded,
+    # so that many worker processes can share the same tables.
+
+    # Increment this if the bus rules change, so that old tables are not picked up.
+    version = 1
+
+    def __init__(self,directory=None) :
+        self.directory = directory
+        self.tables = dict()
+        if directory is not None :
+            os.makedirs(directory,exist_ok=True)
+
+    def Signature(self,nElements,i_gens=[],i_loads=[],i_lines=[]) :
+        externals = sorted(int(i) for i in list(i_gens) + list(i_loads))
+        lines = list(int(i) for i in i_lines)
+        return 'v{}_n{}_e{}_l{}'.format(self.version,nElements,externals,lines)
+
+    def GetFileName(self,signature) :
+        digest = hashlib.sha1(signature.encode()).hexdigest()
+        return os.path.join(self.directory,'validity_{}.npy'.format(digest[:20]))
+
+    def Get(self,nElements,i_gens=[],i_loads=[],i_lines=[],table=None) :
+        # (A table computed elsewhere, e.g. in a worker process, can be handed in to be stored.)
+        signature = self.Signature(nElements,i_gens,i_loads,i_lines)
+        if signature in self.tables :
+            if InstrumentationHelpers.enabled :
+                InstrumentationHelpers.Count('ValidityTableStore.memory_hits')
+            return self.tables[signature]
+
+        filename = None
+        if self.directory is not None :
+            filename = self.GetFileName(signature)
+            if table is None and os.path.exists(filename) :
+                table = np.load(filename,mmap_mode='r')
+                if InstrumentationHelpers.enabled :
+                    InstrumentationHelpers.Count('ValidityTableStore.disk_hits')
+
+        if table is None :
+            if InstrumentationHelpers.enabled :
+                InstrumentationHelpers.Count('ValidityTableStore.builds')
+            table = BusTopologyHelpers.ValidBooleanBusStateTable(nElements,
+                                                                 i_gens = i_gens,
+                                                                 i_loads = i_loads,
+                                                                 i_lines = i_lines)
+
+        if filename is not None and not os.path.exists(filename) :
+            # Write to a temporary file first: other processes (or threads) may be reading the same file name.
+            tmp_filename = '{}.{}.{}.tmp.npy'.format(filename[:-4],os.getpid(),threading.get_ident())
+            np.save(tmp_filename,table)
+            os.replace(tmp_filename,filename)
+
+        self.tables[signature] = table
+        return table
+
 
 class Substation :
 
-    def __init__(self,id,nElements,elementIDs) :
-        
+    def __init__(self,id,nElements,elementIDs,validityTableStore=None,elements=None) :
+
         self.index = id
         self.nElements = nElements
 
-        # Cache for keeping track of previously-checked bus states.
-        # The key corresponds to the disconnected indices (binary number)
-        self.validityCache = dict()
-
         # The nominal bus configuration is to put everything on bus 1
         self.currentBusConfig = CommonHelpers.FullyConnectedBitset(nElements)
-        self.validityCache[self.currentBusConfig] = dict()
 
         # NEW type of element ID: 3 digits
         # First digit (starting from the left) is the type of element
@@ -34,58 +182,159 @@ class Substation :
         # This should be static.
         self.elementIDs = np.array(elementIDs)
 
-        # Precompute the valid boolean bus states, for all combos of lines on/off and bus configs.
-        _lineOffCombos = []
+        # The same information as an integer table (see ElementTableDtype), which is what is used
+        # for the bus switching. BuildSubstations makes it directly from the env; otherwise it is
+        # decoded from the elementIDs.
+        if elements is None :
+            elements = MakeElementTable(elementIDs)
+        self.elements = elements
+
+        # The valid boolean bus states, for all combos of lines on/off and bus configs (validityTable,
+        # validityCache, lineOffKeys and lineOffKeyToColumn) are precomputed on first use, or by Warm().
+        # Substations with the same signature share a table, via the (optional) validityTableStore.
+        if validityTableStore is None :
+            validityTableStore = ValidityTableStore()
+        self.validityTableStore = validityTableStore
+
+        # Gather tables from a global lineOnBits to the validityTable column:
+        # the (global) line ID of each local line, its single-bit masks, and the mask of all the
+        # local lines in a global lineOnBits. (The lookup table from the masked lineOnBits to the
+        # column, lineOffColumnTable, is built on first use.)
+        self.localLineIndices = self.LocalLineIndices()
+        self.localLineIDs = self.elements['index'][self.localLineIndices].astype(np.int64)
+        self.localLineMasks = list((0b1 << int(lid),0b1 << j) for j,lid in enumerate(self.localLineIDs))
+        self.lineMask = 0
+        for line_mask,local_mask in self.localLineMasks :
+            self.lineMask |= line_mask
+
+        # Valid bus states for each validityTable column (filled in on first use)
+        self.validBusStatesByColumn = dict()
+
+        return
+
+    # The precomputed attributes, built by Warm() the first time one of them is looked up.
+    # (Once built they are plain instance attributes, so __getattr__ is not called anymore.)
+    lazyAttributes = ('validityTable','validityCache','lineOffKeys','lineOffKeyToColumn')
+
+    def __getattr__(self,name) :
+        if name in Substation.lazyAttributes :
+            self.Warm()
+            return self.__dict__[name]
+        if name in ('lineOffColumnTable','lineOffColumnKeys','lineOffColumnValues') :
+            self.BuildLineOffColumnTable()
+            return self.__dict__[name]
+        raise AttributeError(name)
+
+    def BuildLineOffColumnTable(self) :
+        # lineOffColumnTable[lineOnBits & lineMask] is the validityTable column, for each of the
+        # 2^nLines combinations of local lines (as many as there are validityTable columns).
+        # Column bit j set means that local line j is off, so its global bit is cleared in the key.
+        # (A line with both ends here appears twice: the column with both bits set is the one kept.)
+        keys = [self.lineMask]
+        for line_mask,local_mask in self.localLineMasks :
+            keys = keys + list(key & ~line_mask for key in keys)
+        self.lineOffColumnTable = dict((key,column) for column,key in enumerate(keys))
+
+        # The same table as sorted arrays, for LineOffColumns (if the keys fit in a uint64)
+        self.lineOffColumnKeys = None
+        self.lineOffColumnValues = None
+        if self.lineMask < (0b1 << 64) :
+            items = sorted(self.lineOffColumnTable.items())
+            self.lineOffColumnKeys = np.array(list(k for k,c in items),dtype=np.uint64)
+            self.lineOffColumnValues = np.array(list(c for k,c in items),dtype=np.int64)
+        return
+
+    def Warm(self) :
+        # Build (once) the precomputed tables of this substation.
+        if self.IsWarm() :
+            return
+
+        start = InstrumentationHelpers.Start()
+
+        # validityTable[bus_state,lineOff] is a dense boolean array, where bit j of lineOff means that
+        # the j-th local line (see LocalLineIndices) is disconnected.
+        validityTable = self.validityTableStore.Get(self.nElements,
+                                                    i_gens = self.LocalGeneratorIndices(),
+                                                    i_loads = self.LocalLoadIndices(),
+                                                    i_lines = self.LocalLineIndices())
+
+        # The dict-style keys of the validityCache use the local element bits of the disconnected lines.
+        # They are listed in the same order as before (by number of disconnected lines).
+        lineOffKeys = []
+        lineOffKeyToColumn = dict()
         for i in range(len(self.LocalLineIndices())+1) :
-            _lineOffCombos += itertools.combinations(self.LocalLineIndices(),i)
-
-        all_bus_combos = reversed(range(CommonHelpers.FullyConnectedBitset(self.nElements)+1))
-
-        for sub_bitset in all_bus_combos :
-
-            # If it is not a valid bus state at all (regardless of disconnected lines),
-            # then do not put the bitset into the validityCache keys at all.
-            # We will use the validityCache to get the list of valid possible bus states.
-            if not BusTopologyHelpers.IsValidBooleanBusState(sub_bitset,
-                                                             self.nElements,
-                                                             i_gens = self.LocalGeneratorIndices(),
-                                                             i_loads = self.LocalLoadIndices(),
-                                                             items_disconnected = []) :
-                continue
-
-            self.validityCache[sub_bitset] = dict()
-
-            for _lineOffTuple in _lineOffCombos :
-                _lineOffList = list(_lineOffTuple)
-                v = BusTopologyHelpers.IsValidBooleanBusState(sub_bitset,
-                                                              self.nElements,
-                                                              i_gens = self.LocalGeneratorIndices(),
-                                                              i_loads = self.LocalLoadIndices(),
-                                                              items_disconnected = _lineOffList,
-                                                              verbose=False)
+            for _lineOffTuple in itertools.combinations(range(len(self.LocalLineIndices())),i) :
                 lineOffKey = 0
-                for i in _lineOffList :
-                    lineOffKey += (0b1 << i)
-                self.validityCache[sub_bitset][lineOffKey] = v
-                #print('LocalLineIndices:',self.LocalLineIndices(),'checking',_lineOffList,valid)
-
+                column = 0
+                for j in _lineOffTuple :
+                    lineOffKey += (0b1 << int(self.LocalLineIndices()[j]))
+                    column += (0b1 << j)
+                lineOffKeys.append(lineOffKey)
+                lineOffKeyToColumn[lineOffKey] = column
+
+        # If it is not a valid bus state at all (regardless of disconnected lines),
+        # then the bitset is not in the validityCache keys at all.
+        # We will use the validityCache to get the list of valid possible bus states.
+        validityCache = ValidityCache(self,validityTable)
+
+        # (The validityCache, which IsWarm looks at, is set last.)
+        self.validityTable = validityTable
+        self.lineOffKeys = lineOffKeys
+        self.lineOffKeyToColumn = lineOffKeyToColumn
+        self.validityCache = validityCache
+        InstrumentationHelpers.Stop('Substation.Warm',start)
         return
 
+    def IsWarm(self) :
+        return 'validityCache' in self.__dict__
+
+    def LineOffColumn(self,lineOnBits=-1) :
+        # The validityTable column (disconnected local lines) for a global lineOnBits: one mask
+        # and one table lookup. As before, lineOnBits <= 0 means that all lines are on.
+        if lineOnBits <= 0 :
+            return 0
+        return self.lineOffColumnTable[int(lineOnBits) & self.lineMask]
+
+    def LineOffColumns(self,lineOnBitsArray) :
+        # Batch version of LineOffColumn, for an array of global lineOnBits. The masked bitsets
+        # are looked up in the sorted keys of the table (python ints: in the table itself).
+        lineOnBitsArray = np.asarray(lineOnBitsArray)
+        if lineOnBitsArray.dtype == object or self.lineOffColumnKeys is None :
+            return np.array(list(self.LineOffColumn(b) for b in lineOnBitsArray.tolist()),dtype=np.int64)
+        masked = lineOnBitsArray.astype(np.uint64) & np.uint64(self.lineMask)
+        columns = self.lineOffColumnValues[np.searchsorted(self.lineOffColumnKeys,masked)]
+        columns[lineOnBitsArray <= 0] = 0
+        return columns
+
+    def ValidBusStates(self,lineOnBits=-1) :
+        # Array of the valid bus states for this lineOnBits (does not touch currentBusConfig).
+        # The arrays are precomputed (memoized) per validityTable column: do not modify them.
+        column = self.LineOffColumn(lineOnBits) if lineOnBits >= 0 else -1
+        if InstrumentationHelpers.enabled :
+            InstrumentationHelpers.Count('Substation.ValidBusStates.calls')
+        if column not in self.validBusStatesByColumn :
+            if InstrumentationHelpers.enabled :
+                InstrumentationHelpers.Count('Substation.ValidBusStates.misses')
+            if column < 0 :
+                states = np.array(self.validityCache.bus_states,dtype=np.int64)
+            else :
+                valid = self.validityTable[:,column] & self.validityCache.is_key
+                states = np.nonzero(valid)[0][::-1].astype(np.int64)
+            states.flags.writeable = False
+            self.validBusStatesByColumn[column] = states
+        return self.validBusStatesByColumn[column]
+
+    def ValidCountsByColumn(self) :
+        # Number of valid bus states for each validityTable column (i.e. for each combination
+        # of disconnected local lines). Memoized.
+        if not hasattr(self,'validCountsByColumn') :
+            self.validCountsByColumn = np.count_nonzero(self.validityTable & self.validityCache.is_key[:,None],axis=0)
+        return self.validCountsByColumn
+
     def GetValidBusStates(self,lineOnBits=-1) :
         # Get the valid bus states (ignoring effects of turning off lines)
         # These should be filled in at construction.
-        if lineOnBits < 0 :
-            return list(self.validityCache.keys())
-
-        valid_states = []
-        tmp_saveBusConfig = self.currentBusConfig
-        for i in self.validityCache.keys() :
-            self.SetBusConfig(i)
-            if self.IsValidBooleanBusState(lineOnBits=lineOnBits) :
-                valid_states.append(i)
-
-        self.currentBusConfig = tmp_saveBusConfig
-        return valid_states
+        return list(int(i) for i in self.ValidBusStates(lineOnBits))
 
     def printValidityCache(self) :
         total = 0
@@ -108,13 +357,13 @@ class Substation :
 
     # "Local" index here refers to the local bus bits here
     def LocalGeneratorIndices(self) :
-        return list(np.where(self.elementIDs//1000 == 4)[0])
+        return list(np.where(self.elements['type'] == GEN)[0])
         
     def LocalLoadIndices(self) :
-        return list(np.where(self.elementIDs//1000 == 3)[0])
+        return list(np.where(self.elements['type'] == LOAD)[0])
 
     def LocalLineIndices(self) :
-        return list(np.where(self.elementIDs//1000 <= 2)[0])
+        return list(np.where(self.elements['type'] <= LINE_EX)[0])
 
     def GetLineID(self,elementID) :
         # For line IDs of the form 2005.001 return "5" (the lineID)
@@ -145,68 +394,60 @@ class Substation :
                                                                                self.nElements,
                                                                                bits,
                                                                                self.nElements))
-        toBus1 = []
-        toBus2 = []
-        for i in range(self.nElements) :
-            if (bits & (0b1 << i)) == (0b1 << i) :
-                toBus1.append(self.elementIDs[i])
-            else :
-                toBus2.append(self.elementIDs[i])
+        onBus1 = ((bits >> np.arange(self.nElements)) & 1).astype(bool)
 
         if verbose :
-            print('On bus 1:',toBus1)
-            print('On bus 2:',toBus2)
+            print('On bus 1:',list(self.elementIDs[onBus1]))
+            print('On bus 2:',list(self.elementIDs[~onBus1]))
 
         self.currentBusConfig = bits
 
-        if (not doNotExecute) and len(toBus1) :
-            adjacency_matrix_class.SetListOfElementsToBusN(self.index,1,toBus1)
-        if (not doNotExecute) and len(toBus2) :
-            adjacency_matrix_class.SetListOfElementsToBusN(self.index,2,toBus2)
+        if not doNotExecute :
+            adjacency_matrix_class.UpdateFingerprint(self.index,bits)
+            adjacencyIndices = self.elements['adjacency_index']
+            if np.any(adjacencyIndices < 0) :
+                # (element table made without the grid sizes: get the externals from the element IDs)
+                adjacencyIndices = list(adjacency_matrix_class.ElementIDToAdjacencyIndex(e) for e in self.elementIDs)
+            # Bus 1 elements first, then bus 2 (as two SetListOfElementsToBusN calls would)
+            order = np.concatenate([np.flatnonzero(onBus1),np.flatnonzero(~onBus1)])
+            adjacency_matrix_class.SetElementsToBuses(self.index,np.asarray(adjacencyIndices)[order],onBus1[order])
 
         return
 
     def IsValidBooleanBusState(self,lineOnBits=-1) :
 
+        if InstrumentationHelpers.enabled :
+            InstrumentationHelpers.Count('Substation.IsValidBooleanBusState.calls')
+
         # If it is not in the validity cache, then it is not a valid bus state, period.
         #print('Checking if {} is in'.format(self.currentBusConfig),self.validityCache.keys())
         if self.currentBusConfig not in self.validityCache.keys() :
             #print('It is not! Getting out of here!')
             return False
 
-        localDisconnIndices = []
-        cacheKey = 0
+        return bool(self.validityTable[self.currentBusConfig,self.LineOffColumn(lineOnBits)])
 
-        if lineOnBits > 0 :
-            for li in self.LocalLineIndices() :
-                lineID = self.GetLineID(self.elementIDs[li])
-                isOn = lineOnBits & (0b1 << lineID)
-                #print('{} is {}'.format(lineID,'on' if isOn else 'off'))
-                if isOn :
-                    continue
-                else :
-                    cacheKey += (0b1 << li)
-                    localDisconnIndices.append(li)
-
-        # Otherwise, all results are now precomputed.
-        # print('Looking for bus 0b{:0{}b}, key 0b{:0{}b}'.format(self.currentBusConfig,
-        #                                                         self.nElements,
-        #                                                         cacheKey,
-        #                                                         len(self.LocalLineIndices())))
-        return self.validityCache[self.currentBusConfig][cacheKey]
-
-
-def BuildSubstations(env) :
+def BuildSubstations(env,cache_dir=None,warm=False,n_workers=1,use_processes=False) :
 
     # This builds substations from the environment, putting them into a format that is readily
     # useable by the tools developed to analyze available substation moves.
+    # If cache_dir is given, the validity tables are read from (and saved to) that directory.
+    # The validity tables of each substation are built on first use (see Substation.Warm), unless
+    # warm is True (see WarmSubstations for n_workers and use_processes).
 
     sub_classes = []
+    store = ValidityTableStore(cache_dir)
+    n_sub = len(env.sub_info)
 
     for sub in range(len(env.sub_info)) :
 
+        start = InstrumentationHelpers.Start()
+
         # Element IDs, to be populated
+        # (The float IDs are kept for printing; the integer element table is what is used, and does
+        #  not have the 1000-line / 1000-substation limit of the IDs.)
         element_ids = [0]*env.sub_info[sub]
+        elements = np.zeros(env.sub_info[sub],dtype=ElementTableDtype)
 
         # Find the line (OR) ids that link to this sub
         line_or_ids = np.where(env.line_or_to_subid == sub)[0]
@@ -217,6 +458,7 @@ def BuildSubstations(env) :
                 print('Error -- this sub position is already filled! (line OR)')
             links_to_sub = env.line_ex_to_subid[lid]
             element_ids[sub_pos] = 1000 + lid + np.round(links_to_sub / 1000.,3)
+            elements[sub_pos] = (LINE_OR,lid,links_to_sub,2*links_to_sub)
 
         # Find the line (EX) ids that link to this sub
         line_ex_ids = np.where(env.line_ex_to_subid == sub)[0]
@@ -226,6 +468,7 @@ def BuildSubstations(env) :
                 print('Error -- this sub position is already filled! (line EX)')
             links_to_sub = env.line_or_to_subid[lid]
             element_ids[sub_pos] = 2000 + lid + np.round(links_to_sub / 1000.,3)
+            elements[sub_pos] = (LINE_EX,lid,links_to_sub,2*links_to_sub)
 
         # Now loads
         load_ids = np.where(env.load_to_subid == sub)[0]
@@ -234,6 +477,7 @@ def BuildSubstations(env) :
             if element_ids[sub_pos] != 0 :
                 print('Error -- this sub position is already filled! (loads)')
             element_ids[sub_pos] = 3000 + lid
+            elements[sub_pos] = (LOAD,lid,-1,2*n_sub + env.n_gen + lid)
 
         # Now generators
         gen_ids = np.where(env.gen_to_subid == sub)[0]
@@ -242,7 +486,113 @@ def BuildSubstations(env) :
             if element_ids[sub_pos] != 0 :
                 print('Error -- this sub position is already filled! (gens)')
             element_ids[sub_pos] = 4000 + gid
+            elements[sub_pos] = (GEN,gid,-1,2*n_sub + gid)
 
-        sub_classes.append(Substation(sub,env.sub_info[sub],element_ids))
+        sub_classes.append(Substation(sub,env.sub_info[sub],element_ids,validityTableStore=store,elements=elements))
+        InstrumentationHelpers.Stop('BuildSubstations.substation',start)
+        InstrumentationHelpers.Stop('BuildSubstations.substation_{}_elements'.format(env.sub_info[sub]),start)
+
+    if warm :
+        WarmSubstations(sub_classes,n_workers=n_workers,use_processes=use_processes)
 
     return sub_classes
+
+
+def BuildValidityTable(nElements,i_gens,i_loads,i_lines) :
+    # (For worker processes)
+    return BusTopologyHelpers.ValidBooleanBusStateTable(nElements,i_gens=i_gens,i_loads=i_loads,i_lines=i_lines)
+
+
+def WarmSubstations(sub_classes,indices=None,n_workers=1,use_processes=False) :
+    # Build the precomputed tables of the substations with these indices (default: all of them).
+    # With n_workers > 1, the work is spread over a thread pool, or, if use_processes, the validity
+    # tables (one per substation signature) are built in a process pool and handed to the store.
+    if indices is None :
+        indices = range(len(sub_classes))
+    todo = list(sub_classes[i] for i in indices if not sub_classes[i].IsWarm())
+
+    if n_workers > 1 and use_processes :
+        signatures = dict()
+        for sub in todo :
+            args = (sub.nElements,sub.LocalGeneratorIndices(),sub.LocalLoadIndices(),sub.LocalLineIndices())
+            signature = sub.validityTableStore.Signature(*args)
+            if signature not in sub.validityTableStore.tables :
+                signatures.setdefault((id(sub.validityTableStore),signature),(sub.validityTableStore,args))
+        with concurrent.futures.ProcessPoolExecutor(max_workers=n_workers) as pool :
+            futures = dict((pool.submit(BuildValidityTable,*args),(store,args)) for store,args in signatures.values())
+            for future in concurrent.futures.as_completed(futures) :
+                store,args = futures[future]
+                store.Get(*args,table=future.result())
+
+    if n_workers > 1 and not use_processes :
+        with concurrent.futures.ThreadPoolExecutor(max_workers=n_workers) as pool :
+            list(pool.map(lambda sub : sub.Warm(),todo))
+    else :
+        for sub in todo :
+            sub.Warm()
+
+    return
+
+
+def CountValidCombinations(sub_classes,lineOnBitsArray,logSpace=False,keepBreakdown=True,chunk_size=65536) :
+
+    # Count the valid joint (line status x substation bus state) topologies.
+    # For every line bitset, the number of valid topologies is the product over substations of the
+    # number of valid bus states given that bitset (the notebook's getNumberOfLineAndBusCombinations).
+    # Each substation's count is a lookup in its ValidCountsByColumn vector, for all bitsets at once.
+    #
+    # Returns (total,per_bitset,per_substation):
+    #  - total: the sum over all bitsets (an exact python int, or its natural log if logSpace)
+    #  - per_bitset: the product for each bitset (exact int64, or python ints if int64 could overflow;
+    #    natural logs if logSpace)
+    #  - per_substation: array of shape (n_bitsets,n_sub) with the count for every substation
+    #    (None if not keepBreakdown)
+    lineOnBitsArray = np.asarray(lineOnBitsArray)
+    count_vectors = list(sub.ValidCountsByColumn() for sub in sub_classes)
+
+    # If the product cannot overflow int64, stay in int64; otherwise use python ints.
+    max_log2 = sum(np.log2(max(1,int(c.max()))) for c in count_vectors if len(c))
+    exact_int64 = (max_log2 < 62)
+
+    total = 0
+    per_bitset = []
+    per_substation = []
+    for first in range(0,len(lineOnBitsArray),chunk_size) :
+        bits = lineOnBitsArray[first:first+chunk_size]
+        counts = np.empty((len(bits),len(sub_classes)),dtype=np.int64)
+        for i,sub in enumerate(sub_classes) :
+            counts[:,i] = count_vectors[i][sub.LineOffColumns(bits)]
+
+        if logSpace :
+            with np.errstate(divide='ignore') :
+                products = np.log(counts).sum(axis=1)
+        elif exact_int64 :
+            products = np.prod(counts,axis=1)
+            total += int(products.sum(dtype=object))
+        else :
+            products = np.prod(counts.astype(object),axis=1)
+            total += sum(products)
+
+        per_bitset.append(products)
+        if keepBreakdown :
+            per_substation.append(counts)
+
+    if len(per_bitset) :
+        per_bitset = np.concatenate(per_bitset)
+    else :
+        per_bitset = np.zeros(0,dtype=float if logSpace else np.int64)
+
+    if logSpace :
+        # log of the sum of the products (log-sum-exp)
+        if len(per_bitset) and np.isfinite(per_bitset.max()) :
+            max_log = per_bitset.max()
+            total = max_log + np.log(np.exp(per_bitset - max_log).sum())
+        else :
+            total = -np.inf
+
+    if keepBreakdown :
+        per_substation = np.concatenate(per_substation) if per_substation else np.zeros((0,len(sub_classes)),dtype=np.int64)
+    else :
+        per_substation = None
+
+    return total,per_bitset,per_substation
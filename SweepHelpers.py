@@ -0,0 +1,232 @@
+# Helper functions to sweep over all line-status (on/off) bitsets of a grid,
+# counting the connected topologies and collecting the minimum-cut bitsets.
+# Input includes grid2op environment
+
+import os
+import concurrent.futures
+import CommonHelpers
+import InstrumentationHelpers
+import SweepStoreHelpers
+import TopologyHelpers
+import numpy as np
+
+def GetShardBounds(n_line,n_shards) :
+    # Split the 2^n_line line bitsets into contiguous shards.
+    # Shard 0 holds the highest bitsets (all lines on), as in the notebook sweep, which goes from
+    # the fully-connected bitset downwards. Returns a list of (high,low) pairs: the shard
+    # visits bitsets high-1, high-2, ..., low.
+    total = 0b1 << n_line
+    edges = list(total*k//n_shards for k in range(n_shards+1))
+    return list((total-edges[k],total-edges[k+1]) for k in range(n_shards))
+
+
+def RunSweepShard(n_sub,line_or,line_ex,high,low,seed_bitsets=[],keep_connected_bitsets=True,connected_bitmap=False) :
+    # Sweep the line bitsets high-1 ... low (in decreasing order, like the notebook).
+    # This only takes plain arrays so that it can run in a worker process.
+    # seed_bitsets are known minimum-cut bitsets, used only for pruning.
+    # The connected bitsets are returned (as 'connected_bitsets') only if keep_connected_bitsets.
+    # If connected_bitmap, the connected bitsets are also returned as a packed bitmap (uint8, little
+    # bit order, bit i is bitset low+i; see SweepResultStore.OrPackedRange), at 1 bit per bitset.
+    n_line = len(line_or)
+    line_or = np.asarray(line_or,dtype=np.int64)
+    line_ex = np.asarray(line_ex,dtype=np.int64)
+
+    histo_connected = np.zeros(n_line+1,dtype=np.int64)
+    histo_disconnected = np.zeros(n_line+1,dtype=np.int64)
+    n_connected = 0
+    n_unconnected = 0
+    connected_bitsets = []
+    bitmap = np.zeros((high-low+7)//8 if connected_bitmap else 0,dtype=np.uint8)
+
+    seeds = TopologyHelpers.ExcludedBitsetIndex(n_line,seed_bitsets)
+    minimum_cuts = TopologyHelpers.ExcludedBitsetIndex(n_line)
+    start = InstrumentationHelpers.Start()
+    n_pruned = 0
+
+    for line_bitset in range(high-1,low-1,-1) :
+
+        this_nConnected = TopologyHelpers.nConnected(line_bitset,n_line)
+
+        # Check if another graph with fewer disconnections was already excluded, which
+        # automatically would exclude this graph
+        if seeds.IsExcluded(line_bitset) or minimum_cuts.IsExcluded(line_bitset) :
+            histo_disconnected[this_nConnected] += 1
+            n_unconnected += 1
+            n_pruned += 1
+            continue
+
+        on = CommonHelpers.BitsetToBoolArray(line_bitset,n_line)
+        labels,n_components = TopologyHelpers.GetComponentLabels(n_sub,line_or[on],line_ex[on])
+
+        if n_components > 1 :
+            histo_disconnected[this_nConnected] += 1
+            n_unconnected += 1
+            minimum_cuts.Add(line_bitset)
+        else :
+            histo_connected[this_nConnected] += 1
+            n_connected += 1
+            if keep_connected_bitsets :
+                connected_bitsets.append(line_bitset)
+            if connected_bitmap :
+                offset = line_bitset - low
+                bitmap[offset >> 3] |= (0b1 << (offset & 7))
+
+    if InstrumentationHelpers.enabled :
+        InstrumentationHelpers.Count('RunSweepShard.bitsets',high-low)
+        InstrumentationHelpers.Count('RunSweepShard.pruned',n_pruned)
+        InstrumentationHelpers.Count('RunSweepShard.graph_checks',high-low-n_pruned)
+    InstrumentationHelpers.Stop('RunSweepShard',start)
+
+    result = dict()
+    result['n_connected'] = n_connected
+    result['n_unconnected'] = n_unconnected
+    result['minimum_cut_bitsets'] = np.array(minimum_cuts.GetBitsets(),dtype=np.uint64)
+    if keep_connected_bitsets :
+        result['connected_bitsets'] = np.array(connected_bitsets,dtype=np.uint64)
+    result['histo_connected'] = histo_connected
+    result['histo_disconnected'] = histo_disconnected
+    if connected_bitmap :
+        result['connected_bitmap'] = bitmap
+    return result
+
+
+def GetShardCheckpointName(checkpoint_dir,i_shard,n_shards) :
+    return os.path.join(checkpoint_dir,'shard_{:05d}_of_{:05d}.npz'.format(i_shard,n_shards))
+
+
+def SaveShardCheckpoint(filename,result,signature) :
+    # Write to a temporary file first, so that an interrupted write never looks like a finished shard.
+    tmp_filename = filename + '.tmp.npz'
+    np.savez(tmp_filename,signature=signature,**result)
+    os.replace(tmp_filename,filename)
+    return
+
+
+def LoadShardCheckpoint(filename,signature) :
+    # Return the shard result, or None if there is no (matching) checkpoint.
+    if not os.path.exists(filename) :
+        return None
+    with np.load(filename) as f :
+        if not np.array_equal(f['signature'],signature) :
+            print('Warning: checkpoint {} was made for a different grid. Ignoring it.'.format(filename))
+            return None
+        result = dict((k,f[k]) for k in f.files if k != 'signature')
+    result['n_connected'] = int(result['n_connected'])
+    result['n_unconnected'] = int(result['n_unconnected'])
+    return result
+
+
+def MergeShardResults(results,n_line,seed_bitsets=[]) :
+    # Merge per-shard results (given in shard order). The per-shard minimum-cut lists are only
+    # minimal within their shard; inserting them all into one index removes the supersets.
+    n_connected = sum(r['n_connected'] for r in results)
+    n_unconnected = sum(r['n_unconnected'] for r in results)
+    histo_connected = sum(r['histo_connected'] for r in results)
+    histo_disconnected = sum(r['histo_disconnected'] for r in results)
+
+    minimum_cuts = TopologyHelpers.ExcludedBitsetIndex(n_line)
+    all_cuts = list(int(b) for r in results for b in r['minimum_cut_bitsets']) + list(seed_bitsets)
+    for bits in sorted(all_cuts,reverse=True) :
+        minimum_cuts.Add(bits)
+    minimum_cut_bitsets = sorted(minimum_cuts.GetBitsets(),reverse=True)
+
+    connected_bitsets = list(int(b) for r in results for b in r.get('connected_bitsets',[]))
+
+    return n_connected,n_unconnected,minimum_cut_bitsets,connected_bitsets,histo_connected,histo_disconnected
+
+
+def FindConnectedAndUnconnectedBitsets(_env,n_shards=None,n_workers=None,checkpoint_dir=None,
+                                       keep_connected_bitsets=True,seed_cut_size=2,store_dir=None,verbose=False) :
+    # Return the number of connected, unconnected bitsets, and
+    # a list of the unique minimum-cut bitsets (as in the notebook version).
+    #
+    # The 2^n_line bitsets are split into n_shards shards, run on a pool of n_workers processes
+    # (n_workers=1 runs everything in this process). If checkpoint_dir is given, every finished
+    # shard is written there, and shards that are already there are not run again (resume).
+    # Minimum cuts of up to seed_cut_size lines are found up front (see FindMinimalCutBitsets)
+    # and handed to every shard, so that each shard can prune without the other shards' results.
+    #
+    # The histograms are arrays of counts, indexed by the number of connected lines.
+    #
+    # If store_dir is given, the results also go to a SweepResultStore there (a memory-mapped bitmap
+    # of the connected bitsets, 1 bit per bitset), and the store is returned in place of the list of
+    # connected bitsets (it can be iterated in the same order, or streamed in batches).
+    n_line = _env.n_line
+    if n_line > 64 :
+        print('Error -- a sweep over 2^{} line bitsets is not possible.'.format(n_line))
+        return
+
+    if n_workers is None :
+        n_workers = os.cpu_count() or 1
+    if n_shards is None :
+        n_shards = 4*n_workers
+
+    n_sub = len(_env.sub_info)
+    line_or = np.asarray(_env.line_or_to_subid,dtype=np.int64)
+    line_ex = np.asarray(_env.line_ex_to_subid,dtype=np.int64)
+    signature = np.concatenate([[n_sub,n_line,n_shards],line_or,line_ex])
+
+    seed_bitsets = []
+    if seed_cut_size :
+        seed_bitsets,set_sizes = TopologyHelpers.FindMinimalCutBitsets(_env,max_cut_size=seed_cut_size)
+
+    if checkpoint_dir is not None :
+        os.makedirs(checkpoint_dir,exist_ok=True)
+
+    store = None
+    if store_dir is not None :
+        store = SweepStoreHelpers.SweepResultStore(store_dir,n_line=n_line,signature=signature)
+        keep_connected_bitsets = False
+
+    shard_bounds = GetShardBounds(n_line,n_shards)
+    results = [None]*n_shards
+    for i_shard in range(n_shards) :
+        if checkpoint_dir is not None :
+            filename = GetShardCheckpointName(checkpoint_dir,i_shard,n_shards)
+            results[i_shard] = LoadShardCheckpoint(filename,signature)
+            if keep_connected_bitsets and results[i_shard] is not None and 'connected_bitsets' not in results[i_shard] :
+                # A checkpoint made without the list of connected bitsets is run again
+                results[i_shard] = None
+            if verbose and results[i_shard] is not None :
+                print('Resuming: shard {} of {} was already done'.format(i_shard,n_shards))
+
+    def AddToStore(i_shard) :
+        # Move the shard's bitmap into the store (a checkpoint made without a bitmap is run again)
+        if store is None :
+            return
+        if 'connected_bitmap' not in results[i_shard] :
+            results[i_shard] = None
+            return
+        store.OrPackedRange(shard_bounds[i_shard][1],results[i_shard].pop('connected_bitmap'))
+
+    for i_shard in range(n_shards) :
+        if results[i_shard] is not None :
+            AddToStore(i_shard)
+
+    def Finish(i_shard,result) :
+        results[i_shard] = result
+        if checkpoint_dir is not None :
+            SaveShardCheckpoint(GetShardCheckpointName(checkpoint_dir,i_shard,n_shards),result,signature)
+        AddToStore(i_shard)
+        if verbose :
+            print('Finished shard {} of {}'.format(i_shard,n_shards))
+
+    todo = list(i for i in range(n_shards) if results[i] is None)
+    args = dict((i,(n_sub,line_or,line_ex) + shard_bounds[i] + (seed_bitsets,keep_connected_bitsets,store is not None)) for i in todo)
+
+    if n_workers == 1 :
+        for i_shard in todo :
+            Finish(i_shard,RunSweepShard(*args[i_shard]))
+    else :
+        with concurrent.futures.ProcessPoolExecutor(max_workers=n_workers) as pool :
+            futures = dict((pool.submit(RunSweepShard,*args[i]),i) for i in todo)
+            for future in concurrent.futures.as_completed(futures) :
+                Finish(futures[future],future.result())
+
+    merged = MergeShardResults(results,n_line,seed_bitsets=seed_bitsets)
+    if store is not None :
+        n_connected,n_unconnected,minimum_cut_bitsets,connected_bitsets,histo_connected,histo_disconnected = merged
+        store.Flush()
+        store.SaveSummary(n_connected,n_unconnected,minimum_cut_bitsets,histo_connected,histo_disconnected)
+        merged = (n_connected,n_unconnected,minimum_cut_bitsets,store,histo_connected,histo_disconnected)
+    return merged
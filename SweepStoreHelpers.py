@@ -0,0 +1,209 @@
+# Compact, memory-mapped store of the results of a line-status sweep (see SweepHelpers):
+#  - connectivity of every line bitset, as a bitmap of 2^n_line bits (bit b set: bitset b is connected)
+#  - the minimum-cut bitsets and the histograms (per number of connected lines), as columnar arrays
+# Everything is kept in a directory of .npy files (plus a small json file of metadata), so that later
+# stages can read the results (memory-mapped) without recomputing or materializing python lists.
+# Stores of different runs on the same number of lines can be combined with set operations
+# (Union, Intersection, Difference and SymmetricDifference).
+
+import json
+import math
+import os
+import CommonHelpers
+import numpy as np
+
+class SweepResultStore :
+
+    # Open the store in "directory". If n_line is given, the store is created if it does not exist
+    # (or if it was made for a different signature, e.g. another grid, in which case it is reset).
+    #
+    # The bitmap is a little-endian uint64 array: bitset b is bit (b & 63) of word (b >> 6).
+    # The bitmap is opened read-write; the other arrays are read-only (SaveSummary replaces them).
+
+    def __init__(self,directory,n_line=None,signature=None) :
+        self.directory = directory
+        meta_filename = self.FileName('meta.json')
+
+        meta = None
+        if os.path.exists(meta_filename) :
+            with open(meta_filename) as f :
+                meta = json.load(f)
+            if n_line is not None and (meta['n_line'] != n_line or
+                                       (signature is not None and meta['signature'] != list(int(a) for a in signature))) :
+                print('Warning: the store in {} was made for a different grid. Resetting it.'.format(directory))
+                meta = None
+
+        if meta is None :
+            if n_line is None :
+                raise IOError('No sweep result store in {}'.format(directory))
+            os.makedirs(directory,exist_ok=True)
+            meta = {'n_line' : n_line,
+                    'signature' : list(int(a) for a in signature) if signature is not None else None,
+                    'n_connected' : None,
+                    'n_unconnected' : None}
+            n_words = max(1,(0b1 << n_line) >> 6)
+            bitmap = np.lib.format.open_memmap(self.FileName('connected.npy'),mode='w+',dtype='<u8',shape=(n_words,))
+            del bitmap
+            self.meta = meta
+            self.SaveSummary(None,None,[],np.zeros(n_line+1,dtype=np.int64),np.zeros(n_line+1,dtype=np.int64))
+
+        self.meta = meta
+        self.n_line = meta['n_line']
+        self.n_bitsets = 0b1 << self.n_line
+        self.bitmap = np.load(self.FileName('connected.npy'),mmap_mode='r+')
+        self.LoadColumns()
+
+    def FileName(self,name) :
+        return os.path.join(self.directory,name)
+
+    def LoadColumns(self) :
+        self.minimum_cut_bitsets = np.load(self.FileName('minimum_cut_bitsets.npy'),mmap_mode='r')
+        self.histo_connected = np.load(self.FileName('histo_connected.npy'),mmap_mode='r')
+        self.histo_disconnected = np.load(self.FileName('histo_disconnected.npy'),mmap_mode='r')
+        return
+
+    def SaveArray(self,name,array) :
+        # Write to a temporary file first, so that readers never see a partial file.
+        filename = self.FileName(name)
+        tmp_filename = '{}.{}.tmp.npy'.format(filename[:-4],os.getpid())
+        np.save(tmp_filename,array)
+        os.replace(tmp_filename,filename)
+        return
+
+    def SaveSummary(self,n_connected,n_unconnected,minimum_cut_bitsets,histo_connected,histo_disconnected) :
+        # The minimum cuts and histograms (columnar arrays), and the counts (in the metadata).
+        self.SaveArray('minimum_cut_bitsets.npy',np.array(list(minimum_cut_bitsets),dtype=np.uint64))
+        self.SaveArray('histo_connected.npy',np.asarray(histo_connected,dtype=np.int64))
+        self.SaveArray('histo_disconnected.npy',np.asarray(histo_disconnected,dtype=np.int64))
+        self.meta['n_connected'] = None if n_connected is None else int(n_connected)
+        self.meta['n_unconnected'] = None if n_unconnected is None else int(n_unconnected)
+        tmp_filename = self.FileName('meta.json.{}.tmp'.format(os.getpid()))
+        with open(tmp_filename,'w') as f :
+            json.dump(self.meta,f)
+        os.replace(tmp_filename,self.FileName('meta.json'))
+        if hasattr(self,'bitmap') :
+            self.LoadColumns()
+        return
+
+    def Summarize(self) :
+        # Recompute the counts and histograms from the bitmap (e.g. after a set operation).
+        # The minimum cuts cannot be recovered from the bitmap and are left empty.
+        histo_connected = self.ComputeHistogram()
+        n_connected = int(histo_connected.sum())
+        binomial = np.array(list(math.comb(self.n_line,k) for k in range(self.n_line+1)),dtype=np.int64)
+        self.SaveSummary(n_connected,self.n_bitsets - n_connected,[],histo_connected,binomial - histo_connected)
+        return
+
+    def Flush(self) :
+        self.bitmap.flush()
+        return
+
+    def SetConnected(self,bitsets) :
+        # Mark these line bitsets as connected
+        bitsets = np.asarray(bitsets,dtype=np.uint64)
+        np.bitwise_or.at(self.bitmap,(bitsets >> np.uint64(6)).astype(np.int64),np.uint64(1) << (bitsets & np.uint64(63)))
+        return
+
+    def OrPackedRange(self,low,packed,chunk_size=1 << 20) :
+        # OR a packed bitmap (uint8, little bit order, e.g. from RunSweepShard) of the bitsets
+        # low, low+1, ... into the store. low does not have to be a multiple of 8.
+        as_bytes = self.bitmap.view(np.uint8)
+        packed = np.asarray(packed,dtype=np.uint8)
+        shift = low % 8
+        for first in range(0,len(packed),chunk_size) :
+            chunk = packed[first:first+chunk_size]
+            if shift :
+                bits = np.unpackbits(chunk,bitorder='little')
+                chunk = np.packbits(np.concatenate([np.zeros(shift,dtype=np.uint8),bits]),bitorder='little')
+            start = low//8 + first
+            # (Trailing bytes past the end of the bitmap can only hold zeros)
+            chunk = chunk[:max(0,len(as_bytes) - start)]
+            as_bytes[start:start+len(chunk)] |= chunk
+        return
+
+    def IsConnected(self,bitsets) :
+        # Boolean array: is every line bitset connected
+        bitsets = np.asarray(bitsets,dtype=np.uint64)
+        words = self.bitmap[(bitsets >> np.uint64(6)).astype(np.int64)]
+        return ((words >> (bitsets & np.uint64(63))) & np.uint64(1)).astype(bool)
+
+    def CountConnected(self,chunk_size=1 << 16) :
+        return int(sum(CommonHelpers.Popcount(self.bitmap[first:first+chunk_size]).sum()
+                       for first in range(0,len(self.bitmap),chunk_size)))
+
+    def __len__(self) :
+        if self.meta['n_connected'] is not None :
+            return self.meta['n_connected']
+        return self.CountConnected()
+
+    def IterateConnected(self,batch_size=65536,descending=True,chunk_size=1 << 16) :
+        # Stream the connected bitsets, as uint64 arrays of up to batch_size bitsets.
+        # Descending (the default) is the order of the notebook's connected_bitsets list.
+        n_words = len(self.bitmap)
+        firsts = range(0,n_words,chunk_size)
+        if descending :
+            firsts = reversed(firsts)
+
+        pending = []
+        n_pending = 0
+        for first in firsts :
+            words = np.ascontiguousarray(self.bitmap[first:first+chunk_size])
+            if not words.any() :
+                continue
+            bits = np.unpackbits(words.view(np.uint8),bitorder='little')[:self.n_bitsets - 64*first]
+            found = np.flatnonzero(bits).astype(np.uint64) + np.uint64(64*first)
+            if descending :
+                found = found[::-1]
+            pending.append(found)
+            n_pending += len(found)
+            while n_pending >= batch_size :
+                merged = np.concatenate(pending)
+                yield merged[:batch_size]
+                pending = [merged[batch_size:]]
+                n_pending -= batch_size
+
+        if n_pending :
+            yield np.concatenate(pending)
+        return
+
+    def __iter__(self) :
+        for batch in self.IterateConnected() :
+            for bits in batch.tolist() :
+                yield bits
+
+    def ComputeHistogram(self) :
+        # Number of connected bitsets per number of connected lines, from the bitmap
+        histo = np.zeros(self.n_line+1,dtype=np.int64)
+        for batch in self.IterateConnected(descending=False) :
+            histo += np.bincount(CommonHelpers.Popcount(batch),minlength=self.n_line+1)
+        return histo
+
+    def Combine(self,other,operation,directory,chunk_size=1 << 16) :
+        # New store in "directory" with the bitmap (self operation other), where operation is
+        # 'and', 'or', 'xor' or 'andnot' (connected here but not in other).
+        # The counts and histograms of the new store are recomputed from its bitmap.
+        if other.n_line != self.n_line :
+            raise ValueError('Cannot combine stores of {} and {} lines'.format(self.n_line,other.n_line))
+        operations = {'and' : lambda a,b : a & b,
+                      'or' : lambda a,b : a | b,
+                      'xor' : lambda a,b : a ^ b,
+                      'andnot' : lambda a,b : a & ~b}
+        combined = SweepResultStore(directory,n_line=self.n_line,signature=self.meta['signature'])
+        for first in range(0,len(self.bitmap),chunk_size) :
+            combined.bitmap[first:first+chunk_size] = operations[operation](self.bitmap[first:first+chunk_size],
+                                                                            other.bitmap[first:first+chunk_size])
+        combined.Flush()
+        combined.Summarize()
+        return combined
+
+    def Union(self,other,directory) :
+        return self.Combine(other,'or',directory)
+
+    def Intersection(self,other,directory) :
+        return self.Combine(other,'and',directory)
+
+    def Difference(self,other,directory) :
+        return self.Combine(other,'andnot',directory)
+
+    def SymmetricDifference(self,other,directory) :
+        return self.Combine(other,'xor',directory)
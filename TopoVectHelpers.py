@@ -0,0 +1,120 @@
+# Helper functions to convert between grid2op topo_vect arrays (bus 1, bus 2 or -1 = disconnected,
+# for every element) and the bitsets used here: the bus state of every substation (bit i set:
+# the element at local position i is on bus 1, see Substation) and the line bitset (lineOnBits).
+# Input includes grid2op environment (or any object with the same sub_info and *_to_subid,
+# *_to_sub_pos arrays)
+
+import CommonHelpers
+import numpy as np
+
+class TopoVectCodec :
+
+    # The gather/scatter index tables are computed once from the env's position arrays. Every
+    # conversion is then a few whole-array operations on a batch of topo_vect rows (processed in
+    # chunks of chunk_size rows, to bound the memory use).
+    #
+    # Conventions: a line is on if both of its ends are connected. Disconnected elements (-1), and
+    # both ends of a disconnected line, are encoded on bus "1" (as in the bus rules of
+    # BusTopologyHelpers). Decoding puts the ends of disconnected lines at -1, so the result can be
+    # used directly as a set_bus action.
+
+    def __init__(self,_env,chunk_size=65536) :
+        self.chunk_size = chunk_size
+        self.sub_info = np.asarray(_env.sub_info,dtype=np.int64)
+        self.n_sub = len(self.sub_info)
+        self.n_line = _env.n_line
+        self.dim_topo = int(self.sub_info.sum())
+
+        # Start of every substation in topo_vect (as grid2op's *_pos_topo_vect)
+        self.sub_start = np.concatenate([[0],np.cumsum(self.sub_info)[:-1]]).astype(np.int64)
+
+        def TopoVectPositions(subid,sub_pos) :
+            return self.sub_start[np.asarray(subid,dtype=np.int64)] + np.asarray(sub_pos,dtype=np.int64)
+
+        self.line_or_pos_topo_vect = TopoVectPositions(_env.line_or_to_subid,_env.line_or_to_sub_pos)
+        self.line_ex_pos_topo_vect = TopoVectPositions(_env.line_ex_to_subid,_env.line_ex_to_sub_pos)
+        self.gen_pos_topo_vect = TopoVectPositions(_env.gen_to_subid,_env.gen_to_sub_pos)
+        self.load_pos_topo_vect = TopoVectPositions(_env.load_to_subid,_env.load_to_sub_pos)
+
+        # For every topo_vect position: its substation, and its bit in the substation bus state
+        self.element_sub = np.repeat(np.arange(self.n_sub,dtype=np.int64),self.sub_info)
+        self.element_bit = np.arange(self.dim_topo,dtype=np.int64) - self.sub_start[self.element_sub]
+        self.element_weight = np.int64(1) << self.element_bit
+
+        # Substations with elements (reduceat over the start of an empty substation would give the
+        # first element of the next one, instead of 0)
+        self.nonempty_subs = np.flatnonzero(self.sub_info > 0)
+
+        # Line bitsets are uint64 if they fit, python ints otherwise
+        self.line_bits_dtype = np.uint64 if self.n_line <= 64 else object
+        return
+
+    def EncodeLinesOn(self,topo_vect) :
+        # Boolean array (n_rows,n_line): both ends of the line are connected
+        topo_vect = np.atleast_2d(topo_vect)
+        return (topo_vect[:,self.line_or_pos_topo_vect] > 0) & (topo_vect[:,self.line_ex_pos_topo_vect] > 0)
+
+    def LinesOnToBitsets(self,lines_on) :
+        # Boolean array (n_rows,n_line) to line bitsets (lineOnBits)
+        if self.n_line <= 64 :
+            weights = np.uint64(1) << np.arange(self.n_line,dtype=np.uint64)
+            return np.bitwise_or.reduce(np.where(lines_on,weights,np.uint64(0)),axis=1)
+        packed = np.packbits(lines_on,axis=1,bitorder='little')
+        return np.array(list(int.from_bytes(row.tobytes(),'little') for row in packed),dtype=object)
+
+    def Encode(self,topo_vect) :
+        # topo_vect: array of shape (n_rows,dim_topo) (or a single row).
+        # Returns (bus_states,line_bits): the bus state of every substation, shape (n_rows,n_sub),
+        # and the line bitset of every row, shape (n_rows,).
+        topo_vect = np.atleast_2d(topo_vect)
+        n_rows = len(topo_vect)
+        bus_states = np.zeros((n_rows,self.n_sub),dtype=np.int64)
+        line_bits = np.zeros(n_rows,dtype=self.line_bits_dtype)
+        for first in range(0,n_rows,self.chunk_size) :
+            chunk = topo_vect[first:first+self.chunk_size]
+            lines_on = self.EncodeLinesOn(chunk)
+            on_bus1 = (chunk != 2)
+            # Both ends of a disconnected line go on bus 1
+            i_row,i_line = np.nonzero(~lines_on)
+            on_bus1[i_row,self.line_or_pos_topo_vect[i_line]] = True
+            on_bus1[i_row,self.line_ex_pos_topo_vect[i_line]] = True
+            # Sum the bit weights of the elements on bus 1, substation by substation
+            if len(self.nonempty_subs) :
+                sums = np.add.reduceat(np.where(on_bus1,self.element_weight,0),
+                                       self.sub_start[self.nonempty_subs],axis=1)
+                bus_states[first:first+len(chunk),self.nonempty_subs] = sums
+            line_bits[first:first+len(chunk)] = self.LinesOnToBitsets(lines_on)
+        return bus_states,line_bits
+
+    def Decode(self,bus_states,line_bits=None) :
+        # Inverse of Encode: bus_states of shape (n_rows,n_sub) and line bitsets of shape (n_rows,)
+        # (None, or negative bitsets, mean that all lines are on).
+        # Returns topo_vect of shape (n_rows,dim_topo) with values 1, 2 or -1.
+        bus_states = np.atleast_2d(np.asarray(bus_states,dtype=np.int64))
+        n_rows = len(bus_states)
+        topo_vect = np.zeros((n_rows,self.dim_topo),dtype=np.int32)
+        for first in range(0,n_rows,self.chunk_size) :
+            chunk = bus_states[first:first+self.chunk_size]
+            on_bus1 = (chunk[:,self.element_sub] >> self.element_bit) & 1
+            topo_chunk = (2 - on_bus1).astype(np.int32)
+
+            if line_bits is not None :
+                chunk_bits = np.asarray(line_bits)[first:first+self.chunk_size]
+                lines_off = ~CommonHelpers.BitsetsToBoolArray(chunk_bits,self.n_line)
+                i_row,i_line = np.nonzero(lines_off)
+                topo_chunk[i_row,self.line_or_pos_topo_vect[i_line]] = -1
+                topo_chunk[i_row,self.line_ex_pos_topo_vect[i_line]] = -1
+            topo_vect[first:first+len(chunk)] = topo_chunk
+        return topo_vect
+
+    def EncodeSubstations(self,topo_vect,sub_classes) :
+        # Set the currentBusConfig of every substation from one topo_vect. Returns the line bitset.
+        bus_states,line_bits = self.Encode(topo_vect)
+        for sub,bits in zip(sub_classes,bus_states[0]) :
+            sub.SetBusConfig(int(bits))
+        return int(line_bits[0])
+
+    def DecodeSubstations(self,sub_classes,lineOnBits=-1) :
+        # The topo_vect (one row) of the currentBusConfig of every substation and this line bitset.
+        bus_states = list(sub.currentBusConfig for sub in sub_classes)
+        return self.Decode([bus_states],[lineOnBits])[0]
@@ -2,55 +2,130 @@
 # Input includes grid2op environment
 
 import CommonHelpers
+import InstrumentationHelpers
+import collections
+import contextlib
+import heapq
+import itertools
+import random
 import numpy as np
 
-def MakeAdjacencyMatrix(_env,n_buses=2,skipExternals=False,printLineIDs=False,lineOnBits=-1) :
-    # Given an environment, make the adjacency matrix
-    # (assuming all lines are on, and all buses are fully connected).
-
-    n_entries = len(_env.sub_info)
-    if not skipExternals : 
-        n_entries += _env.n_gen + _env.n_load
-
-    if n_buses == 2 :
-        n_entries += len(_env.sub_info)
-
-    fill_value = -1 if printLineIDs else 0
-    adj_matrix = np.full(shape=[n_entries,n_entries],fill_value=fill_value)
+class AdjacencyMatrixBuilder :
+
+    # Precomputes the row/column indices of every line, generator and load once per environment,
+    # so that adjacency and Laplacian matrices can then be produced by fancy-index scatter
+    # (instead of per-element python loops). The batch versions take an array of lineOnBits
+    # and return a stacked array of shape (n_bitsets,n_entries,n_entries).
+
+    def __init__(self,_env,n_buses=2,skipExternals=False) :
+        self.n_buses = n_buses
+        self.skipExternals = skipExternals
+        self.n_sub = len(_env.sub_info)
+        self.n_line = _env.n_line
+
+        self.n_entries = self.n_sub
+        if not skipExternals :
+            self.n_entries += _env.n_gen + _env.n_load
+        if n_buses == 2 :
+            self.n_entries += self.n_sub
+
+        # Lines connect bus "1" (index 0) of the origin and extremity substations
+        self.line_or = n_buses*np.asarray(_env.line_or_to_subid,dtype=np.int64)
+        self.line_ex = n_buses*np.asarray(_env.line_ex_to_subid,dtype=np.int64)
+        self.line_ids = np.arange(self.n_line)
+
+        # Generators, then loads, are placed after the substation buses
+        offset = n_buses*self.n_sub
+        self.ext_rows = np.arange(offset,offset + _env.n_gen + _env.n_load)
+        self.ext_cols = n_buses*np.concatenate([np.asarray(_env.gen_to_subid,dtype=np.int64),
+                                                np.asarray(_env.load_to_subid,dtype=np.int64)])
+        if skipExternals :
+            self.ext_rows = self.ext_rows[:0]
+            self.ext_cols = self.ext_cols[:0]
+
+        # Laplacian diagonal (when externals are included): sub_info on bus 1, one for each external
+        self.diag_rows = np.concatenate([n_buses*np.arange(self.n_sub),self.ext_rows])
+        self.diag_vals = np.concatenate([np.asarray(_env.sub_info,dtype=np.int64),
+                                         np.ones(len(self.ext_rows),dtype=np.int64)])
+        return
 
-    for i in range(_env.n_line) :
+    def LineOnMask(self,lineOnBits=-1) :
+        return CommonHelpers.BitsetToBoolArray(lineOnBits,self.n_line)
 
-        if (lineOnBits >= 0) and not ((0b1 << i) & lineOnBits) :
-            #print('line is turned off:',i)
-            continue
+    def MakeAdjacencyMatrix(self,lineOnBits=-1,printLineIDs=False) :
+        fill_value = -1 if printLineIDs else 0
+        adj_matrix = np.full(shape=[self.n_entries,self.n_entries],fill_value=fill_value,dtype=np.int64)
 
-        val = i if printLineIDs else 1
-        bus = 0
-        lor = n_buses*(_env.line_or_to_subid[i]) + bus
-        lex = n_buses*(_env.line_ex_to_subid[i]) + bus
-        adj_matrix[lor][lex] = val
-        adj_matrix[lex][lor] = val
+        on = self.LineOnMask(lineOnBits)
+        val = self.line_ids[on] if printLineIDs else 1
+        adj_matrix[self.line_or[on],self.line_ex[on]] = val
+        adj_matrix[self.line_ex[on],self.line_or[on]] = val
 
-    if skipExternals :
+        adj_matrix[self.ext_rows,self.ext_cols] = 1
+        adj_matrix[self.ext_cols,self.ext_rows] = 1
         return adj_matrix
 
-    for i in range(_env.n_gen) :
-        bus = 0
-        offset = n_buses*len(_env.sub_info)
-        gi = i + offset
-        sub = n_buses*(_env.gen_to_subid[i]) + bus
-        adj_matrix[gi][sub] = 1
-        adj_matrix[sub][gi] = 1
+    def MakeAdjacencyMatrices(self,lineOnBitsArray) :
+        on = CommonHelpers.BitsetsToBoolArray(lineOnBitsArray,self.n_line)
+        n_batch = len(on)
+        adj_matrices = np.zeros(shape=[n_batch,self.n_entries,self.n_entries],dtype=np.int64)
+
+        i_batch,i_line = np.nonzero(on)
+        adj_matrices[i_batch,self.line_or[i_line],self.line_ex[i_line]] = 1
+        adj_matrices[i_batch,self.line_ex[i_line],self.line_or[i_line]] = 1
+
+        adj_matrices[:,self.ext_rows,self.ext_cols] = 1
+        adj_matrices[:,self.ext_cols,self.ext_rows] = 1
+        return adj_matrices
+
+    def GetEdges(self,lineOnBits=-1) :
+        # Return the (rows,cols) edge list for this line bitset (lines, then externals)
+        on = self.LineOnMask(lineOnBits)
+        rows = np.concatenate([self.line_or[on],self.ext_rows])
+        cols = np.concatenate([self.line_ex[on],self.ext_cols])
+        return rows,cols
+
+    def GetComponentLabels(self,lineOnBits=-1) :
+        # Connected components straight from the edge list (no matrix is built).
+        # Bus 2 of every substation is not connected here, so it is an unused bus. A substation
+        # with nothing connected to bus 1 is its own component (i.e. the grid is not connected).
+        # Returns (labels,n_components,unused_buses).
+        rows,cols = self.GetEdges(lineOnBits)
+        unused_buses = []
+        if self.n_buses == 2 :
+            unused_buses = list(range(1,2*self.n_sub,2))
+        labels,n_components = GetComponentLabels(self.n_entries,rows,cols,unused_buses=unused_buses)
+        return labels,n_components,unused_buses
+
+    def IsConnected(self,lineOnBits=-1) :
+        labels,n_components,unused_buses = self.GetComponentLabels(lineOnBits)
+        return n_components <= 1
+
+    def MakeLaplacian(self,lineOnBits=-1) :
+        return self.MakeLaplacians([lineOnBits])[0]
+
+    def MakeLaplacians(self,lineOnBitsArray,sparse=False) :
+        # If sparse, return a list of scipy CSR matrices instead of a stacked dense array.
+        lap_matrices = -1*self.MakeAdjacencyMatrices(lineOnBitsArray)
+        diag = np.arange(self.n_entries)
+
+        if self.skipExternals :
+            lap_matrices[:,diag,diag] = -lap_matrices.sum(axis=2)
+        else :
+            lap_matrices[:,self.diag_rows,self.diag_rows] = self.diag_vals
+
+        if sparse :
+            import scipy.sparse
+            return list(scipy.sparse.csr_matrix(a) for a in lap_matrices)
+        return lap_matrices
 
-    for i in range(_env.n_load) :
-        bus = 0
-        offset = n_buses*len(_env.sub_info) + _env.n_gen
-        li = i + offset
-        sub = n_buses*(_env.load_to_subid[i]) + bus
-        adj_matrix[li][sub] = 1
-        adj_matrix[sub][li] = 1
 
-    return adj_matrix
+def MakeAdjacencyMatrix(_env,n_buses=2,skipExternals=False,printLineIDs=False,lineOnBits=-1) :
+    # Given an environment, make the adjacency matrix
+    # (assuming all lines are on, and all buses are fully connected).
+    # For repeated calls on the same environment, use AdjacencyMatrixBuilder directly.
+    builder = AdjacencyMatrixBuilder(_env,n_buses=n_buses,skipExternals=skipExternals)
+    return builder.MakeAdjacencyMatrix(lineOnBits=lineOnBits,printLineIDs=printLineIDs)
 
 
 class AdjacencyMatrixClass :
@@ -60,11 +135,28 @@ class AdjacencyMatrixClass :
                                                     n_buses=2,
                                                     skipExternals=False,
                                                     lineOnBits=lineOnBits)
-        self.lineOnBits = lineOnBits
+        self.n_entries = len(self.adjacency_matrix)
+        self.InitState(env,lineOnBits)
+
+    def InitState(self,env,lineOnBits) :
+        # Everything but the matrix itself (shared with PackedAdjacencyMatrixClass)
+        self.lineOnBits = int(lineOnBits)
+        self.n_line = env.n_line
         self.n_sub = len(env.sub_info)
         self.n_gen = env.n_gen
         self.n_load = env.n_load
 
+        # Undo journal of (row,col,old value) for every changed cell, and of (sub_index,old bus state)
+        # for every fingerprint change, and the lengths of both journals at each savepoint.
+        # Changes are only journaled while a savepoint is active.
+        self.journal = []
+        self.fingerprint_journal = []
+        self.savepoints = []
+
+        # Optional topology fingerprint and connectivity cache (see EnableConnectivityCache)
+        self.fingerprint = None
+        self.connectivity_cache = None
+
     def GetMatrixHeader(self) :
         col_s = ''.join('s{:02d} '.format(a) for a in range(self.n_sub))
         col_g = ''.join('g ' for a in range(self.n_gen))
@@ -94,13 +186,76 @@ class AdjacencyMatrixClass :
         # Bus ID is stored in the decimal. Return "bus 1" version
         return 2*int(np.round( (elementID - int(elementID))*1000 , 0))
 
+    # Cell access. (Overridden by PackedAdjacencyMatrixClass, which stores the matrix as bits.)
+    def GetEntry(self,i,j) :
+        return self.adjacency_matrix[i][j]
+
+    def SetEntry(self,i,j,value) :
+        self.adjacency_matrix[i][j] = value
+
+    # Vectorized cell access: arrays of rows and cols. If a cell is repeated, the last value wins.
+    def GetEntries(self,rows,cols) :
+        return self.adjacency_matrix[rows,cols]
+
+    def SetEntries(self,rows,cols,values) :
+        rows,cols,values = self.LastOfRepeatedCells(rows,cols,values)
+        self.adjacency_matrix[rows,cols] = values
+
+    def LastOfRepeatedCells(self,rows,cols,values) :
+        # Keep only the last value of repeated cells (numpy fancy assignment does not say which
+        # of the repeated writes wins).
+        rows = np.asarray(rows,dtype=np.int64)
+        cols = np.asarray(cols,dtype=np.int64)
+        values = np.asarray(values)
+        flat = rows*self.n_entries + cols
+        unique_flat,last = np.unique(flat[::-1],return_index=True)
+        keep = len(flat) - 1 - last
+        return rows[keep],cols[keep],values[keep]
+
+    def Neighbors(self,i_vert) :
+        return np.flatnonzero(self.adjacency_matrix[i_vert] == 1)
+
     def FindFullyDisconnectedBuses(self) :
         return FindFullyDisconnectedBuses(self.adjacency_matrix,self.n_sub)
 
+    def GetDisjointSetsOfMatrix(self,unused_buses=[]) :
+        return GetDisjointSets(self.adjacency_matrix,unused_buses=unused_buses)
+
+    def EnableConnectivityCache(self,sub_classes,max_size=65536,cache=None,seed=0) :
+        # Track the TopologyFingerprint of this matrix (lineOnBits and the currentBusConfig of
+        # sub_classes, which should be the bus configs applied to this matrix), and memoize
+        # GetDisjointSets in a ConnectivityCache keyed by it. The cache can be shared between
+        # matrices of the same grid. Bus configs must then be changed through
+        # Substation.ApplyBusConfig (or TryBusConfig), which update the fingerprint.
+        self.fingerprint = TopologyFingerprint(sub_classes,self.n_line,self.lineOnBits,seed=seed)
+        self.connectivity_cache = cache if cache is not None else ConnectivityCache(max_size)
+        return self.connectivity_cache
+
+    def UpdateFingerprint(self,sub_index,busConfig) :
+        # Called by Substation.ApplyBusConfig, when the bus config is applied to this matrix
+        if self.fingerprint is not None :
+            if self.savepoints :
+                self.fingerprint_journal.append((sub_index,self.fingerprint.busConfigs[sub_index]))
+            self.fingerprint.SetBusConfig(sub_index,busConfig)
+        return
+
     def GetDisjointSets(self) :
 
+        if self.connectivity_cache is not None :
+            # (The cached dict is shared: do not modify it.)
+            disjoint_sets = self.connectivity_cache.Get(self.fingerprint.value)
+            if disjoint_sets is None :
+                disjoint_sets = self.ComputeDisjointSets()
+                self.connectivity_cache.Put(self.fingerprint.value,disjoint_sets)
+            return disjoint_sets
+
+        return self.ComputeDisjointSets()
+
+    def ComputeDisjointSets(self) :
+
+        start = InstrumentationHelpers.Start()
         disabled = self.FindFullyDisconnectedBuses()
-        disjoint_sets = GetDisjointSets(self.adjacency_matrix,unused_buses=disabled)
+        disjoint_sets = self.GetDisjointSetsOfMatrix(unused_buses=disabled)
 
         # If a substation is completely disconnected, then consider this illegal.
         # Put the substation in the list of disjoint sets.
@@ -109,77 +264,437 @@ class AdjacencyMatrixClass :
                 #print('We have a fully-disconnected substation. Bad.')
                 disjoint_sets[i] = i
 
+        InstrumentationHelpers.Stop('AdjacencyMatrixClass.GetDisjointSets',start)
         return disjoint_sets
 
 
     def SetListOfElementsToBusN(self,busIndex,whichBus,elementIDs) :
-        i = 2*busIndex + (whichBus - 1)
-        i_off = 2*busIndex + 1 - (whichBus - 1)
-        for elementID in elementIDs :
-            j = self.ElementIDToAdjacencyIndex(elementID)
-
-            # If it is a substation, gotta figure out which bus is active.
-            if j < 2*self.n_sub :
-                if self.adjacency_matrix[i][j] or self.adjacency_matrix[i_off][j] :
-                    j = j
-                elif self.adjacency_matrix[i][j+1] or self.adjacency_matrix[i_off][j+1] :
-                    j = j+1
-                else :
-                    # The line must be turned off. Do nothing.
-                    txt = 'No connection found b/w {} and {} -- probably the line is off.'
-                    txt2 = '(This is okay!)'
-                    #print(txt.format(i,j),txt2)
-                    continue
+        # elementIDs can be the float element IDs, or rows of a Substation element table.
+        if getattr(elementIDs,'dtype',None) is not None and elementIDs.dtype.names :
+            adjacencyIndices = elementIDs['adjacency_index']
+        else :
+            adjacencyIndices = list(self.ElementIDToAdjacencyIndex(elementID) for elementID in elementIDs)
+        onBus1 = np.full(len(adjacencyIndices),whichBus == 1)
+        self.SetElementsToBuses(busIndex,adjacencyIndices,onBus1)
+        return
 
-            sthChanged = 'no change' if (self.adjacency_matrix[i][j] == 1 and
-                                         self.adjacency_matrix[i_off][j] == 0) else 'changed'
-            #print('Bus {} switch: ({},{}) to ({},{}) ({})'.format(whichBus,i_off,j,i,j,sthChanged))
-            self.adjacency_matrix[i][j] = 1
-            self.adjacency_matrix[j][i] = 1
-            self.adjacency_matrix[i_off][j] = 0
-            self.adjacency_matrix[j][i_off] = 0
+    def SetElementsToBuses(self,busIndex,adjacencyIndices,onBus1) :
+        # Connect the elements (adjacency indices, see Substation.elements) of substation busIndex
+        # to bus 1 where onBus1 is True, and to bus 2 otherwise, with whole-array cell access.
+        # If two elements write the same cell (parallel lines), the later element wins.
+        j = np.asarray(adjacencyIndices,dtype=np.int64)
+        onBus1 = np.asarray(onBus1,dtype=bool)
+        i = 2*busIndex + np.where(onBus1,0,1)
+        i_off = 2*busIndex + np.where(onBus1,1,0)
+
+        # If it is a substation, gotta figure out which bus is active.
+        # If neither is, the line must be turned off: do nothing for it (this is okay!)
+        is_line = (j < 2*self.n_sub)
+        j_bus2 = np.where(is_line,j+1,j)
+        far_bus1 = (self.GetEntries(i,j) != 0) | (self.GetEntries(i_off,j) != 0)
+        far_bus2 = (self.GetEntries(i,j_bus2) != 0) | (self.GetEntries(i_off,j_bus2) != 0)
+        keep = ~is_line | far_bus1 | far_bus2
+        j = np.where(is_line & ~far_bus1,j_bus2,j)
+        i,i_off,j = i[keep],i_off[keep],j[keep]
+
+        # Cells (i,j),(j,i),(i_off,j),(j,i_off) of every element
+        rows = np.stack([i,j,i_off,j],axis=1)
+        cols = np.stack([j,i,j,i_off],axis=1)
+        values = np.tile(np.array([1,1,0,0]),(len(j),1))
+
+        if self.savepoints :
+            changed = (self.GetEntries(i,j) != 1) | (self.GetEntries(i_off,j) != 0)
+            old_values = self.GetEntries(rows[changed].ravel(),cols[changed].ravel())
+            self.journal.extend(zip(rows[changed].ravel().tolist(),cols[changed].ravel().tolist(),
+                                    np.asarray(old_values).tolist()))
+
+        self.SetEntries(rows.ravel(),cols.ravel(),values.ravel())
         return
 
-def MakeLaplacian(_env,n_buses=2,skipExternals=False,lineOnBits=-1) :
-    # Given an environment, make the Laplacian matrix
-    # (assuming all lines are on, and all buses are fully connected).
+    def Savepoint(self) :
+        # Start journaling changes; Rollback() returns the matrix to this point.
+        # Savepoints can be nested. Returns the savepoint depth.
+        self.savepoints.append((len(self.journal),len(self.fingerprint_journal)))
+        return len(self.savepoints)
+
+    def Rollback(self) :
+        # Undo every change since the last savepoint (in O(changed cells)), and release it.
+        start,fingerprint_start = self.savepoints.pop()
+        for sub_index,busConfig in reversed(self.fingerprint_journal[fingerprint_start:]) :
+            self.fingerprint.SetBusConfig(sub_index,busConfig)
+        del self.fingerprint_journal[fingerprint_start:]
+        if len(self.journal) > start :
+            # In reverse order: the oldest value of a repeated cell is then the last one, which is
+            # the one that SetEntries keeps.
+            rows,cols,values = zip(*reversed(self.journal[start:]))
+            self.SetEntries(np.array(rows),np.array(cols),np.array(values))
+        del self.journal[start:]
+        return
 
-    lap_matrix = -1*MakeAdjacencyMatrix(_env,
-                                        n_buses=n_buses,
-                                        skipExternals=skipExternals,
-                                        lineOnBits=lineOnBits)
+    def Commit(self) :
+        # Keep the changes since the last savepoint, and release it. (The changes can still be
+        # undone by rolling back an enclosing savepoint.)
+        self.savepoints.pop()
+        if not self.savepoints :
+            self.journal = []
+            self.fingerprint_journal = []
+        return
 
-    if skipExternals :
-        for i,row in enumerate(lap_matrix) :
-            lap_matrix[i][i] = -sum(row)
-        return lap_matrix
+    @contextlib.contextmanager
+    def TryBusConfig(self,substation,bits,verbose=False) :
+        # Context manager for "try this bus config": apply the bus config of this substation,
+        # and undo it (in the matrix and the substation) when leaving the block. For example:
+        #     with adj_instance.TryBusConfig(sub_classes[5],0b101110) :
+        #         disjoint_sets = adj_instance.GetDisjointSets()
+        # Calls can be nested, e.g. for a depth-first search over substation configurations.
+        saveBusConfig = substation.currentBusConfig
+        self.Savepoint()
+        try :
+            substation.ApplyBusConfig(bits,self,verbose=verbose)
+            yield self
+        finally :
+            self.Rollback()
+            substation.SetBusConfig(saveBusConfig)
+
+class PackedAdjacencyMatrixClass(AdjacencyMatrixClass) :
+
+    # Same as AdjacencyMatrixClass, but the matrix is stored as packed bit rows: an array of
+    # n_entries x ceil(n_entries/64) uint64 words (64x less memory than the int64 matrix).
+    # Breadth-first search expands a whole frontier at once, as the OR of the frontier rows
+    # AND-NOT the vertices that are already in the set.
+    # The adjacency_matrix attribute is still available (unpacked on demand), e.g. for printing.
+
+    def __init__(self,env,lineOnBits=-1) :
+        builder = AdjacencyMatrixBuilder(env,n_buses=2,skipExternals=False)
+        self.n_entries = builder.n_entries
+        self.n_words = (self.n_entries + 63)//64
+        self.packed_rows = np.zeros((self.n_entries,self.n_words),dtype=np.uint64)
+
+        rows,cols = builder.GetEdges(lineOnBits)
+        self.SetBits(self.packed_rows,rows,cols)
+        self.SetBits(self.packed_rows,cols,rows)
+
+        self.InitState(env,lineOnBits)
+
+    @staticmethod
+    def SetBits(packed,rows,cols) :
+        cols = np.asarray(cols,dtype=np.int64)
+        np.bitwise_or.at(packed,(np.asarray(rows,dtype=np.int64),cols >> 6),np.uint64(1) << (cols & 63).astype(np.uint64))
+
+    def PackIndices(self,indices) :
+        packed = np.zeros((1,self.n_words),dtype=np.uint64)
+        self.SetBits(packed,np.zeros(len(indices),dtype=np.int64),indices)
+        return packed[0]
+
+    def UnpackIndices(self,packed) :
+        # Indices of the set bits (packed can also be a 2D array of rows, giving a 2D boolean array)
+        bits = np.unpackbits(np.ascontiguousarray(packed,dtype='<u8').view(np.uint8),axis=-1,bitorder='little')
+        if bits.ndim > 1 :
+            return bits[...,:self.n_entries].astype(bool)
+        return np.flatnonzero(bits[:self.n_entries])
+
+    @property
+    def adjacency_matrix(self) :
+        return self.UnpackIndices(self.packed_rows).astype(np.int64)
+
+    def GetEntry(self,i,j) :
+        return int((self.packed_rows[i,j >> 6] >> np.uint64(j & 63)) & np.uint64(1))
+
+    def SetEntry(self,i,j,value) :
+        bit = np.uint64(1) << np.uint64(j & 63)
+        if value :
+            self.packed_rows[i,j >> 6] |= bit
+        else :
+            self.packed_rows[i,j >> 6] &= ~bit
+
+    def GetEntries(self,rows,cols) :
+        cols = np.asarray(cols,dtype=np.int64)
+        words = self.packed_rows[np.asarray(rows,dtype=np.int64),cols >> 6]
+        return ((words >> (cols & 63).astype(np.uint64)) & np.uint64(1)).astype(np.int64)
+
+    def SetEntries(self,rows,cols,values) :
+        # Keep the last value of repeated cells, then clear all the bits and set the ones
+        rows,cols,values = self.LastOfRepeatedCells(rows,cols,values)
+        bits = np.uint64(1) << (cols & 63).astype(np.uint64)
+        np.bitwise_and.at(self.packed_rows,(rows,cols >> 6),~bits)
+        on = (values != 0)
+        np.bitwise_or.at(self.packed_rows,(rows[on],cols[on] >> 6),bits[on])
+
+    def Neighbors(self,i_vert) :
+        return self.UnpackIndices(self.packed_rows[i_vert])
+
+    def FindFullyDisconnectedBuses(self) :
+        # A bus is disconnected if its row has no bit set.
+        rows = self.packed_rows[:self.n_sub*2]
+        return list(int(i) for i in np.nonzero(~np.any(rows != 0,axis=1))[0])
+
+    def GetDisjointSetsOfMatrix(self,unused_buses=[]) :
+        # Same output as GetDisjointSets(adjacency_matrix,unused_buses), using bitwise BFS.
+        all_vertices = self.PackIndices(np.arange(self.n_entries))
+        visited = self.PackIndices(unused_buses)
+
+        disjoint_sets = dict()
+        while True :
+            remaining = self.UnpackIndices(all_vertices & ~visited)
+            if not len(remaining) :
+                break
 
-    for i,info in enumerate(_env.sub_info) :
-        lap_matrix[i*n_buses][i*n_buses] = info
+            i_start = int(remaining[0])
+            component = self.PackIndices([i_start])
+            frontier = component
+            while np.any(frontier) :
+                frontier_vertices = self.UnpackIndices(frontier)
+                if InstrumentationHelpers.enabled :
+                    InstrumentationHelpers.Count('PackedAdjacencyMatrixClass.GetDisjointSetsOfMatrix.expansions')
+                    InstrumentationHelpers.Count('PackedAdjacencyMatrixClass.GetDisjointSetsOfMatrix.vertices',len(frontier_vertices))
+                reached = np.bitwise_or.reduce(self.packed_rows[frontier_vertices],axis=0)
+                frontier = reached & ~component
+                component = component | frontier
+
+            visited = visited | component
+            disjoint_sets[i_start] = set(int(i) for i in self.UnpackIndices(component))
 
-    for i in range(_env.n_gen) :
-        bus = 0
-        offset = n_buses*len(_env.sub_info)
-        lap_matrix[i+offset][i+offset] = 1
+        return disjoint_sets
+
+
+class IncrementalConnectivityChecker :
+
+    # Keeps track of whether the grid in an AdjacencyMatrixClass is connected, and re-checks only
+    # the affected buses after a substation bus config is applied.
+    #
+    # If the grid was connected before the move, every piece of the grid that hung off the
+    # substation still hangs off bus 1 or bus 2 after it. So the grid is still connected if and only
+    # if the two buses are still connected to each other (or one of them is unused). This is checked
+    # with a bidirectional search from the two buses, always expanding the smaller frontier, which
+    # stops as soon as the searches meet. If one search runs out first, what it found is the island.
+    # If the grid was not connected before, we fall back to a full GetDisjointSets.
+
+    def __init__(self,adjacency_matrix_class) :
+        self.adj = adjacency_matrix_class
+        self.Reset()
+
+    def Reset(self) :
+        # Recompute the connectivity of the current topology from scratch.
+        self.isConnected,self.islanded = self.CheckFull()
+        return self.isConnected,self.islanded
+
+    def Neighbors(self,i_vert) :
+        return self.adj.Neighbors(i_vert)
+
+    def CheckFull(self) :
+        # Islanded: everything outside the largest connected set.
+        disjoint_sets = self.adj.GetDisjointSets()
+        if len(disjoint_sets) <= 1 :
+            return True,[]
+        sets = list((v if isinstance(v,set) else set([v])) for v in disjoint_sets.values())
+        largest = max(sets,key=len)
+        return False,sorted(i for s in sets if s is not largest for i in s)
+
+    def CheckSubstation(self,sub_index) :
+        # Re-check connectivity after a change of the bus config of substation sub_index.
+        # Returns (isConnected,islanded), where islanded is a sorted list of adjacency indices.
+        if InstrumentationHelpers.enabled :
+            InstrumentationHelpers.Count('IncrementalConnectivityChecker.CheckSubstation.calls')
+        if not self.isConnected :
+            if InstrumentationHelpers.enabled :
+                InstrumentationHelpers.Count('IncrementalConnectivityChecker.CheckSubstation.full_checks')
+            self.isConnected,self.islanded = self.CheckFull()
+            return self.isConnected,self.islanded
+
+        bus1 = 2*sub_index
+        bus2 = 2*sub_index + 1
+        frontiers = [[bus1],[bus2]]
+        visited = [set([bus1]),set([bus2])]
+
+        # A bus with nothing connected is unused (not a split), unless both are.
+        if not len(self.Neighbors(bus1)) or not len(self.Neighbors(bus2)) :
+            if not len(self.Neighbors(bus1)) and not len(self.Neighbors(bus2)) :
+                self.isConnected,self.islanded = False,[bus1,bus2]
+            else :
+                self.isConnected,self.islanded = True,[]
+            return self.isConnected,self.islanded
+
+        while True :
+            side = 0 if len(frontiers[0]) <= len(frontiers[1]) else 1
+            other = 1 - side
+            next_frontier = []
+            if InstrumentationHelpers.enabled :
+                InstrumentationHelpers.Count('IncrementalConnectivityChecker.CheckSubstation.vertices',len(frontiers[side]))
+            for i_vert in frontiers[side] :
+                for j_vert in self.Neighbors(i_vert) :
+                    j_vert = int(j_vert)
+                    if j_vert in visited[other] :
+                        self.isConnected,self.islanded = True,[]
+                        return self.isConnected,self.islanded
+                    if j_vert not in visited[side] :
+                        visited[side].add(j_vert)
+                        next_frontier.append(j_vert)
+
+            if not next_frontier :
+                # This side is cut off from the other bus: it is an island.
+                self.isConnected,self.islanded = False,sorted(visited[side])
+                return self.isConnected,self.islanded
+            frontiers[side] = next_frontier
+
+    def ApplyBusConfig(self,substation,bits,verbose=False) :
+        # Apply a bus config (see Substation.ApplyBusConfig) and re-check connectivity.
+        substation.ApplyBusConfig(bits,self.adj,verbose=verbose)
+        return self.CheckSubstation(substation.index)
+
+    @contextlib.contextmanager
+    def TryBusConfig(self,substation,bits,verbose=False) :
+        # Like AdjacencyMatrixClass.TryBusConfig, but yields (isConnected,islanded), and restores the
+        # connectivity state when leaving the block.
+        saveState = (self.isConnected,self.islanded)
+        try :
+            with self.adj.TryBusConfig(substation,bits,verbose=verbose) :
+                yield self.CheckSubstation(substation.index)
+        finally :
+            self.isConnected,self.islanded = saveState
+
+
+MASK64 = (0b1 << 64) - 1
+
+def SplitMix64(x) :
+    # 64-bit integer hash (the SplitMix64 finalizer)
+    x = (x + 0x9E3779B97F4A7C15) & MASK64
+    x = ((x ^ (x >> 30))*0xBF58476D1CE4E5B9) & MASK64
+    x = ((x ^ (x >> 27))*0x94D049BB133111EB) & MASK64
+    return x ^ (x >> 31)
+
+
+class TopologyFingerprint :
+
+    # Zobrist-style 64-bit fingerprint of a global topology: lineOnBits plus the currentBusConfig of
+    # every substation. The fingerprint is the XOR of a random key for every line that is off and of
+    # a key for every (substation,bus state) pair, so the same topology gets the same value whatever
+    # the order of the changes that led to it, and every change is an O(1) update:
+    #  - bus config of a substation: XOR out the key of the old state, XOR in the key of the new one
+    #    (the keys are SplitMix64 hashes of a random per-substation key and the state, so no table
+    #    of 2^nElements keys is needed). The state of every substation is kept here (busConfigs),
+    #    so the old state never has to come from the caller.
+    #  - line toggle: XOR the key of the line
+    # Two different topologies get the same value with a probability of ~2^-64 per pair.
+
+    def __init__(self,sub_classes,n_line,lineOnBits=-1,seed=0) :
+        rng = random.Random(seed)
+        self.n_line = n_line
+        self.all_on = CommonHelpers.FullyConnectedBitset(n_line)
+        self.sub_keys = list(rng.getrandbits(64) for sub in sub_classes)
+        self.line_keys = list(rng.getrandbits(64) for lid in range(n_line))
+        self.value = 0
+        self.busConfigs = [0]*len(sub_classes)
+        for sub in sub_classes :
+            self.busConfigs[sub.index] = int(sub.currentBusConfig)
+            self.value ^= self.BusConfigKey(sub.index,sub.currentBusConfig)
+        self.lineOnBits = self.all_on
+        self.SetLineOnBits(lineOnBits)
+
+    def BusConfigKey(self,sub_index,busConfig) :
+        return SplitMix64(self.sub_keys[sub_index] ^ int(busConfig))
+
+    def SetBusConfig(self,sub_index,busConfig) :
+        busConfig = int(busConfig)
+        self.value ^= self.BusConfigKey(sub_index,self.busConfigs[sub_index]) ^ self.BusConfigKey(sub_index,busConfig)
+        self.busConfigs[sub_index] = busConfig
+        return self.value
+
+    def ToggleLine(self,lineID) :
+        self.value ^= self.line_keys[lineID]
+        self.lineOnBits ^= (0b1 << lineID)
+        return self.value
+
+    def SetLineStatus(self,lineID,on) :
+        if bool((self.lineOnBits >> lineID) & 0b1) != bool(on) :
+            self.ToggleLine(lineID)
+        return self.value
+
+    def SetLineOnBits(self,lineOnBits) :
+        # O(number of changed lines). Negative lineOnBits mean all lines on.
+        lineOnBits = int(lineOnBits)
+        lineOnBits = self.all_on if lineOnBits < 0 else (lineOnBits & self.all_on)
+        changed = self.lineOnBits ^ lineOnBits
+        while changed :
+            lowest = changed & -changed
+            self.value ^= self.line_keys[lowest.bit_length() - 1]
+            changed ^= lowest
+        self.lineOnBits = lineOnBits
+        return self.value
+
+
+class ConnectivityCache :
+
+    # Bounded LRU cache of connectivity results (e.g. the disjoint sets of AdjacencyMatrixClass),
+    # keyed by TopologyFingerprint value, with hit-rate statistics.
+
+    def __init__(self,max_size=65536) :
+        self.max_size = max_size
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) :
+        return len(self.entries)
+
+    def __contains__(self,fingerprint) :
+        return fingerprint in self.entries
+
+    def Get(self,fingerprint) :
+        # The cached result, or None
+        result = self.entries.get(fingerprint)
+        if result is None :
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(fingerprint)
+        return result
+
+    def Put(self,fingerprint,result) :
+        self.entries[fingerprint] = result
+        self.entries.move_to_end(fingerprint)
+        while len(self.entries) > self.max_size :
+            self.entries.popitem(last=False)
+            self.evictions += 1
+        return
+
+    def GetOrCompute(self,fingerprint,compute) :
+        # The cached result, or compute() (which is then cached)
+        result = self.Get(fingerprint)
+        if result is None :
+            result = compute()
+            self.Put(fingerprint,result)
+        return result
+
+    def HitRate(self) :
+        return self.hits/max(1,self.hits + self.misses)
+
+    def Statistics(self) :
+        return {'hits' : self.hits,'misses' : self.misses,'evictions' : self.evictions,
+                'size' : len(self.entries),'max_size' : self.max_size,'hit_rate' : self.HitRate()}
+
+    def Clear(self) :
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        return
 
-    for i in range(_env.n_load) :
-        bus = 0
-        offset = n_buses*len(_env.sub_info) + _env.n_gen
-        lap_matrix[i+offset][i+offset] = 1
 
-    return lap_matrix
+def MakeLaplacian(_env,n_buses=2,skipExternals=False,lineOnBits=-1) :
+    # Given an environment, make the Laplacian matrix
+    # (assuming all lines are on, and all buses are fully connected).
+    # For repeated calls on the same environment, use AdjacencyMatrixBuilder directly.
+    builder = AdjacencyMatrixBuilder(_env,n_buses=n_buses,skipExternals=skipExternals)
+    return builder.MakeLaplacian(lineOnBits=lineOnBits)
 
 
 def IsConnectedLaplacianEigenvalue(_lap_matrix) :
-    evals,evecs = np.linalg.eig(_lap_matrix)
-    #print('Eigenvalues/vectors:')
-    #for i in evals :
-    #    print('{:.01f} + {:.01f}j'.format(i.real,i.imag))
-
-    n_zeroeig = 0
-    for i in evals :
-        if abs(i.real) < 1e-9 :
-            n_zeroeig += 1
+    # The Laplacian is symmetric: use the (real) symmetric eigenvalue solver.
+    # (See SpectralHelpers for the algebraic connectivity, sparse grids and batches.)
+    evals = np.linalg.eigvalsh(_lap_matrix)
+
+    n_zeroeig = np.count_nonzero(np.abs(evals) < 1e-9)
     #print('Number of zero eigenvalues:',n_zeroeig)
 
     return (n_zeroeig <= 1)
@@ -189,92 +704,146 @@ def FindFullyDisconnectedBuses(_adjacency_matrix,n_sub,n_buses=2) :
     # from the grid. Normally, this is fine.
     # If an entire substation is disconnected,
     # then that is a problem which this can help to identify.
-    disabled = []
-    for i,row in enumerate(_adjacency_matrix[:n_sub*n_buses]) :
-        if np.count_nonzero(row) :
+    rows = np.asarray(_adjacency_matrix[:n_sub*n_buses])
+    return list(int(i) for i in np.nonzero(~np.any(rows,axis=1))[0])
+
+class UnionFind :
+
+    # Disjoint-set forest (path compression + union by rank), used to build connected
+    # components straight from an edge list in near-linear time.
+
+    def __init__(self,n_vertices) :
+        self.parent = list(range(n_vertices))
+        self.rank = [0]*n_vertices
+        self.n_sets = n_vertices
+
+    def Find(self,i) :
+        parent = self.parent
+        while parent[i] != i :
+            # Path halving
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    def Union(self,i,j) :
+        ri = self.Find(i)
+        rj = self.Find(j)
+        if ri == rj :
+            return False
+        if self.rank[ri] < self.rank[rj] :
+            ri,rj = rj,ri
+        self.parent[rj] = ri
+        if self.rank[ri] == self.rank[rj] :
+            self.rank[ri] += 1
+        self.n_sets -= 1
+        return True
+
+    def Roots(self) :
+        return list(self.Find(i) for i in range(len(self.parent)))
+
+
+def GetComponentLabels(n_vertices,rows,cols,unused_buses=[]) :
+    # Return (labels,n_components) for the graph given by the edge list (rows[k],cols[k]).
+    # Components are labeled 0,1,2... in order of their lowest vertex index.
+    # Unused buses that do not touch any edge get the label -1 and are not counted.
+    if InstrumentationHelpers.enabled :
+        InstrumentationHelpers.Count('GetComponentLabels.calls')
+        InstrumentationHelpers.Count('GetComponentLabels.vertices',n_vertices)
+        InstrumentationHelpers.Count('GetComponentLabels.edges',len(rows))
+    uf = UnionFind(n_vertices)
+    for i,j in zip(rows,cols) :
+        uf.Union(int(i),int(j))
+
+    # Unused buses that are not touched by any edge are not part of any component
+    isolated_unused = set(unused_buses).difference(int(i) for i in rows).difference(int(j) for j in cols)
+
+    labels = np.full(n_vertices,-1,dtype=np.int64)
+    root_to_label = dict()
+    for i in range(n_vertices) :
+        if i in isolated_unused :
             continue
-        #print(i,'is disconnected')
-        disabled.append(i)
-    return disabled
-
-def IsConnectedManual(_adj_matrix,unused_buses=[]) :
-    i_start = 0
-    SetOfAlreadyTraversed = set([i_start])
-
-    new_vertices = [i_start]
+        labels[i] = root_to_label.setdefault(uf.Find(i),len(root_to_label))
+    return labels,len(root_to_label)
+
+
+def GetComponentLabelsBatch(n_vertices,line_or,line_ex,lines_on) :
+    # Vectorized connected components for a batch of line statuses on the same graph.
+    # lines_on is a boolean array of shape (n_batch,n_line). Returns labels of shape (n_batch,n_vertices),
+    # where each vertex is labeled with the lowest vertex index of its component.
+    # line_or and line_ex have shape (n_line,), or (n_batch,n_line) if the line ends move between
+    # graphs (e.g. different bus configurations).
+    # (Min-label propagation over all edges of all graphs at once, with pointer jumping.)
+    line_or = np.broadcast_to(np.asarray(line_or,dtype=np.int64),np.shape(lines_on))
+    line_ex = np.broadcast_to(np.asarray(line_ex,dtype=np.int64),np.shape(lines_on))
+    n_batch = len(lines_on)
+    labels = np.tile(np.arange(n_vertices,dtype=np.int64),(n_batch,1))
+    i_batch,i_line = np.nonzero(lines_on)
+    flat_or = i_batch*n_vertices + line_or[i_batch,i_line]
+    flat_ex = i_batch*n_vertices + line_ex[i_batch,i_line]
+    offsets = (np.arange(n_batch,dtype=np.int64)*n_vertices)[:,None]
+
+    flat_labels = labels.ravel()
     while True :
-        next_new_vertices = []
-        for i_vert in new_vertices :
-            for j_vert,entry in enumerate(_adj_matrix[i_vert]) :
-                if (entry == 1) and (j_vert not in SetOfAlreadyTraversed) :
-                    SetOfAlreadyTraversed.add(j_vert)
-                    next_new_vertices.append(j_vert)
-
-        # check if there are no new vertices
-        if not len(next_new_vertices) :
-            break
-
-        new_vertices = next_new_vertices
-
-    return len(SetOfAlreadyTraversed) == (len(_adj_matrix) - len(unused_buses))
-
-
-def GetDisjointSets(_adj_matrix,unused_buses=[]) :
-    # Return a dictionary of disjoint sets.
-
-    # Start with the first bus that is in use.
-    for i in range(len(_adj_matrix)) :
-        if i not in unused_buses :
-            i_start = i
+        lowest = np.minimum(flat_labels[flat_or],flat_labels[flat_ex])
+        new_labels = flat_labels.copy()
+        np.minimum.at(new_labels,flat_or,lowest)
+        np.minimum.at(new_labels,flat_ex,lowest)
+        # Pointer jumping: take the label of your label
+        new_labels = new_labels.reshape(n_batch,n_vertices)
+        new_labels = np.take(new_labels.ravel(),(new_labels + offsets).ravel())
+        if np.array_equal(new_labels,flat_labels) :
             break
+        flat_labels = new_labels
 
-    # Consider the case where you might have >1 disjoint sets
-    # Throw unused buses in here, e.g. we know that they should be counted as
-    # belonging to their own set (we will not report them though).
-    AllTraversedVertices = set([i_start] + unused_buses)
+    return flat_labels.reshape(n_batch,n_vertices)
 
-    DisjointSetsOfAlreadyTraversed = dict()
-    DisjointSetsOfAlreadyTraversed[i_start] = set([i_start])
-    CurrentSetOfAlreadyTraversed = DisjointSetsOfAlreadyTraversed[i_start]
 
-    border_vertices = [i_start]
-    while True :
+def GetEdgesFromAdjacencyMatrix(_adj_matrix) :
+    # Return the (rows,cols) of connections in the adjacency matrix (entries equal to 1).
+    return np.nonzero(np.triu(np.asarray(_adj_matrix) == 1))
 
-        #print('border_vertices:',border_vertices)
-        #print('DisjointSetsOfAlreadyTraversed',DisjointSetsOfAlreadyTraversed)
-        #print('All traversed vertices',AllTraversedVertices)
 
-        new_frontier_vertices = []
-        for i_vert in border_vertices :
-            for j_vert,entry in enumerate(_adj_matrix[i_vert]) :
-                if (entry == 1) and (j_vert not in CurrentSetOfAlreadyTraversed) :
-                    CurrentSetOfAlreadyTraversed.add(j_vert)
-                    AllTraversedVertices.add(j_vert)
-                    new_frontier_vertices.append(j_vert)
+def DisjointSetsFromLabels(labels,unused_buses=[]) :
+    # Convert a component label array to the dictionary format of GetDisjointSets:
+    # key is the first (in-use) vertex of the set, value is the set of vertices.
+    # Sets consisting only of unused buses are not reported.
+    unused = set(unused_buses)
+    keys = dict()
+    for i,label in enumerate(labels) :
+        if label >= 0 and label not in keys and i not in unused :
+            keys[label] = i
 
-        # check if there are no new vertices
-        if not len(new_frontier_vertices) :
+    disjoint_sets = dict((k,set()) for k in sorted(keys.values()))
+    for i,label in enumerate(labels) :
+        if label in keys :
+            disjoint_sets[keys[label]].add(i)
+    return disjoint_sets
 
-            # If you traversed every vertex, then break
-            if len(CurrentSetOfAlreadyTraversed) == len(_adj_matrix) :
-                break
 
-            if len(AllTraversedVertices) == len(_adj_matrix) :
-                break
-
-            # If not, start a new Set with the next untouched vertex
-            for i_vert in range(len(_adj_matrix)) :
-                if i_vert in AllTraversedVertices :
-                    continue
-                new_frontier_vertices.append(i_vert)
-                DisjointSetsOfAlreadyTraversed[i_vert] = set([i_vert])
-                CurrentSetOfAlreadyTraversed = DisjointSetsOfAlreadyTraversed[i_vert]
-                AllTraversedVertices.add(i_vert)
-                break
+def IsConnectedManual(_adj_matrix,unused_buses=[]) :
+    # The grid is connected if vertex 0 reaches every vertex that is in use.
+    rows,cols = GetEdgesFromAdjacencyMatrix(_adj_matrix)
+    if InstrumentationHelpers.enabled :
+        InstrumentationHelpers.Count('IsConnectedManual.calls')
+        InstrumentationHelpers.Count('IsConnectedManual.vertices',len(_adj_matrix))
+        InstrumentationHelpers.Count('IsConnectedManual.edges',len(rows))
+    uf = UnionFind(len(_adj_matrix))
+    for i,j in zip(rows,cols) :
+        uf.Union(int(i),int(j))
+    roots = uf.Roots()
+    return roots.count(roots[0]) == (len(_adj_matrix) - len(unused_buses))
 
-        border_vertices = new_frontier_vertices
 
-    return DisjointSetsOfAlreadyTraversed
+def GetDisjointSets(_adj_matrix,unused_buses=[]) :
+    # Return a dictionary of disjoint sets.
+    # Unused buses are counted as belonging to their own set (we will not report them though).
+    rows,cols = GetEdgesFromAdjacencyMatrix(_adj_matrix)
+    if InstrumentationHelpers.enabled :
+        InstrumentationHelpers.Count('GetDisjointSets.calls')
+        InstrumentationHelpers.Count('GetDisjointSets.vertices',len(_adj_matrix))
+        InstrumentationHelpers.Count('GetDisjointSets.edges',len(rows))
+    labels,n_components = GetComponentLabels(len(_adj_matrix),rows,cols)
+    return DisjointSetsFromLabels(labels,unused_buses=unused_buses)
 
 
 # A little bit more parseable version
@@ -327,62 +896,76 @@ def PrintLineIDs(_env) :
 
 
 def nDisconnected(flag,n_total) :
-    # Quick function: return the number of disconnected lines, given a bitwise flag
-    flag_str = "{:0{}b}".format(flag,n_total)
-    n_zeros = flag_str.count('0')
-    return n_zeros
+    # Quick function: return the number of disconnected lines (out of n_total), given a bitwise flag.
+    # For a PackedBitsets or an array of flags, returns an array.
+    return n_total - nConnected(flag,n_total)
 
 
 def nConnected(flag,n_total) :
-    # Quick function: return the number of connected lines, given a bitwise flag
-    flag_str = "{:0{}b}".format(flag,n_total)
-    n_ones = flag_str.count('1')
-    return n_ones
+    # Quick function: return the number of connected lines (out of n_total), given a bitwise flag.
+    # Negative flags mean all lines on. For a PackedBitsets or an array of flags, returns an array.
+    if isinstance(flag,(CommonHelpers.PackedBitsets,np.ndarray,list)) :
+        return CommonHelpers.PackBitsets(flag,n_total).Popcount()
+    if flag < 0 :
+        return n_total
+    return bin(flag & CommonHelpers.FullyConnectedBitset(n_total)).count('1')
 
 
 def ExcludedByBitsetWithFewerDisconnections(line_bitset,excluded_bitsets) :
     # If there is a bitset in the list "excluded_bitsets"
     # whose list of off-lines is a subset of the list of off-lines of this line_bitset,
     # then return True.
+    # (Equivalently: every line that is on in line_bitset is also on in the excluded bitset,
+    #  which does not depend on the total number of lines.)
+    # "excluded_bitsets" can also be an ExcludedBitsetIndex, and line_bitset a (single) PackedBitsets.
 
-    all_on = CommonHelpers.FullyConnectedBitset(20)
-    line_bitset_flipped = all_on - line_bitset
+    if isinstance(line_bitset,CommonHelpers.PackedBitsets) :
+        line_bitset = int(line_bitset)
 
-    for excl_bitset in excluded_bitsets :
+    if isinstance(excluded_bitsets,ExcludedBitsetIndex) :
+        return excluded_bitsets.IsExcluded(line_bitset)
+
+    if InstrumentationHelpers.enabled :
+        InstrumentationHelpers.Count('ExcludedByBitsetWithFewerDisconnections.calls')
 
-        excl_bitset_flipped = all_on - excl_bitset
+    for excl_bitset in excluded_bitsets :
 
-        #print('Checking 0b{:b} against 0b{:b}'.format(line_bitset_flipped,excl_bitset_flipped))
-        if (line_bitset_flipped & excl_bitset_flipped) == excl_bitset_flipped :
+        if not (line_bitset & ~excl_bitset) :
             #print('Checking 0b{:b} against 0b{:b} - excluded.'.format(line_bitset,excl_bitset))
+            if InstrumentationHelpers.enabled :
+                InstrumentationHelpers.Count('ExcludedByBitsetWithFewerDisconnections.excluded')
             return True
 
     return False
 
 
-def AddExcludedBitset(line_bitset,excluded_bitsets) :
+def AddExcludedBitset(line_bitset,excluded_bitsets,verbose=False) :
     # If "excluded_bitsets" is a list of already-excluded (by topology) bitsets,
     # then add this excluded bitset to that list, with a caveat:
     #  - If there is another bitset, already in this list, that is excluded, where the off-lines
     #    of one bitset is a subset of the list of off-lines of the other bitset, then only keep the
     #    bitset with a smaller list of off-lines (since the other is definitely not a
     #    minimum-cut bitset).
+    # "excluded_bitsets" can also be an ExcludedBitsetIndex, and line_bitset a (single) PackedBitsets.
+
+    if isinstance(line_bitset,CommonHelpers.PackedBitsets) :
+        line_bitset = int(line_bitset)
 
-    all_on = CommonHelpers.FullyConnectedBitset(20)
-    line_bitset_flipped = all_on - line_bitset
+    if isinstance(excluded_bitsets,ExcludedBitsetIndex) :
+        excluded_bitsets.Add(line_bitset,verbose=verbose)
+        return
 
     for i in range(len(excluded_bitsets)-1,-1,-1) :
         excl_bitset = excluded_bitsets[i]
-        excl_bitset_flipped = all_on - excl_bitset
 
-        if (line_bitset_flipped & excl_bitset_flipped) == excl_bitset_flipped :
+        if not (line_bitset & ~excl_bitset) :
             # Already covered - do nothing
-            print('0b{:b} already covered by 0b{:b}'.format(excl_bitset_flipped,line_bitset_flipped))
+            if verbose : print('0b{:b} already covered by 0b{:b}'.format(line_bitset,excl_bitset))
             return
 
-        if (line_bitset_flipped & excl_bitset_flipped) == line_bitset_flipped :
+        if not (excl_bitset & ~line_bitset) :
             # pop the other bitset, add this new bitset and exit
-            #print('0b{:b} is superseded by 0b{:b}'.format(excl_bitset_flipped,line_bitset_flipped))
+            #print('0b{:b} is superseded by 0b{:b}'.format(excl_bitset,line_bitset))
             excluded_bitsets.pop(i)
 
     # No conflict; add line_bitset
@@ -390,3 +973,488 @@ def AddExcludedBitset(line_bitset,excluded_bitsets) :
     #print('Excluded bitsets changed; new size is',len(excluded_bitsets))
 
     return
+
+
+class ExcludedBitsetIndex :
+
+    # Bitmap-partitioned index of excluded (minimum-cut) line bitsets.
+    # Every stored bitset gets a slot number; for each line we keep a (python int) bitmap of
+    # the slots in which that line is off. Then:
+    #  - "Is any stored off-line set a subset of the off-lines of this query?" is answered by
+    #    removing every slot where a line that is on in the query is off.
+    #  - "Which stored off-line sets are supersets of this one?" is the AND of the bitmaps of
+    #    the lines that are off in the new bitset.
+    # This replaces the linear scan over the excluded_bitsets list (once per candidate bitset).
+
+    def __init__(self,n_line,bitsets=[]) :
+        self.n_line = n_line
+        self.slots = []
+        self.alive = 0
+        self.off_slots = [0]*n_line
+        for bits in bitsets :
+            self.Add(bits)
+
+    def __len__(self) :
+        return bin(self.alive).count('1')
+
+    def GetPackedBitsets(self) :
+        # The stored bitsets as a PackedBitsets (width n_line)
+        return CommonHelpers.PackBitsets(self.GetBitsets(),self.n_line)
+
+    def __iter__(self) :
+        return iter(self.GetBitsets())
+
+    def GetBitsets(self) :
+        # The stored bitsets, in the order in which they were added.
+        return list(bits for slot,bits in enumerate(self.slots) if (self.alive >> slot) & 0b1)
+
+    def CandidateSubsets(self,line_bitset) :
+        # Slots whose off-lines are a subset of the off-lines of line_bitset
+        candidates = self.alive
+        for i in range(self.n_line) :
+            if candidates and ((line_bitset >> i) & 0b1) :
+                candidates &= ~self.off_slots[i]
+        return candidates
+
+    def CandidateSupersets(self,line_bitset) :
+        # Slots whose off-lines are a superset of the off-lines of line_bitset
+        candidates = self.alive
+        for i in range(self.n_line) :
+            if candidates and not ((line_bitset >> i) & 0b1) :
+                candidates &= self.off_slots[i]
+        return candidates
+
+    def IsExcluded(self,line_bitset) :
+        excluded = self.CandidateSubsets(line_bitset) != 0
+        if InstrumentationHelpers.enabled :
+            InstrumentationHelpers.Count('ExcludedBitsetIndex.IsExcluded.calls')
+            InstrumentationHelpers.Count('ExcludedBitsetIndex.IsExcluded.excluded',int(excluded))
+        return excluded
+
+    def AreExcluded(self,line_bitsets) :
+        # Batch version of IsExcluded; returns a boolean array.
+        # A PackedBitsets is checked against all stored bitsets at once (its on-lines are a subset
+        # of the on-lines of a stored bitset).
+        if isinstance(line_bitsets,CommonHelpers.PackedBitsets) :
+            if not len(self) :
+                return np.zeros(len(line_bitsets),dtype=bool)
+            return CommonHelpers.PackBitsets(line_bitsets,self.n_line).SubsetMatrix(self.GetPackedBitsets()).any(axis=1)
+        return np.array(list(self.IsExcluded(int(b)) for b in line_bitsets),dtype=bool)
+
+    def Add(self,line_bitset,verbose=False) :
+        # Same rules as AddExcludedBitset. Returns True if the bitset was added.
+        if self.IsExcluded(line_bitset) :
+            if verbose : print('0b{:b} already covered'.format(line_bitset))
+            return False
+
+        # Remove the stored bitsets that are superseded by this one
+        self.alive &= ~self.CandidateSupersets(line_bitset)
+
+        slot = len(self.slots)
+        self.slots.append(line_bitset)
+        self.alive |= (0b1 << slot)
+        for i in range(self.n_line) :
+            if not ((line_bitset >> i) & 0b1) :
+                self.off_slots[i] |= (0b1 << slot)
+        return True
+
+
+def MakeIncidenceLists(n_vertices,line_or,line_ex) :
+    # For each vertex, a list of (neighbor,lineID) pairs.
+    incidence = list([] for i in range(n_vertices))
+    for lid,(a,b) in enumerate(zip(line_or,line_ex)) :
+        incidence[int(a)].append((int(b),lid))
+        incidence[int(b)].append((int(a),lid))
+    return incidence
+
+
+def FindBridges(incidence,removed) :
+    # Tarjan's bridge-finding algorithm (iterative DFS with low-links), skipping removed lines.
+    # Parallel lines are handled by skipping only the line we arrived on (not the parent vertex).
+    # Returns the list of bridge lineIDs and a component label for each vertex.
+    n_vertices = len(incidence)
+    disc = [-1]*n_vertices
+    low = [0]*n_vertices
+    comp = [-1]*n_vertices
+    bridges = []
+    time = 0
+    n_comp = 0
+
+    for start in range(n_vertices) :
+        if disc[start] >= 0 :
+            continue
+        disc[start] = low[start] = time
+        time += 1
+        comp[start] = n_comp
+        stack = [(start,-1,iter(incidence[start]))]
+
+        while stack :
+            v,parent_line,neighbors = stack[-1]
+            advanced = False
+            for w,lid in neighbors :
+                if removed[lid] or lid == parent_line :
+                    continue
+                if disc[w] < 0 :
+                    disc[w] = low[w] = time
+                    time += 1
+                    comp[w] = n_comp
+                    stack.append((w,lid,iter(incidence[w])))
+                    advanced = True
+                    break
+                low[v] = min(low[v],disc[w])
+
+            if advanced :
+                continue
+            stack.pop()
+            if stack :
+                u = stack[-1][0]
+                low[u] = min(low[u],low[v])
+                if low[v] > disc[u] :
+                    bridges.append(parent_line)
+        n_comp += 1
+
+    return bridges,comp
+
+
+def EdgeConnectivityExceeds(incidence,line_or,removed,source,sink,limit) :
+    # Return True if there are more than "limit" line-disjoint paths between source and sink
+    # (unit-capacity augmenting paths, stopping as soon as limit+1 paths are found).
+    flow = dict()
+    for i_path in range(limit+1) :
+        previous = {source : None}
+        frontier = [source]
+        while frontier and sink not in previous :
+            next_frontier = []
+            for v in frontier :
+                for w,lid in incidence[v] :
+                    if removed[lid] or w in previous or w == v :
+                        continue
+                    direction = 1 if line_or[lid] == v else -1
+                    if flow.get(lid,0) == direction :
+                        continue
+                    previous[w] = (v,lid,direction)
+                    next_frontier.append(w)
+            frontier = next_frontier
+
+        if sink not in previous :
+            return False
+
+        w = sink
+        while previous[w] is not None :
+            v,lid,direction = previous[w]
+            flow[lid] = flow.get(lid,0) + direction
+            w = v
+
+    return True
+
+
+def FindMinimalCutBitsets(_env,max_cut_size=None) :
+    # Enumerate the minimal disconnecting line sets (minimal cuts) of the substation graph directly,
+    # instead of sweeping all 2^n_line line bitsets. Only cuts of up to max_cut_size lines
+    # are returned (default: no limit).
+    #
+    # A minimal cut F whose lowest line is e is either {e} (e is a bridge), or {e} plus a minimal cut
+    # of the grid without e that separates the two ends of e. We recurse on that, pruning any branch
+    # where the ends of a chosen line cannot be separated by the remaining budget of lines.
+    #
+    # Returns the same bitsets as the notebook's brute-force sweep (lineOnBits with the cut lines
+    # turned off, in decreasing order), and the sizes of the two disjoint sets for each cut.
+    n_sub = len(_env.sub_info)
+    n_line = _env.n_line
+    if max_cut_size is None :
+        max_cut_size = n_line
+
+    line_or = list(int(a) for a in _env.line_or_to_subid)
+    line_ex = list(int(a) for a in _env.line_ex_to_subid)
+    incidence = MakeIncidenceLists(n_sub,line_or,line_ex)
+    removed = [False]*n_line
+    all_on = CommonHelpers.FullyConnectedBitset(n_line)
+
+    bridges,comp = FindBridges(incidence,removed)
+    if max(comp) > 0 :
+        # Already disconnected with every line on.
+        return [all_on],[list(comp.count(c) for c in range(max(comp)+1))]
+
+    def Separates(comp,pairs) :
+        return all(comp[a] != comp[b] for a,b in pairs)
+
+    cuts = []
+
+    def Recurse(first_line,budget,pairs,chosen) :
+        if InstrumentationHelpers.enabled :
+            InstrumentationHelpers.Count('FindMinimalCutBitsets.nodes')
+        bridges,comp = FindBridges(incidence,removed)
+        bridges = set(bridges)
+
+        for e in range(first_line,n_line) :
+            if removed[e] or line_or[e] == line_ex[e] :
+                continue
+
+            removed[e] = True
+            if e in bridges :
+                # Removing a bridge splits the grid; check that it separates the required pairs.
+                if (not pairs) or Separates(FindBridges(incidence,removed)[1],pairs) :
+                    cuts.append(chosen + [e])
+
+            elif budget > 1 :
+                new_pairs = pairs + [(line_or[e],line_ex[e])]
+                if not any(EdgeConnectivityExceeds(incidence,line_or,removed,a,b,budget-1) for a,b in new_pairs) :
+                    Recurse(e+1,budget-1,new_pairs,chosen + [e])
+                elif InstrumentationHelpers.enabled :
+                    InstrumentationHelpers.Count('FindMinimalCutBitsets.pruned')
+            removed[e] = False
+
+        return
+
+    if max_cut_size > 0 :
+        Recurse(0,max_cut_size,[],[])
+
+    minimum_cut_bitsets = []
+    for cut in cuts :
+        off_bits = 0
+        for lid in cut :
+            off_bits += 0b1 << lid
+        minimum_cut_bitsets.append(all_on - off_bits)
+    minimum_cut_bitsets.sort(reverse=True)
+
+    set_sizes = []
+    for bits in minimum_cut_bitsets :
+        on = CommonHelpers.BitsetToBoolArray(bits,n_line)
+        rows = np.asarray(line_or)[on]
+        cols = np.asarray(line_ex)[on]
+        labels,n_components = GetComponentLabels(n_sub,rows,cols)
+        set_sizes.append(list(int(a) for a in np.bincount(labels,minlength=n_components)))
+
+    return minimum_cut_bitsets,set_sizes
+
+
+def GetCutProperties(_env,cut_bitsets) :
+    # Partition sizes and cut metrics of the substation graph, for a batch of line bitsets.
+    # Works for cuts that produce any number of components. Returns a structured array with:
+    #  - bits, n_components, n_cut (off lines that separate two components), set_sizes (tuple, in
+    #    the order of the lowest substation of each set, as in GetDisjointSets)
+    #  - separated_pairs: number of substation pairs that are separated (size0*size1 for two sets)
+    #  - sparsity: n_cut / separated_pairs (the notebook's sparsest cut metric, for two sets)
+    #  - edge_expansion: n_cut / (number of substations outside the largest set)
+    # Connected bitsets get sparsity and edge_expansion inf.
+    n_sub = len(_env.sub_info)
+    n_line = _env.n_line
+    line_or = np.asarray(_env.line_or_to_subid,dtype=np.int64)
+    line_ex = np.asarray(_env.line_ex_to_subid,dtype=np.int64)
+
+    cut_bitsets = list(cut_bitsets)
+    lines_on = CommonHelpers.BitsetsToBoolArray(np.array(cut_bitsets,dtype=object if n_line > 64 else np.uint64),n_line)
+    labels = GetComponentLabelsBatch(n_sub,line_or,line_ex,lines_on)
+
+    n_batch = len(cut_bitsets)
+    sizes = np.zeros((n_batch,n_sub),dtype=np.int64)
+    np.add.at(sizes,(np.repeat(np.arange(n_batch),n_sub),labels.ravel()),1)
+
+    n_components = np.count_nonzero(sizes,axis=1)
+    separated_pairs = (n_sub*n_sub - (sizes*sizes).sum(axis=1))//2
+    n_cut = np.count_nonzero(~lines_on & (labels[:,line_or] != labels[:,line_ex]),axis=1)
+    outside_largest = n_sub - sizes.max(axis=1)
+
+    with np.errstate(divide='ignore',invalid='ignore') :
+        sparsity = np.where(separated_pairs > 0,n_cut/np.maximum(separated_pairs,1),np.inf)
+        edge_expansion = np.where(outside_largest > 0,n_cut/np.maximum(outside_largest,1),np.inf)
+
+    dtype = [('bits',object if n_line > 64 else np.uint64),('n_components',np.int64),('n_cut',np.int64),
+             ('set_sizes',object),('separated_pairs',np.int64),('sparsity',float),('edge_expansion',float)]
+    result = np.zeros(n_batch,dtype=dtype)
+    result['bits'] = cut_bitsets
+    result['n_components'] = n_components
+    result['n_cut'] = n_cut
+    for i in range(n_batch) :
+        result['set_sizes'][i] = tuple(int(a) for a in sizes[i][sizes[i] > 0])
+    result['separated_pairs'] = separated_pairs
+    result['sparsity'] = sparsity
+    result['edge_expansion'] = edge_expansion
+    return result
+
+
+def TopSparsestCuts(_env,cut_bitsets,k=10,key='sparsity',batch_size=4096) :
+    # Consume a stream (any iterable, e.g. an ExcludedBitsetIndex or a generator) of cut bitsets
+    # in batches, and keep only the k cuts with the smallest value of "key" ('sparsity' or
+    # 'edge_expansion') in a bounded heap. The full list is never materialized or sorted.
+    # Returns the structured array of GetCutProperties for the top k, sorted by key
+    # (ties: highest bitset first, as for the notebook's sorted list of minimum-cut bitsets).
+    heap = []
+    counter = itertools.count()
+    stream = iter(cut_bitsets)
+    while True :
+        batch = list(itertools.islice(stream,batch_size))
+        if not batch :
+            break
+        properties = GetCutProperties(_env,batch)
+        # Only the best k of this batch can make it into the heap (in the order of the heap:
+        # key, then highest bitset first, i.e. lowest ~bits)
+        for i in np.lexsort((~properties['bits'],properties[key]))[:k] :
+            entry = (-properties[key][i],int(properties['bits'][i]),-next(counter),properties[i])
+            if len(heap) < k :
+                heapq.heappush(heap,entry)
+            elif entry > heap[0] :
+                heapq.heapreplace(heap,entry)
+
+    rows = list(entry[3] for entry in sorted(heap,reverse=True))
+    if not rows :
+        return GetCutProperties(_env,[])
+    return np.array(rows,dtype=rows[0].dtype)
+
+
+class ContingencyScreener :
+
+    # N-1 / N-2 contingency screening of the bus graph (bus 1 of substation s is vertex 2s, bus 2
+    # is vertex 2s+1), in time linear in the number of lines, for one topology or a batch of them.
+    #  - A line is N-1 critical if it is a bridge (its outage splits its part of the grid in two).
+    #  - A pair of lines (neither N-1 critical) is N-2 critical if it is a 2-edge cut.
+    # Both come out of one spanning-forest search: every non-tree line gets a random 64-bit label,
+    # and every tree line the XOR of the labels of the non-tree lines whose cycle passes through it.
+    # Bridges are the lines with label 0, and two lines are a cut pair if and only if they have the
+    # same label (up to a probability of ~n_line^2/2^64 of a false pair).
+    # As in AdjacencyMatrixClass.GetDisjointSets, a bus that is left with nothing connected (no
+    # line, generator or load) is unused, not islanded: an outage that only empties a bus is not
+    # critical, unless the other bus of the substation is empty too (a disconnected substation).
+    # Results are outage bitsets: bit i set means that line i is out.
+
+    def __init__(self,_env,seed=0) :
+        self.n_sub = len(_env.sub_info)
+        self.n_line = _env.n_line
+        self.line_or_sub = np.asarray(_env.line_or_to_subid,dtype=np.int64)
+        self.line_or_pos = np.asarray(_env.line_or_to_sub_pos,dtype=np.int64)
+        self.line_ex_sub = np.asarray(_env.line_ex_to_subid,dtype=np.int64)
+        self.line_ex_pos = np.asarray(_env.line_ex_to_sub_pos,dtype=np.int64)
+        # Generators, then loads
+        self.ext_sub = np.concatenate([np.asarray(_env.gen_to_subid,dtype=np.int64),
+                                       np.asarray(_env.load_to_subid,dtype=np.int64)])
+        self.ext_pos = np.concatenate([np.asarray(_env.gen_to_sub_pos,dtype=np.int64),
+                                       np.asarray(_env.load_to_sub_pos,dtype=np.int64)])
+        rng = random.Random(seed)
+        self.line_labels = list(rng.getrandbits(64) for lid in range(self.n_line))
+
+    def GetLineEnds(self,lineOnBitsArray,bus_states=None) :
+        # Returns lines_on and the bus vertex of both ends of every line, each of shape (n_batch,n_line).
+        # bus_states has shape (n_batch,n_sub) (bit set: element on bus 1); None means all on bus 1.
+        lines_on = CommonHelpers.BitsetsToBoolArray(lineOnBitsArray,self.n_line)
+        if bus_states is None :
+            vert_or = np.broadcast_to(2*self.line_or_sub,lines_on.shape)
+            vert_ex = np.broadcast_to(2*self.line_ex_sub,lines_on.shape)
+            return lines_on,vert_or,vert_ex
+
+        bus_states = np.asarray(bus_states,dtype=np.int64)
+        vert_or = 2*self.line_or_sub + 1 - ((bus_states[:,self.line_or_sub] >> self.line_or_pos) & 1)
+        vert_ex = 2*self.line_ex_sub + 1 - ((bus_states[:,self.line_ex_sub] >> self.line_ex_pos) & 1)
+        return lines_on,vert_or,vert_ex
+
+    def GetElementCounts(self,n_batch,bus_states=None) :
+        # Number of generators and loads on every bus vertex, shape (n_batch,2*n_sub).
+        if bus_states is None :
+            vert = np.broadcast_to(2*self.ext_sub,(n_batch,len(self.ext_sub)))
+        else :
+            bus_states = np.asarray(bus_states,dtype=np.int64)
+            vert = 2*self.ext_sub + 1 - ((bus_states[:,self.ext_sub] >> self.ext_pos) & 1)
+        n_elements = np.zeros((n_batch,2*self.n_sub),dtype=np.int64)
+        np.add.at(n_elements,(np.repeat(np.arange(n_batch),len(self.ext_sub)),vert.ravel()),1)
+        return n_elements
+
+    def ScreenGraph(self,lines,vert_or,vert_ex,n_elements) :
+        # The screening of one graph. lines are the IDs of the lines that are on,
+        # vert_or/vert_ex the bus vertices of the line ends (lists indexed by line ID), and
+        # n_elements the number of generators and loads on every bus vertex.
+        # Returns (n1_bitset,n2_bitsets).
+        n_vertices = 2*self.n_sub
+        incidence = list([] for i in range(n_vertices))
+        degree = [0]*n_vertices
+        for lid in lines :
+            incidence[vert_or[lid]].append((vert_ex[lid],lid))
+            incidence[vert_ex[lid]].append((vert_or[lid],lid))
+            if vert_or[lid] != vert_ex[lid] :
+                degree[vert_or[lid]] += 1
+                degree[vert_ex[lid]] += 1
+
+        def EmptiedBus(v,n_out) :
+            # Does an outage of n_out lines, all ending on bus v, leave v unused (and not its
+            # whole substation disconnected)?
+            sibling = v ^ 1
+            return degree[v] == n_out and n_elements[v] == 0 and (degree[sibling] > 0 or n_elements[sibling] > 0)
+
+        # Spanning forest (any search order will do)
+        parent = [-1]*n_vertices
+        parent_line = [-1]*n_vertices
+        visited = [False]*n_vertices
+        order = []
+        for start in range(n_vertices) :
+            if visited[start] or not incidence[start] :
+                continue
+            visited[start] = True
+            stack = [start]
+            while stack :
+                v = stack.pop()
+                order.append(v)
+                for w,lid in incidence[v] :
+                    if not visited[w] :
+                        visited[w] = True
+                        parent[w] = v
+                        parent_line[w] = lid
+                        stack.append(w)
+
+        # Non-tree lines: put their label on both ends. Tree lines: XOR over the subtree below them.
+        labels = dict()
+        vertex_labels = [0]*n_vertices
+        tree_lines = set(parent_line)
+        for lid in lines :
+            if lid not in tree_lines and vert_or[lid] != vert_ex[lid] :
+                labels[lid] = self.line_labels[lid]
+                vertex_labels[vert_or[lid]] ^= labels[lid]
+                vertex_labels[vert_ex[lid]] ^= labels[lid]
+        for v in reversed(order) :
+            if parent[v] >= 0 :
+                labels[parent_line[v]] = vertex_labels[v]
+                vertex_labels[parent[v]] ^= vertex_labels[v]
+
+        n1_bitset = 0
+        classes = dict()
+        for lid,label in labels.items() :
+            if label == 0 :
+                if not (EmptiedBus(vert_or[lid],1) or EmptiedBus(vert_ex[lid],1)) :
+                    n1_bitset |= (0b1 << lid)
+            else :
+                classes.setdefault(label,[]).append(lid)
+
+        n2_bitsets = []
+        for members in classes.values() :
+            for a,b in itertools.combinations(members,2) :
+                shared = set((vert_or[a],vert_ex[a])).intersection((vert_or[b],vert_ex[b]))
+                if any(EmptiedBus(v,2) for v in shared) :
+                    continue
+                n2_bitsets.append((0b1 << a) | (0b1 << b))
+        n2_bitsets.sort()
+        return n1_bitset,n2_bitsets
+
+    def ScreenBatch(self,lineOnBitsArray,bus_states=None) :
+        # Screen a batch of topologies (line bitsets, and optionally the bus states of every
+        # substation, shape (n_batch,n_sub)). Returns the lists n1_bitsets and n2_bitsets.
+        lines_on,vert_or,vert_ex = self.GetLineEnds(lineOnBitsArray,bus_states)
+        n_elements = self.GetElementCounts(len(lines_on),bus_states).tolist()
+        vert_or = vert_or.tolist()
+        vert_ex = vert_ex.tolist()
+        n1_bitsets = []
+        n2_bitsets = []
+        for i in range(len(lines_on)) :
+            n1,n2 = self.ScreenGraph(np.flatnonzero(lines_on[i]).tolist(),vert_or[i],vert_ex[i],n_elements[i])
+            n1_bitsets.append(n1)
+            n2_bitsets.append(n2)
+        return n1_bitsets,n2_bitsets
+
+    def Screen(self,lineOnBits=-1,bus_states=None) :
+        # Screen one topology. Returns (n1_bitset,n2_bitsets).
+        if bus_states is not None :
+            bus_states = [bus_states]
+        n1_bitsets,n2_bitsets = self.ScreenBatch([lineOnBits],bus_states)
+        return n1_bitsets[0],n2_bitsets[0]
+
+    def ScreenAdjacencyMatrixClass(self,adjacency_matrix_class,sub_classes) :
+        # Screen the current topology of an AdjacencyMatrixClass (its lineOnBits, and the
+        # currentBusConfig of the substations that were applied to it).
+        bus_states = list(sub.currentBusConfig for sub in sub_classes)
+        return self.Screen(adjacency_matrix_class.lineOnBits,bus_states)
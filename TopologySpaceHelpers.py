@@ -0,0 +1,312 @@
+# Helper functions to walk the joint topology space: line status (on/off bitsets) x the bus state
+# of every substation. The space is never materialized: every member has an index, and
+# members are ranked/unranked in mixed radix (one digit per substation), so that it can be
+# sliced into disjoint shards, resumed from any index, or sampled uniformly.
+# Input includes grid2op environment and the substations from Substation.BuildSubstations
+
+import bisect
+import random
+import CommonHelpers
+import TopologyHelpers
+import numpy as np
+
+class TopologySpace :
+
+    # The members are ordered by line bitset (in the order given), then by the bus states of
+    # substation 0, 1, ... (the digits). Digit d of a substation is its d-th valid bus state for
+    # that line bitset (sub.ValidBusStates, descending), so digit 0 is the nominal state when it
+    # is valid. A substation is "changed" if it is not in the nominal state (everything on bus 1).
+    #
+    # max_changed_lines drops the line bitsets with more disconnected lines.
+    # max_changed_substations is part of the ranking: only the members with at most that many
+    # changed substations are counted and indexed, so the index range stays dense.
+    # require_connected is checked on the fly (by batch), so it skips members inside a slice
+    # but does not change the indices.
+
+    def __init__(self,_env,sub_classes,line_bitsets,max_changed_substations=None,max_changed_lines=None,
+                 require_connected=True) :
+        self.sub_classes = sub_classes
+        self.n_sub = len(sub_classes)
+        self.n_line = _env.n_line
+        self.max_changed_substations = max_changed_substations
+        self.require_connected = require_connected
+        self.nominal = np.array(list(CommonHelpers.FullyConnectedBitset(sub.nElements) for sub in sub_classes),dtype=np.int64)
+
+        # lineOnBits < 0 means that all lines are on
+        all_on = CommonHelpers.FullyConnectedBitset(self.n_line)
+        line_bitsets = list(int(b) if b >= 0 else all_on for b in line_bitsets)
+        # (repeated line bitsets are only counted once)
+        line_bitsets = list(dict.fromkeys(line_bitsets))
+        if max_changed_lines is not None :
+            line_bitsets = list(b for b in line_bitsets
+                                if b < 0 or TopologyHelpers.nDisconnected(b,self.n_line) <= max_changed_lines)
+
+        # Number of valid bus states (radix) of every substation, and whether the nominal state
+        # is one of them, for every line bitset
+        bits_array = np.array(line_bitsets,dtype=np.uint64 if self.n_line <= 64 else object)
+        radices = np.zeros((len(line_bitsets),self.n_sub),dtype=np.int64)
+        nominal_valid = np.zeros((len(line_bitsets),self.n_sub),dtype=bool)
+        for i,sub in enumerate(sub_classes) :
+            columns = sub.LineOffColumns(bits_array)
+            radices[:,i] = sub.ValidCountsByColumn()[columns]
+            nominal_valid[:,i] = sub.validityTable[self.nominal[i]][columns]
+
+        counts = self.CountMembers(radices,nominal_valid)
+        keep = list(i for i,c in enumerate(counts) if c > 0)
+        self.line_bitsets = list(line_bitsets[i] for i in keep)
+        self.radices = radices[keep]
+        self.nominal_valid = nominal_valid[keep]
+        self.bitset_position = None
+
+        # offsets[i] is the index of the first member with line bitset i
+        self.offsets = [0]
+        for i in keep :
+            self.offsets.append(self.offsets[-1] + int(counts[i]))
+        self.size = self.offsets.pop()
+
+        # Line ends and externals, as (substation,position in the substation bus state)
+        self.line_or_sub = np.asarray(_env.line_or_to_subid,dtype=np.int64)
+        self.line_or_pos = np.asarray(_env.line_or_to_sub_pos,dtype=np.int64)
+        self.line_ex_sub = np.asarray(_env.line_ex_to_subid,dtype=np.int64)
+        self.line_ex_pos = np.asarray(_env.line_ex_to_sub_pos,dtype=np.int64)
+        self.ext_sub = np.concatenate([np.asarray(_env.gen_to_subid,dtype=np.int64),
+                                       np.asarray(_env.load_to_subid,dtype=np.int64)])
+        self.ext_pos = np.concatenate([np.asarray(_env.gen_to_sub_pos,dtype=np.int64),
+                                       np.asarray(_env.load_to_sub_pos,dtype=np.int64)])
+
+        self.record_dtype = np.dtype([('index',np.int64 if self.size < 2**63 else object),
+                                      ('line_bits',bits_array.dtype),
+                                      ('bus_states',np.int64,(self.n_sub,))])
+        return
+
+    def CountMembers(self,radices,nominal_valid) :
+        # Number of members for every line bitset (rows of radices). Without a budget this is the
+        # product of the radices; with a budget of changed substations it is the dynamic program
+        # of SuffixCounts, for all bitsets at once. Exact (python ints if int64 could overflow).
+        max_log2 = np.log2(np.maximum(radices,1)).sum(axis=1).max() if len(radices) else 0
+        dtype = np.int64 if max_log2 < 62 else object
+        radices = radices.astype(dtype)
+        if self.max_changed_substations is None :
+            return np.prod(radices,axis=1)
+
+        budget = min(self.max_changed_substations,self.n_sub)
+        unchanged = nominal_valid.astype(dtype)
+        completions = np.ones((len(radices),budget+1),dtype=dtype)
+        for s in range(self.n_sub-1,-1,-1) :
+            new_completions = unchanged[:,s,None]*completions
+            new_completions[:,1:] += (radices[:,s,None] - unchanged[:,s,None])*completions[:,:-1]
+            completions = new_completions
+        return completions[:,budget]
+
+    def SuffixCounts(self,i_bitset) :
+        # For one line bitset: completions[s][b] is the number of ways to set substations s ... n_sub-1
+        # with at most b changed substations (b = 0 ... budget).
+        radices = list(int(r) for r in self.radices[i_bitset])
+        unchanged = list(int(u) for u in self.nominal_valid[i_bitset])
+        budget = min(self.max_changed_substations,self.n_sub)
+        completions = [None]*(self.n_sub+1)
+        completions[self.n_sub] = [1]*(budget+1)
+        for s in range(self.n_sub-1,-1,-1) :
+            after = completions[s+1]
+            completions[s] = list(unchanged[s]*after[b] + ((radices[s]-unchanged[s])*after[b-1] if b else 0)
+                                  for b in range(budget+1))
+        return completions
+
+    def GetBitsetPosition(self,lineOnBits) :
+        if self.bitset_position is None :
+            self.bitset_position = dict((b,i) for i,b in enumerate(self.line_bitsets))
+        return self.bitset_position.get(int(lineOnBits))
+
+    def UnrankDigits(self,index) :
+        # Return (i_bitset,digits) of the member with this index.
+        if not (0 <= index < self.size) :
+            raise IndexError(index)
+        i_bitset = bisect.bisect_right(self.offsets,index) - 1
+        r = index - self.offsets[i_bitset]
+        radices = self.radices[i_bitset]
+        digits = [0]*self.n_sub
+
+        if self.max_changed_substations is None :
+            for s in range(self.n_sub-1,-1,-1) :
+                r,digits[s] = divmod(r,int(radices[s]))
+            return i_bitset,digits
+
+        completions = self.SuffixCounts(i_bitset)
+        b = min(self.max_changed_substations,self.n_sub)
+        for s in range(self.n_sub) :
+            if self.nominal_valid[i_bitset,s] :
+                if r < completions[s+1][b] :
+                    continue
+                r -= completions[s+1][b]
+                d,r = divmod(r,completions[s+1][b-1])
+                digits[s] = d + 1
+            else :
+                digits[s],r = divmod(r,completions[s+1][b-1])
+            b -= 1
+        return i_bitset,digits
+
+    def RankDigits(self,i_bitset,digits) :
+        # Inverse of UnrankDigits
+        radices = self.radices[i_bitset]
+        r = 0
+        if self.max_changed_substations is None :
+            for s in range(self.n_sub) :
+                r = r*int(radices[s]) + int(digits[s])
+            return self.offsets[i_bitset] + r
+
+        completions = self.SuffixCounts(i_bitset)
+        b = min(self.max_changed_substations,self.n_sub)
+        for s in range(self.n_sub) :
+            d = int(digits[s])
+            if self.nominal_valid[i_bitset,s] :
+                if d == 0 :
+                    continue
+                r += completions[s+1][b]
+                d -= 1
+            if b == 0 :
+                raise ValueError('More than {} changed substations'.format(self.max_changed_substations))
+            r += d*completions[s+1][b-1]
+            b -= 1
+        return self.offsets[i_bitset] + r
+
+    def NextDigits(self,i_bitset,digits) :
+        # Advance digits (in place) to the next member with the same line bitset.
+        # Returns False if this was the last one.
+        radices = self.radices[i_bitset]
+        budget = self.n_sub if self.max_changed_substations is None else self.max_changed_substations
+
+        # changed substations before s, and forced changes (nominal state not valid) after s
+        changed_before = [0]*(self.n_sub+1)
+        forced_after = [0]*(self.n_sub+1)
+        for s in range(self.n_sub) :
+            changed = (digits[s] > 0) or not self.nominal_valid[i_bitset,s]
+            changed_before[s+1] = changed_before[s] + changed
+            forced_after[self.n_sub-1-s] = forced_after[self.n_sub-s] + (not self.nominal_valid[i_bitset,self.n_sub-1-s])
+
+        for s in range(self.n_sub-1,-1,-1) :
+            if digits[s]+1 < radices[s] and changed_before[s] + 1 + forced_after[s+1] <= budget :
+                digits[s] += 1
+                for t in range(s+1,self.n_sub) :
+                    digits[t] = 0
+                return True
+        return False
+
+    def DigitsToBusStates(self,i_bitset,digits) :
+        lineOnBits = self.line_bitsets[i_bitset]
+        return list(int(sub.ValidBusStates(lineOnBits)[d]) for sub,d in zip(self.sub_classes,digits))
+
+    def Unrank(self,index) :
+        # Return (lineOnBits,bus_states) of the member with this index.
+        i_bitset,digits = self.UnrankDigits(index)
+        return self.line_bitsets[i_bitset],tuple(self.DigitsToBusStates(i_bitset,digits))
+
+    def Rank(self,lineOnBits,bus_states) :
+        # Return the index of (lineOnBits,bus_states), or None if it is not in this space.
+        i_bitset = self.GetBitsetPosition(lineOnBits)
+        if i_bitset is None :
+            return None
+        digits = []
+        for sub,bits in zip(self.sub_classes,bus_states) :
+            states = sub.ValidBusStates(lineOnBits)
+            # ValidBusStates is in descending order
+            d = len(states) - int(np.searchsorted(states[::-1],bits)) - 1
+            if d < 0 or d >= len(states) or states[d] != bits :
+                return None
+            digits.append(d)
+        if self.max_changed_substations is not None :
+            n_changed = sum(1 for b,n in zip(bus_states,self.nominal) if b != n)
+            if n_changed > self.max_changed_substations :
+                return None
+        return self.RankDigits(i_bitset,digits)
+
+    def GetShardBounds(self,i_shard,n_shards) :
+        # Disjoint, contiguous (start,stop) index range of shard i_shard
+        return self.size*i_shard//n_shards,self.size*(i_shard+1)//n_shards
+
+    def IsConnectedBatch(self,line_bits,bus_states) :
+        # Whether every bus in use is connected, for a batch of members.
+        # Bus 1 of substation s is vertex 2s, bus 2 is vertex 2s+1. A bus is in use if a connected
+        # line or an external (generator or load) is on it.
+        n_batch = len(line_bits)
+        lines_on = CommonHelpers.BitsetsToBoolArray(line_bits,self.n_line)
+        bus_states = np.asarray(bus_states,dtype=np.int64)
+
+        def Vertices(subs,positions) :
+            on_bus1 = (bus_states[:,subs] >> positions) & 1
+            return 2*subs + 1 - on_bus1
+
+        vert_or = Vertices(self.line_or_sub,self.line_or_pos)
+        vert_ex = Vertices(self.line_ex_sub,self.line_ex_pos)
+        vert_ext = Vertices(self.ext_sub,self.ext_pos)
+
+        n_vertices = 2*self.n_sub
+        labels = TopologyHelpers.GetComponentLabelsBatch(n_vertices,vert_or,vert_ex,lines_on)
+
+        used = np.zeros((n_batch,n_vertices),dtype=bool)
+        i_batch,i_line = np.nonzero(lines_on)
+        used[i_batch,vert_or[i_batch,i_line]] = True
+        used[i_batch,vert_ex[i_batch,i_line]] = True
+        used[np.arange(n_batch)[:,None],vert_ext] = True
+
+        lowest = np.where(used,labels,n_vertices).min(axis=1)
+        highest = np.where(used,labels,-1).max(axis=1)
+        return lowest == highest
+
+    def IterateRecords(self,start=0,stop=None,batch_size=4096) :
+        # Lazily yield the members with index start ... stop-1, as structured arrays of up to
+        # batch_size records (fields: index, line_bits, bus_states), in index order.
+        # If require_connected, the disconnected members are dropped from each batch.
+        stop = self.size if stop is None else min(stop,self.size)
+        if start >= stop :
+            return
+
+        i_bitset,digits = self.UnrankDigits(start)
+        index = start
+        while index < stop :
+            n_batch = min(batch_size,stop-index)
+            records = np.zeros(n_batch,dtype=self.record_dtype)
+            states = None
+            for k in range(n_batch) :
+                if states is None :
+                    lineOnBits = self.line_bitsets[i_bitset]
+                    states = list(sub.ValidBusStates(lineOnBits) for sub in self.sub_classes)
+                records['index'][k] = index + k
+                records['line_bits'][k] = lineOnBits
+                records['bus_states'][k] = list(st[d] for st,d in zip(states,digits))
+                if not self.NextDigits(i_bitset,digits) :
+                    i_bitset += 1
+                    digits = [0]*self.n_sub
+                    states = None
+            index += n_batch
+
+            if self.require_connected :
+                records = records[self.IsConnectedBatch(records['line_bits'],records['bus_states'])]
+            if len(records) :
+                yield records
+
+    def Iterate(self,start=0,stop=None,batch_size=4096) :
+        # Lazily yield (lineOnBits,bus_states) for the members with index start ... stop-1.
+        for records in self.IterateRecords(start,stop,batch_size=batch_size) :
+            for line_bits,bus_states in zip(records['line_bits'],records['bus_states']) :
+                yield int(line_bits),tuple(int(b) for b in bus_states)
+
+    def Sample(self,n_samples,seed=None,max_tries=None) :
+        # Uniform random members (with replacement), as a structured array.
+        # If require_connected, disconnected draws are rejected (up to max_tries draws in total).
+        rng = random.Random(seed)
+        if max_tries is None :
+            max_tries = 100*n_samples
+        records = np.zeros(0,dtype=self.record_dtype)
+        n_tries = 0
+        while len(records) < n_samples and n_tries < max_tries and self.size :
+            n_draw = min(n_samples - len(records),max_tries - n_tries)
+            draws = np.zeros(n_draw,dtype=self.record_dtype)
+            for k in range(n_draw) :
+                index = rng.randrange(self.size)
+                lineOnBits,bus_states = self.Unrank(index)
+                draws[k] = (index,lineOnBits,bus_states)
+            n_tries += n_draw
+            if self.require_connected :
+                draws = draws[self.IsConnectedBatch(draws['line_bits'],draws['bus_states'])]
+            records = np.concatenate([records,draws])
+        return records
@@ -0,0 +1,5 @@
+# The helpers are flat modules at the top of the repository
+import os
+import sys
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
@@ -0,0 +1,44 @@
+import BusTopologyHelpers
+import random
+import numpy as np
+
+def RandomLayout(rng,nbits) :
+    # Random local indices of the generators, loads and lines of a substation with nbits elements
+    kinds = list(rng.choice(['gen','load','line','line']) for i in range(nbits))
+    i_gens = list(i for i in range(nbits) if kinds[i] == 'gen')
+    i_loads = list(i for i in range(nbits) if kinds[i] == 'load')
+    i_lines = list(i for i in range(nbits) if kinds[i] == 'line')
+    return i_gens,i_loads,i_lines
+
+def test_validity_table_matches_scalar() :
+    rng = random.Random(0)
+    for nbits in range(1,9) :
+        for i in range(4) :
+            i_gens,i_loads,i_lines = RandomLayout(rng,nbits)
+            table = BusTopologyHelpers.ValidBooleanBusStateTable(nbits,i_gens=i_gens,i_loads=i_loads,i_lines=i_lines)
+            assert table.shape == (0b1 << nbits,0b1 << len(i_lines))
+            for lineOff in range(0b1 << len(i_lines)) :
+                disconnected = list(i_lines[j] for j in range(len(i_lines)) if (lineOff >> j) & 1)
+                for flag in range(0b1 << nbits) :
+                    assert table[flag,lineOff] == BusTopologyHelpers.IsValidBooleanBusState(flag,nbits,i_gens,i_loads,disconnected)
+
+def test_batch_matches_scalar() :
+    # Scalar masks (one layout for all flags), and per-flag masks (random disconnected lines)
+    rng = random.Random(1)
+    for nbits in range(1,11) :
+        for i in range(3) :
+            i_gens,i_loads,i_lines = RandomLayout(rng,nbits)
+            gen_mask = sum(0b1 << i for i in i_gens)
+            load_mask = sum(0b1 << i for i in i_loads)
+            flags = np.arange(0b1 << nbits,dtype=np.uint64)
+
+            disconnected = list(i for i in i_lines if rng.random() < 0.5)
+            valid = BusTopologyHelpers.IsValidBooleanBusStateBatch(flags,nbits,gen_mask,load_mask,sum(0b1 << i for i in disconnected))
+            assert valid.tolist() == list(BusTopologyHelpers.IsValidBooleanBusState(int(flag),nbits,i_gens,i_loads,disconnected)
+                                          for flag in flags)
+
+            per_flag = list(list(i for i in i_lines if rng.random() < 0.5) for flag in flags)
+            disconnected_masks = np.array(list(sum(0b1 << i for i in d) for d in per_flag),dtype=np.uint64)
+            valid = BusTopologyHelpers.IsValidBooleanBusStateBatch(flags,nbits,gen_mask,load_mask,disconnected_masks)
+            assert valid.tolist() == list(BusTopologyHelpers.IsValidBooleanBusState(int(flag),nbits,i_gens,i_loads,d)
+                                          for flag,d in zip(flags,per_flag))
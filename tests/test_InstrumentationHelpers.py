@@ -0,0 +1,16 @@
+import InstrumentationHelpers
+
+def test_module_level_timing_does_not_crash() :
+    # Start/Stop at the top of the stack (as in a script or python -c) has no caller to sample
+    code = 'start = InstrumentationHelpers.Start()\nInstrumentationHelpers.Stop("module_level",start)\n'
+    InstrumentationHelpers.Reset()
+    InstrumentationHelpers.Enable(sample_every_n=1)
+    try :
+        exec(compile(code,'<script>','exec'),{'InstrumentationHelpers' : InstrumentationHelpers})
+        InstrumentationHelpers.AddTime('module_level',1e-6,depth=50)
+    finally :
+        InstrumentationHelpers.Disable()
+    snapshot = InstrumentationHelpers.Snapshot()
+    assert snapshot['timers']['module_level']['count'] == 2
+    assert sum(site['samples'] for site in snapshot['profiles']['module_level'].values()) == 2
+    InstrumentationHelpers.Reset()
@@ -0,0 +1,47 @@
+import random
+import BenchmarkHelpers
+import SpectralHelpers
+import TopologyHelpers
+import numpy as np
+
+def RandomLineBitsets(n_line,n_off,n_bitsets,seed=0) :
+    rng = random.Random(seed)
+    all_on = (0b1 << n_line) - 1
+    bitsets = [-1]
+    for i in range(n_bitsets) :
+        bits = all_on
+        for lid in rng.sample(range(n_line),n_off) :
+            bits &= ~(0b1 << lid)
+        bitsets.append(bits)
+    return bitsets
+
+
+def test_sparse_matches_dense_on_disconnected_grid() :
+    _env = BenchmarkHelpers.MakeBenchmarkEnv('random60')
+    dense = SpectralHelpers.SpectralAnalyzer(_env)
+    sparse = SpectralHelpers.SpectralAnalyzer(_env,dense_max_size=0)
+    assert dense.use_dense and not sparse.use_dense
+    builder = TopologyHelpers.AdjacencyMatrixBuilder(_env,n_buses=1,skipExternals=True)
+
+    bitsets = RandomLineBitsets(_env.n_line,20,30)
+    n_components,algebraic_connectivity,fiedler_vectors = dense.AnalyzeBatch(bitsets)
+    assert n_components.max() > 1
+
+    for i,bits in enumerate(bitsets) :
+        labels,n_expected,unused_buses = builder.GetComponentLabels(bits)
+        n_sparse,ac_sparse,fiedler_sparse = sparse.Analyze(bits)
+        assert n_components[i] == n_expected
+        assert n_sparse == n_expected
+        assert abs(ac_sparse - algebraic_connectivity[i]) < 1e-6
+        if n_expected == 1 :
+            assert abs(abs(fiedler_sparse @ fiedler_vectors[i]) - 1) < 1e-6
+
+
+def test_sparse_component_count_on_large_grid() :
+    _env = BenchmarkHelpers.MakeBenchmarkEnv('grid1000')
+    sparse = SpectralHelpers.SpectralAnalyzer(_env)
+    assert not sparse.use_dense
+    builder = TopologyHelpers.AdjacencyMatrixBuilder(_env,n_buses=1,skipExternals=True)
+    for bits in RandomLineBitsets(_env.n_line,200,3,seed=1) :
+        labels,n_expected,unused_buses = builder.GetComponentLabels(bits)
+        assert sparse.Analyze(bits)[0] == n_expected
@@ -0,0 +1,70 @@
+import BenchmarkHelpers
+import Substation
+import random
+import numpy as np
+
+def test_line_off_columns() :
+    # The table lookups against the definition: bit j of the column is set if local line j is off
+    _env = BenchmarkHelpers.MakeBenchmarkEnv('ieee118')
+    subs = Substation.BuildSubstations(_env)
+    rng = random.Random(0)
+    bitsets = list(rng.getrandbits(_env.n_line) for i in range(200)) + [0,-1]
+    for sub in subs :
+        ref = []
+        for bits in bitsets :
+            column = 0
+            for j,lid in enumerate(sub.localLineIDs) :
+                if bits > 0 and not (bits >> int(lid)) & 1 :
+                    column |= (0b1 << j)
+            ref.append(column)
+        assert list(sub.LineOffColumn(bits) for bits in bitsets) == ref
+        assert list(sub.LineOffColumns(np.array(bitsets,dtype=object))) == ref
+
+    _env = BenchmarkHelpers.MakeBenchmarkEnv('ieee14')
+    subs = Substation.BuildSubstations(_env)
+    bitsets = np.array(list(rng.getrandbits(_env.n_line) for i in range(200)) + [0],dtype=np.uint64)
+    for sub in subs :
+        assert list(sub.LineOffColumns(bitsets)) == list(sub.LineOffColumn(int(bits)) for bits in bitsets)
+
+def NotebookNumberOfLineAndBusCombinations(_line_bitsets,_sub_classes) :
+    # getNumberOfLineAndBusCombinations of learn2RPN.ipynb (without the progress printout),
+    # returning the count of every bitset as well
+    per_bitset = []
+    for line_bitset in _line_bitsets :
+        nValid_subCombi = 1
+        for sub in _sub_classes :
+            nValid_sub = 0
+            for sub_bitset in sub.GetValidBusStates() :
+                sub.SetBusConfig(sub_bitset)
+                if sub.IsValidBooleanBusState(lineOnBits=line_bitset) :
+                    nValid_sub += 1
+            nValid_subCombi *= nValid_sub
+        per_bitset.append(nValid_subCombi)
+    for sub in _sub_classes :
+        sub.ResetBusConfig()
+    return sum(per_bitset),per_bitset
+
+def test_count_valid_combinations_matches_notebook() :
+    _env = BenchmarkHelpers.MakeBenchmarkEnv('ieee14')
+    subs = Substation.BuildSubstations(_env)
+    rng = random.Random(1)
+    bitsets = [(0b1 << _env.n_line) - 1] + list(rng.getrandbits(_env.n_line) for i in range(300))
+    ref_total,ref_per_bitset = NotebookNumberOfLineAndBusCombinations(bitsets,subs)
+
+    total,per_bitset,per_substation = Substation.CountValidCombinations(subs,np.array(bitsets,dtype=np.uint64),chunk_size=64)
+    assert total == ref_total
+    assert list(per_bitset) == ref_per_bitset
+    assert (np.prod(per_substation,axis=1) == per_bitset).all()
+
+    log_total,log_per_bitset,per_substation = Substation.CountValidCombinations(subs,np.array(bitsets,dtype=np.uint64),logSpace=True)
+    assert np.isclose(log_total,np.log(ref_total))
+    assert np.allclose(np.exp(log_per_bitset),ref_per_bitset)
+
+    # More than 64 lines (python int bitsets), and products that may not fit in int64
+    _env = BenchmarkHelpers.MakeBenchmarkEnv('ieee118')
+    subs = Substation.BuildSubstations(_env)
+    bitsets = [(0b1 << _env.n_line) - 1] + list((0b1 << _env.n_line) - 1 - (0b1 << rng.randrange(_env.n_line)) for i in range(20))
+    ref_total,ref_per_bitset = NotebookNumberOfLineAndBusCombinations(bitsets,subs)
+    total,per_bitset,per_substation = Substation.CountValidCombinations(subs,np.array(bitsets,dtype=object))
+    assert total == ref_total
+    assert list(per_bitset) == ref_per_bitset
@@ -0,0 +1,55 @@
+import BenchmarkHelpers
+import CommonHelpers
+import SweepHelpers
+import TopologyHelpers
+import numpy as np
+
+def NotebookSweep(_env) :
+    # The sweep loop of learn2RPN.ipynb (with numpy histograms)
+    histo_connected = np.zeros(_env.n_line+1,dtype=np.int64)
+    histo_disconnected = np.zeros(_env.n_line+1,dtype=np.int64)
+    n_connected = 0
+    n_unconnected = 0
+    minimum_cut_disconnected_bitsets = []
+    connected_bitsets = []
+
+    for line_bitset in reversed(range(CommonHelpers.FullyConnectedBitset(_env.n_line) + 1)) :
+        this_nConnected = TopologyHelpers.nConnected(line_bitset,_env.n_line)
+        if TopologyHelpers.ExcludedByBitsetWithFewerDisconnections(line_bitset,minimum_cut_disconnected_bitsets) :
+            histo_disconnected[this_nConnected] += 1
+            n_unconnected += 1
+            continue
+
+        adjacency_matrix = TopologyHelpers.MakeAdjacencyMatrix(_env,n_buses=1,skipExternals=True,lineOnBits=line_bitset)
+        isConnected = TopologyHelpers.IsConnectedManual(adjacency_matrix)
+        n_connected += isConnected
+        n_unconnected += (not isConnected)
+        if not isConnected :
+            histo_disconnected[this_nConnected] += 1
+            TopologyHelpers.AddExcludedBitset(line_bitset,minimum_cut_disconnected_bitsets)
+        else :
+            histo_connected[this_nConnected] += 1
+            connected_bitsets.append(line_bitset)
+
+    return n_connected,n_unconnected,minimum_cut_disconnected_bitsets,connected_bitsets,histo_connected,histo_disconnected
+
+def test_sharded_sweep_matches_notebook() :
+    _env = BenchmarkHelpers.MakeRandomMeshedEnv(7,10,2,3,seed=4)
+    ref = NotebookSweep(_env)
+    for kwargs in [dict(n_workers=1,n_shards=1,seed_cut_size=0),dict(n_workers=1,n_shards=7),dict(n_workers=2,n_shards=3)] :
+        result = SweepHelpers.FindConnectedAndUnconnectedBitsets(_env,**kwargs)
+        assert result[:4] == ref[:4]
+        assert (result[4] == ref[4]).all() and (result[5] == ref[5]).all()
+
+def test_resume_does_not_drop_connected_bitsets(tmp_path) :
+    # Checkpoints made without the list of connected bitsets (store run, or keep_connected_bitsets=False)
+    # must not be resumed into a run that wants the list.
+    _env = BenchmarkHelpers.MakeRandomMeshedEnv(8,13,2,3,seed=0)
+    ref = SweepHelpers.FindConnectedAndUnconnectedBitsets(_env,n_workers=1,n_shards=4)
+    assert len(ref[3]) == ref[0]
+
+    for i,kwargs in enumerate([dict(store_dir=str(tmp_path / 'store')),dict(keep_connected_bitsets=False)]) :
+        checkpoint_dir = str(tmp_path / 'checkpoints{}'.format(i))
+        SweepHelpers.FindConnectedAndUnconnectedBitsets(_env,n_workers=1,n_shards=4,checkpoint_dir=checkpoint_dir,**kwargs)
+        result = SweepHelpers.FindConnectedAndUnconnectedBitsets(_env,n_workers=1,n_shards=4,checkpoint_dir=checkpoint_dir)
+        assert result[:4] == ref[:4]
@@ -0,0 +1,58 @@
+import SweepStoreHelpers
+import math
+import random
+import numpy as np
+import pytest
+
+def MakeStore(directory,n_line,bitsets) :
+    store = SweepStoreHelpers.SweepResultStore(directory,n_line=n_line)
+    store.SetConnected(sorted(bitsets))
+    store.Flush()
+    store.Summarize()
+    return store
+
+def test_set_operations(tmp_path) :
+    n_line = 9
+    rng = random.Random(0)
+    a = set(rng.sample(range(0b1 << n_line),150))
+    b = set(rng.sample(range(0b1 << n_line),150))
+    store_a = MakeStore(str(tmp_path / 'a'),n_line,a)
+    store_b = MakeStore(str(tmp_path / 'b'),n_line,b)
+
+    for name,expected in [('Union',a | b),('Intersection',a & b),('Difference',a - b),('SymmetricDifference',a ^ b)] :
+        combined = getattr(store_a,name)(store_b,str(tmp_path / name))
+        assert list(combined) == sorted(expected,reverse=True)
+        assert len(combined) == len(expected)
+        histo = np.bincount(list(bin(bits).count('1') for bits in expected),minlength=n_line+1)
+        assert (combined.histo_connected == histo).all()
+        binomial = np.array(list(math.comb(n_line,k) for k in range(n_line+1)))
+        assert (combined.histo_disconnected == binomial - histo).all()
+
+def test_reopen(tmp_path) :
+    directory = str(tmp_path / 'store')
+    n_line = 8
+    bitsets = [3,17,64,255]
+    store = SweepStoreHelpers.SweepResultStore(directory,n_line=n_line,signature=[1,2,3])
+    store.SetConnected(bitsets)
+    store.Flush()
+    store.SaveSummary(len(bitsets),(0b1 << n_line) - len(bitsets),[254,127],
+                      np.zeros(n_line+1,dtype=np.int64),np.zeros(n_line+1,dtype=np.int64))
+    del store
+
+    # Reopened without n_line: everything is read back from the directory
+    store = SweepStoreHelpers.SweepResultStore(directory)
+    assert store.n_line == n_line
+    assert list(store) == sorted(bitsets,reverse=True)
+    assert len(store) == len(bitsets)
+    assert list(store.minimum_cut_bitsets) == [254,127]
+    assert list(store.IsConnected([3,4,255])) == [True,False,True]
+    del store
+
+    # Same grid: kept. Another grid: reset.
+    store = SweepStoreHelpers.SweepResultStore(directory,n_line=n_line,signature=[1,2,3])
+    assert store.CountConnected() == len(bitsets)
+    store = SweepStoreHelpers.SweepResultStore(directory,n_line=n_line,signature=[1,2,4])
+    assert store.CountConnected() == 0
+
+    with pytest.raises(IOError) :
+        SweepStoreHelpers.SweepResultStore(str(tmp_path / 'missing'))
@@ -0,0 +1,16 @@
+import BenchmarkHelpers
+import TopoVectHelpers
+import numpy as np
+
+def test_encode_decode_with_empty_substations() :
+    # Substations 1 and 4 (the last one) have no elements
+    lines = [(0,2),(2,3),(3,0)]
+    _env = BenchmarkHelpers.SyntheticEnv('empty_subs',5,lines,[0],[2,3])
+    assert list(_env.sub_info) == [3,0,3,3,0]
+    codec = TopoVectHelpers.TopoVectCodec(_env)
+
+    rng = np.random.default_rng(0)
+    topo_vect = rng.integers(1,3,size=(50,codec.dim_topo)).astype(np.int32)
+    bus_states,line_bits = codec.Encode(topo_vect)
+    assert (bus_states[:,1] == 0).all() and (bus_states[:,4] == 0).all()
+    assert (codec.Decode(bus_states,line_bits) == topo_vect).all()
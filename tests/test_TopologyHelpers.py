@@ -0,0 +1,214 @@
+import BenchmarkHelpers
+import CommonHelpers
+import Substation
+import TopologyHelpers
+import itertools
+import random
+import numpy as np
+
+def test_fingerprint_after_not_executed_bus_config() :
+    # ApplyBusConfig(doNotExecute=True) changes currentBusConfig but not the matrix: the fingerprint
+    # must still describe the matrix, or the connectivity cache returns another topology's components.
+    _env = BenchmarkHelpers.MakeBenchmarkEnv('ieee14')
+    subs = Substation.BuildSubstations(_env)
+    adj = TopologyHelpers.AdjacencyMatrixClass(_env,0b11111111111011111101)
+    adj.EnableConnectivityCache(subs)
+    sub = subs[1]
+    X,Y = 0b111111,0b100011
+
+    sub.ApplyBusConfig(Y,adj)
+    assert adj.GetDisjointSets() == adj.ComputeDisjointSets()
+    sub.ApplyBusConfig(X,adj)
+    assert adj.GetDisjointSets() == adj.ComputeDisjointSets()
+    sub.ApplyBusConfig(Y,adj,doNotExecute=True)
+    sub.ApplyBusConfig(X,adj)
+    assert adj.GetDisjointSets() == adj.ComputeDisjointSets()
+
+    fresh = TopologyHelpers.TopologyFingerprint(subs,adj.n_line,adj.lineOnBits)
+    assert adj.fingerprint.value == fresh.value
+
+def test_fingerprint_rollback() :
+    _env = BenchmarkHelpers.MakeBenchmarkEnv('ieee14')
+    subs = Substation.BuildSubstations(_env)
+    adj = TopologyHelpers.AdjacencyMatrixClass(_env)
+    adj.EnableConnectivityCache(subs)
+    value = adj.fingerprint.value
+    busConfigs = list(adj.fingerprint.busConfigs)
+
+    adj.Savepoint()
+    subs[1].ApplyBusConfig(0b100011,adj)
+    subs[2].ApplyBusConfig(0b1010,adj)
+    assert adj.fingerprint.value != value
+    adj.Rollback()
+    assert adj.fingerprint.value == value
+    assert adj.fingerprint.busConfigs == busConfigs
+
+def CountComponentsWithOutage(adj,_env,outage) :
+    # Number of disjoint sets of the matrix, with the lines in "outage" switched off
+    # (ieee14 has no parallel lines, so every line is one cell of the bus-to-bus block).
+    saved = adj.adjacency_matrix.copy()
+    for lid in outage :
+        a,b = 2*_env.line_or_to_subid[lid],2*_env.line_ex_to_subid[lid]
+        block = adj.adjacency_matrix[a:a+2,b:b+2]
+        i,j = np.argwhere(block == 1)[0]
+        adj.adjacency_matrix[a+i,b+j] = adj.adjacency_matrix[b+j,a+i] = 0
+    n_sets = len(adj.ComputeDisjointSets())
+    adj.adjacency_matrix = saved
+    return n_sets
+
+def test_contingency_screener_brute_force() :
+    # N-1 and N-2 results of the screener against outages of the adjacency matrix, for random
+    # bus-split topologies (and the split of substation 12 that leaves lines 18 and 19 alone on bus 1).
+    _env = BenchmarkHelpers.MakeBenchmarkEnv('ieee14')
+    subs = Substation.BuildSubstations(_env)
+    screener = TopologyHelpers.ContingencyScreener(_env)
+    rng = random.Random(1)
+
+    topologies = [{12 : 0b1010}]
+    for i in range(6) :
+        split = dict()
+        for sub in rng.sample(subs,3) :
+            split[sub.index] = rng.choice(sorted(sub.ValidBusStates()))
+        topologies.append(split)
+
+    for split in topologies :
+        for sub in subs :
+            sub.ResetBusConfig()
+        adj = TopologyHelpers.AdjacencyMatrixClass(_env)
+        for index,bits in split.items() :
+            subs[index].ApplyBusConfig(bits,adj)
+        assert all(subs[index].currentBusConfig == bits for index,bits in split.items())
+
+        n_sets = CountComponentsWithOutage(adj,_env,[])
+        n1_lines = list(lid for lid in range(_env.n_line) if CountComponentsWithOutage(adj,_env,[lid]) > n_sets)
+        n2_bitsets = list((0b1 << a) | (0b1 << b) for a,b in itertools.combinations(range(_env.n_line),2)
+                          if a not in n1_lines and b not in n1_lines and CountComponentsWithOutage(adj,_env,[a,b]) > n_sets)
+
+        n1_bitset,screened_n2 = screener.ScreenAdjacencyMatrixClass(adj,subs)
+        assert n1_bitset == sum(0b1 << lid for lid in n1_lines)
+        assert sorted(screened_n2) == sorted(n2_bitsets)
+
+    for sub in subs :
+        sub.ResetBusConfig()
+
+def test_top_sparsest_cuts_ties() :
+    # Ties in the key go to the highest bitset, whatever the order of the stream
+    _env = BenchmarkHelpers.MakeBenchmarkEnv('ieee14')
+    cut_bitsets,set_sizes = TopologyHelpers.FindMinimalCutBitsets(_env,max_cut_size=3)
+    properties = TopologyHelpers.GetCutProperties(_env,cut_bitsets)
+    rng = random.Random(0)
+    for key in ['sparsity','edge_expansion'] :
+        ref = sorted(zip(properties[key].tolist(),properties['bits'].tolist()),key=lambda a : (a[0],-a[1]))
+        for k in [3,4,6] :
+            for i in range(10) :
+                rng.shuffle(cut_bitsets)
+                top = TopologyHelpers.TopSparsestCuts(_env,cut_bitsets,k=k,key=key,batch_size=8)
+                assert list(zip(top[key].tolist(),top['bits'].tolist())) == ref[:k]
+
+def test_rollback_restores_repeated_cells() :
+    # The same cells are changed several times under one savepoint: rolling back restores
+    # the oldest value, for both matrix classes.
+    _env = BenchmarkHelpers.MakeBenchmarkEnv('ieee14')
+    subs = Substation.BuildSubstations(_env)
+    for matrix_class in [TopologyHelpers.AdjacencyMatrixClass,TopologyHelpers.PackedAdjacencyMatrixClass] :
+        adj = matrix_class(_env)
+        adj.SetEntries([0,0,0],[2,2,2],[0,1,0])
+        assert adj.GetEntry(0,2) == 0
+        adj.SetEntries([0,0,0],[2,2,2],[0,0,1])
+        assert adj.GetEntry(0,2) == 1
+
+        original = adj.adjacency_matrix.copy()
+        adj.Savepoint()
+        subs[1].ApplyBusConfig(0b111010,adj)
+        adj.Savepoint()
+        subs[1].ApplyBusConfig(0b110101,adj)
+        subs[3].ApplyBusConfig(0b111001,adj)
+        adj.Commit()
+        subs[1].ApplyBusConfig(0b111001,adj)
+        assert not (adj.adjacency_matrix == original).all()
+        adj.Rollback()
+        assert (adj.adjacency_matrix == original).all()
+        for sub in subs :
+            sub.ResetBusConfig()
+
+def BreadthFirstDisjointSets(adj_matrix,unused_buses) :
+    # Reference for GetDisjointSets: breadth-first search from the lowest vertex that was not
+    # reached yet (unused buses are not reported)
+    traversed = set(unused_buses)
+    disjoint_sets = dict()
+    for start in range(len(adj_matrix)) :
+        if start in traversed :
+            continue
+        component = set([start])
+        frontier = [start]
+        while frontier :
+            next_frontier = []
+            for i in frontier :
+                for j in np.flatnonzero(adj_matrix[i] == 1).tolist() :
+                    if j not in component :
+                        component.add(j)
+                        next_frontier.append(j)
+            frontier = next_frontier
+        traversed |= component
+        disjoint_sets[start] = component
+    return disjoint_sets
+
+def test_union_find_matches_breadth_first_search() :
+    _env = BenchmarkHelpers.MakeBenchmarkEnv('ieee14')
+    subs = Substation.BuildSubstations(_env)
+    rng = random.Random(2)
+    for i in range(40) :
+        lineOnBits = CommonHelpers.FullyConnectedBitset(_env.n_line)
+        for lid in rng.sample(range(_env.n_line),rng.randrange(6)) :
+            lineOnBits -= (0b1 << lid)
+        adj = TopologyHelpers.AdjacencyMatrixClass(_env,lineOnBits)
+        for sub in rng.sample(subs,3) :
+            sub.ApplyBusConfig(rng.choice(sorted(sub.ValidBusStates(lineOnBits))),adj)
+
+        matrix = adj.adjacency_matrix
+        unused = adj.FindFullyDisconnectedBuses()
+        ref = BreadthFirstDisjointSets(matrix,unused)
+        assert TopologyHelpers.GetDisjointSets(matrix,unused_buses=unused) == ref
+        assert TopologyHelpers.IsConnectedManual(matrix,unused_buses=unused) == (len(ref) == 1)
+        for sub in subs :
+            sub.ResetBusConfig()
+
+    # Connectivity straight from the line bitset (no matrix), on the substation graph
+    builder = TopologyHelpers.AdjacencyMatrixBuilder(_env,n_buses=1,skipExternals=True)
+    for i in range(200) :
+        lineOnBits = rng.getrandbits(_env.n_line)
+        matrix = TopologyHelpers.MakeAdjacencyMatrix(_env,n_buses=1,skipExternals=True,lineOnBits=lineOnBits)
+        assert builder.IsConnected(lineOnBits) == (len(BreadthFirstDisjointSets(matrix,[])) == 1)
+
+def test_minimal_cuts_brute_force() :
+    # Every set of up to max_cut_size lines that disconnects the substation graph, while none of
+    # its subsets does (as lineOnBits, highest first), with the sizes of the disjoint sets.
+    for _env,max_cut_size in [(BenchmarkHelpers.MakeBenchmarkEnv('ieee14'),3),
+                              (BenchmarkHelpers.MakeRandomMeshedEnv(12,17,3,5,seed=3),4)] :
+        all_on = CommonHelpers.FullyConnectedBitset(_env.n_line)
+
+        def DisjointSets(cut) :
+            lineOnBits = all_on - sum(0b1 << lid for lid in cut)
+            matrix = TopologyHelpers.MakeAdjacencyMatrix(_env,n_buses=1,skipExternals=True,lineOnBits=lineOnBits)
+            return BreadthFirstDisjointSets(matrix,[])
+
+        disconnecting = set()
+        ref_bitsets = []
+        ref_set_sizes = dict()
+        for size in range(1,max_cut_size+1) :
+            for cut in itertools.combinations(range(_env.n_line),size) :
+                if any(sub_cut in disconnecting for sub_cut in itertools.combinations(cut,size-1)) :
+                    disconnecting.add(cut)
+                    continue
+                disjoint_sets = DisjointSets(cut)
+                if len(disjoint_sets) > 1 :
+                    disconnecting.add(cut)
+                    bits = all_on - sum(0b1 << lid for lid in cut)
+                    ref_bitsets.append(bits)
+                    ref_set_sizes[bits] = list(len(disjoint_sets[k]) for k in sorted(disjoint_sets))
+        ref_bitsets.sort(reverse=True)
+
+        bitsets,set_sizes = TopologyHelpers.FindMinimalCutBitsets(_env,max_cut_size=max_cut_size)
+        assert len(ref_bitsets) > 0
+        assert bitsets == ref_bitsets
+        assert set_sizes == list(ref_set_sizes[bits] for bits in ref_bitsets)